@@ -2,124 +2,165 @@
 Aplikacja webowa do przeglądania wartości kalorycznych produktów.
 """
 
+import base64
+import hashlib
+import hmac
+import json
 import os
+import threading
+import time
 import requests
+from collections import OrderedDict
+from datetime import date, timedelta
+from concurrent.futures import ThreadPoolExecutor, wait
 from functools import wraps
-from flask import Flask, render_template, jsonify, request, session, redirect, url_for
-from kalorie import sprawdz_uzytkownika, init_db, get_connection
+from flask import Flask, render_template, jsonify, request, session, redirect, url_for, g
+from werkzeug.middleware.proxy_fix import ProxyFix
+from kalorie import (sprawdz_uzytkownika, ZaDuzoProb, KolejkaPelna, migruj, get_connection, znajdz_produkty,
+                     pobierz_z_cache, zapisz_w_cache, rozmiar_cache, pobierz_produkty, przelicz_porcje,
+                     SKLADNIKI, normalizuj, wersja_produktow,
+                     dodaj_do_dziennika, usun_z_dziennika, wpisy_dziennika, podsumowanie_dziennika,
+                     zapisz_produkty, przegladaj_produkty, popularnosc_produktow, normalizuj_kod,
+                     produkt_po_kodzie, pobierz_zeton)
+from indeks import IndeksPrzyblizony
+from produkty_lokalne import dane_lokalne
+from openfoodfacts import KlientOpenFoodFacts, LimitPrzekroczony, WspolneZapytania, produkt_z_off
+from metryki import rejestr, mierzona, zacznij_pomiar, w_kontekscie, server_timing
 
 app = Flask(__name__)
 app.secret_key = os.environ.get('SECRET_KEY', 'dev-secret-key-change-in-production')
 
-# Inicjalizuj bazę danych przy starcie
-init_db()
-
-# Lokalna baza podstawowych produktów (na 100g)
-PRODUKTY_LOKALNE = [
-    # Owoce
-    {'id': 'lok_jablko', 'nazwa': 'Jabłko', 'kalorie': 52, 'bialko': 0.3, 'weglowodany': 14, 'tluszcze': 0.2},
-    {'id': 'lok_banan', 'nazwa': 'Banan', 'kalorie': 89, 'bialko': 1.1, 'weglowodany': 23, 'tluszcze': 0.3},
-    {'id': 'lok_pomarancza', 'nazwa': 'Pomarańcza', 'kalorie': 47, 'bialko': 0.9, 'weglowodany': 12, 'tluszcze': 0.1},
-    {'id': 'lok_gruszka', 'nazwa': 'Gruszka', 'kalorie': 57, 'bialko': 0.4, 'weglowodany': 15, 'tluszcze': 0.1},
-    {'id': 'lok_truskawka', 'nazwa': 'Truskawki', 'kalorie': 32, 'bialko': 0.7, 'weglowodany': 8, 'tluszcze': 0.3},
-    {'id': 'lok_winogrono', 'nazwa': 'Winogrona', 'kalorie': 69, 'bialko': 0.7, 'weglowodany': 18, 'tluszcze': 0.2},
-    {'id': 'lok_arbuz', 'nazwa': 'Arbuz', 'kalorie': 30, 'bialko': 0.6, 'weglowodany': 8, 'tluszcze': 0.2},
-    {'id': 'lok_brzoskwinia', 'nazwa': 'Brzoskwinia', 'kalorie': 39, 'bialko': 0.9, 'weglowodany': 10, 'tluszcze': 0.3},
-    {'id': 'lok_sliwka', 'nazwa': 'Śliwka', 'kalorie': 46, 'bialko': 0.7, 'weglowodany': 11, 'tluszcze': 0.3},
-    {'id': 'lok_kiwi', 'nazwa': 'Kiwi', 'kalorie': 61, 'bialko': 1.1, 'weglowodany': 15, 'tluszcze': 0.5},
-    {'id': 'lok_mandarynka', 'nazwa': 'Mandarynka', 'kalorie': 53, 'bialko': 0.8, 'weglowodany': 13, 'tluszcze': 0.3},
-    {'id': 'lok_malina', 'nazwa': 'Maliny', 'kalorie': 52, 'bialko': 1.2, 'weglowodany': 12, 'tluszcze': 0.7},
-    {'id': 'lok_borowka', 'nazwa': 'Borówki', 'kalorie': 57, 'bialko': 0.7, 'weglowodany': 14, 'tluszcze': 0.3},
-    {'id': 'lok_wisnia', 'nazwa': 'Wiśnie', 'kalorie': 50, 'bialko': 1.0, 'weglowodany': 12, 'tluszcze': 0.3},
-    {'id': 'lok_melon', 'nazwa': 'Melon', 'kalorie': 34, 'bialko': 0.8, 'weglowodany': 8, 'tluszcze': 0.2},
-    {'id': 'lok_ananas', 'nazwa': 'Ananas', 'kalorie': 50, 'bialko': 0.5, 'weglowodany': 13, 'tluszcze': 0.1},
-    {'id': 'lok_mango', 'nazwa': 'Mango', 'kalorie': 60, 'bialko': 0.8, 'weglowodany': 15, 'tluszcze': 0.4},
-    {'id': 'lok_awokado', 'nazwa': 'Awokado', 'kalorie': 160, 'bialko': 2.0, 'weglowodany': 9, 'tluszcze': 15},
-    {'id': 'lok_cytryna', 'nazwa': 'Cytryna', 'kalorie': 29, 'bialko': 1.1, 'weglowodany': 9, 'tluszcze': 0.3},
-    {'id': 'lok_grejpfrut', 'nazwa': 'Grejpfrut', 'kalorie': 42, 'bialko': 0.8, 'weglowodany': 11, 'tluszcze': 0.1},
-
-    # Warzywa
-    {'id': 'lok_marchew', 'nazwa': 'Marchew', 'kalorie': 41, 'bialko': 0.9, 'weglowodany': 10, 'tluszcze': 0.2},
-    {'id': 'lok_ziemniak', 'nazwa': 'Ziemniak', 'kalorie': 77, 'bialko': 2.0, 'weglowodany': 17, 'tluszcze': 0.1},
-    {'id': 'lok_pomidor', 'nazwa': 'Pomidor', 'kalorie': 18, 'bialko': 0.9, 'weglowodany': 3.9, 'tluszcze': 0.2},
-    {'id': 'lok_ogorek', 'nazwa': 'Ogórek', 'kalorie': 15, 'bialko': 0.7, 'weglowodany': 3.6, 'tluszcze': 0.1},
-    {'id': 'lok_cebula', 'nazwa': 'Cebula', 'kalorie': 40, 'bialko': 1.1, 'weglowodany': 9, 'tluszcze': 0.1},
-    {'id': 'lok_czosnek', 'nazwa': 'Czosnek', 'kalorie': 149, 'bialko': 6.4, 'weglowodany': 33, 'tluszcze': 0.5},
-    {'id': 'lok_papryka', 'nazwa': 'Papryka', 'kalorie': 31, 'bialko': 1.0, 'weglowodany': 6, 'tluszcze': 0.3},
-    {'id': 'lok_salata', 'nazwa': 'Sałata', 'kalorie': 15, 'bialko': 1.4, 'weglowodany': 2.9, 'tluszcze': 0.2},
-    {'id': 'lok_kapusta', 'nazwa': 'Kapusta', 'kalorie': 25, 'bialko': 1.3, 'weglowodany': 6, 'tluszcze': 0.1},
-    {'id': 'lok_brокuly', 'nazwa': 'Brokuły', 'kalorie': 34, 'bialko': 2.8, 'weglowodany': 7, 'tluszcze': 0.4},
-    {'id': 'lok_kalafior', 'nazwa': 'Kalafior', 'kalorie': 25, 'bialko': 1.9, 'weglowodany': 5, 'tluszcze': 0.3},
-    {'id': 'lok_szpinak', 'nazwa': 'Szpinak', 'kalorie': 23, 'bialko': 2.9, 'weglowodany': 3.6, 'tluszcze': 0.4},
-    {'id': 'lok_burak', 'nazwa': 'Burak', 'kalorie': 43, 'bialko': 1.6, 'weglowodany': 10, 'tluszcze': 0.2},
-    {'id': 'lok_cukinia', 'nazwa': 'Cukinia', 'kalorie': 17, 'bialko': 1.2, 'weglowodany': 3.1, 'tluszcze': 0.3},
-    {'id': 'lok_baklazan', 'nazwa': 'Bakłażan', 'kalorie': 25, 'bialko': 1.0, 'weglowodany': 6, 'tluszcze': 0.2},
-    {'id': 'lok_pieczarka', 'nazwa': 'Pieczarki', 'kalorie': 22, 'bialko': 3.1, 'weglowodany': 3.3, 'tluszcze': 0.3},
-    {'id': 'lok_por', 'nazwa': 'Por', 'kalorie': 61, 'bialko': 1.5, 'weglowodany': 14, 'tluszcze': 0.3},
-    {'id': 'lok_seler', 'nazwa': 'Seler', 'kalorie': 16, 'bialko': 0.7, 'weglowodany': 3, 'tluszcze': 0.2},
-    {'id': 'lok_rzodkiewka', 'nazwa': 'Rzodkiewka', 'kalorie': 16, 'bialko': 0.7, 'weglowodany': 3.4, 'tluszcze': 0.1},
-    {'id': 'lok_dynia', 'nazwa': 'Dynia', 'kalorie': 26, 'bialko': 1.0, 'weglowodany': 7, 'tluszcze': 0.1},
-
-    # Mięso
-    {'id': 'lok_kurczak_piersi', 'nazwa': 'Pierś z kurczaka', 'kalorie': 165, 'bialko': 31, 'weglowodany': 0, 'tluszcze': 3.6},
-    {'id': 'lok_kurczak_udo', 'nazwa': 'Udo z kurczaka', 'kalorie': 209, 'bialko': 26, 'weglowodany': 0, 'tluszcze': 11},
-    {'id': 'lok_wolowina', 'nazwa': 'Wołowina (chuda)', 'kalorie': 250, 'bialko': 26, 'weglowodany': 0, 'tluszcze': 15},
-    {'id': 'lok_wieprzowina', 'nazwa': 'Wieprzowina (schab)', 'kalorie': 242, 'bialko': 27, 'weglowodany': 0, 'tluszcze': 14},
-    {'id': 'lok_mieso_mielone', 'nazwa': 'Mięso mielone wołowe', 'kalorie': 254, 'bialko': 17, 'weglowodany': 0, 'tluszcze': 20},
-    {'id': 'lok_indyk', 'nazwa': 'Indyk (pierś)', 'kalorie': 135, 'bialko': 30, 'weglowodany': 0, 'tluszcze': 1},
-    {'id': 'lok_kaczka', 'nazwa': 'Kaczka', 'kalorie': 337, 'bialko': 19, 'weglowodany': 0, 'tluszcze': 28},
-    {'id': 'lok_boczek', 'nazwa': 'Boczek', 'kalorie': 541, 'bialko': 37, 'weglowodany': 1.4, 'tluszcze': 42},
-    {'id': 'lok_szynka', 'nazwa': 'Szynka', 'kalorie': 145, 'bialko': 21, 'weglowodany': 1.5, 'tluszcze': 6},
-    {'id': 'lok_kielbasa', 'nazwa': 'Kiełbasa', 'kalorie': 301, 'bialko': 12, 'weglowodany': 2, 'tluszcze': 27},
-
-    # Ryby
-    {'id': 'lok_losos', 'nazwa': 'Łosoś', 'kalorie': 208, 'bialko': 20, 'weglowodany': 0, 'tluszcze': 13},
-    {'id': 'lok_tunczyk', 'nazwa': 'Tuńczyk', 'kalorie': 132, 'bialko': 28, 'weglowodany': 0, 'tluszcze': 1},
-    {'id': 'lok_dorsz', 'nazwa': 'Dorsz', 'kalorie': 82, 'bialko': 18, 'weglowodany': 0, 'tluszcze': 0.7},
-    {'id': 'lok_pstrag', 'nazwa': 'Pstrąg', 'kalorie': 119, 'bialko': 20, 'weglowodany': 0, 'tluszcze': 3.5},
-    {'id': 'lok_sledz', 'nazwa': 'Śledź', 'kalorie': 158, 'bialko': 18, 'weglowodany': 0, 'tluszcze': 9},
-    {'id': 'lok_makrela', 'nazwa': 'Makrela', 'kalorie': 205, 'bialko': 19, 'weglowodany': 0, 'tluszcze': 14},
-    {'id': 'lok_krewetki', 'nazwa': 'Krewetki', 'kalorie': 99, 'bialko': 24, 'weglowodany': 0.2, 'tluszcze': 0.3},
-
-    # Nabiał
-    {'id': 'lok_mleko', 'nazwa': 'Mleko 2%', 'kalorie': 50, 'bialko': 3.4, 'weglowodany': 4.8, 'tluszcze': 2},
-    {'id': 'lok_mleko_pelne', 'nazwa': 'Mleko 3.2%', 'kalorie': 60, 'bialko': 3.2, 'weglowodany': 4.7, 'tluszcze': 3.2},
-    {'id': 'lok_jogurt', 'nazwa': 'Jogurt naturalny', 'kalorie': 61, 'bialko': 3.5, 'weglowodany': 4.7, 'tluszcze': 3.3},
-    {'id': 'lok_jogurt_grecki', 'nazwa': 'Jogurt grecki', 'kalorie': 97, 'bialko': 9, 'weglowodany': 3.6, 'tluszcze': 5},
-    {'id': 'lok_ser_zolty', 'nazwa': 'Ser żółty (gouda)', 'kalorie': 356, 'bialko': 25, 'weglowodany': 2.2, 'tluszcze': 27},
-    {'id': 'lok_ser_bialy', 'nazwa': 'Ser biały (twaróg)', 'kalorie': 98, 'bialko': 11, 'weglowodany': 3.4, 'tluszcze': 4.3},
-    {'id': 'lok_ser_feta', 'nazwa': 'Ser feta', 'kalorie': 264, 'bialko': 14, 'weglowodany': 4.1, 'tluszcze': 21},
-    {'id': 'lok_ser_mozzarella', 'nazwa': 'Mozzarella', 'kalorie': 280, 'bialko': 28, 'weglowodany': 3.1, 'tluszcze': 17},
-    {'id': 'lok_maslo', 'nazwa': 'Masło', 'kalorie': 717, 'bialko': 0.9, 'weglowodany': 0.1, 'tluszcze': 81},
-    {'id': 'lok_smietana', 'nazwa': 'Śmietana 18%', 'kalorie': 188, 'bialko': 2.6, 'weglowodany': 3.5, 'tluszcze': 18},
-    {'id': 'lok_jajko', 'nazwa': 'Jajko kurze', 'kalorie': 155, 'bialko': 13, 'weglowodany': 1.1, 'tluszcze': 11},
-
-    # Pieczywo i zboża
-    {'id': 'lok_chleb_pszenny', 'nazwa': 'Chleb pszenny', 'kalorie': 265, 'bialko': 9, 'weglowodany': 49, 'tluszcze': 3.2},
-    {'id': 'lok_chleb_zytni', 'nazwa': 'Chleb żytni', 'kalorie': 259, 'bialko': 8.5, 'weglowodany': 48, 'tluszcze': 3.3},
-    {'id': 'lok_chleb_pelnoziarnisty', 'nazwa': 'Chleb pełnoziarnisty', 'kalorie': 247, 'bialko': 13, 'weglowodany': 41, 'tluszcze': 4.2},
-    {'id': 'lok_bulka', 'nazwa': 'Bułka pszenna', 'kalorie': 276, 'bialko': 8, 'weglowodany': 53, 'tluszcze': 2.5},
-    {'id': 'lok_ryz_bialy', 'nazwa': 'Ryż biały (gotowany)', 'kalorie': 130, 'bialko': 2.7, 'weglowodany': 28, 'tluszcze': 0.3},
-    {'id': 'lok_ryz_brazowy', 'nazwa': 'Ryż brązowy (gotowany)', 'kalorie': 111, 'bialko': 2.6, 'weglowodany': 23, 'tluszcze': 0.9},
-    {'id': 'lok_makaron', 'nazwa': 'Makaron (gotowany)', 'kalorie': 131, 'bialko': 5, 'weglowodany': 25, 'tluszcze': 1.1},
-    {'id': 'lok_kasza_gryczana', 'nazwa': 'Kasza gryczana (gotowana)', 'kalorie': 92, 'bialko': 3.4, 'weglowodany': 20, 'tluszcze': 0.6},
-    {'id': 'lok_kasza_jaglana', 'nazwa': 'Kasza jaglana (gotowana)', 'kalorie': 119, 'bialko': 3.5, 'weglowodany': 23, 'tluszcze': 1},
-    {'id': 'lok_platki_owsiane', 'nazwa': 'Płatki owsiane', 'kalorie': 389, 'bialko': 17, 'weglowodany': 66, 'tluszcze': 7},
-    {'id': 'lok_maka_pszenna', 'nazwa': 'Mąka pszenna', 'kalorie': 364, 'bialko': 10, 'weglowodany': 76, 'tluszcze': 1},
-
-    # Tłuszcze i oleje
-    {'id': 'lok_olej_rzepakowy', 'nazwa': 'Olej rzepakowy', 'kalorie': 884, 'bialko': 0, 'weglowodany': 0, 'tluszcze': 100},
-    {'id': 'lok_oliwa', 'nazwa': 'Oliwa z oliwek', 'kalorie': 884, 'bialko': 0, 'weglowodany': 0, 'tluszcze': 100},
-    {'id': 'lok_olej_slonecznikowy', 'nazwa': 'Olej słonecznikowy', 'kalorie': 884, 'bialko': 0, 'weglowodany': 0, 'tluszcze': 100},
-
-    # Inne
-    {'id': 'lok_miod', 'nazwa': 'Miód', 'kalorie': 304, 'bialko': 0.3, 'weglowodany': 82, 'tluszcze': 0},
-    {'id': 'lok_cukier', 'nazwa': 'Cukier', 'kalorie': 387, 'bialko': 0, 'weglowodany': 100, 'tluszcze': 0},
-    {'id': 'lok_czekolada', 'nazwa': 'Czekolada mleczna', 'kalorie': 535, 'bialko': 8, 'weglowodany': 59, 'tluszcze': 30},
-    {'id': 'lok_orzechy_wloskie', 'nazwa': 'Orzechy włoskie', 'kalorie': 654, 'bialko': 15, 'weglowodany': 14, 'tluszcze': 65},
-    {'id': 'lok_migdaly', 'nazwa': 'Migdały', 'kalorie': 579, 'bialko': 21, 'weglowodany': 22, 'tluszcze': 50},
-    {'id': 'lok_orzeszki_ziemne', 'nazwa': 'Orzeszki ziemne', 'kalorie': 567, 'bialko': 26, 'weglowodany': 16, 'tluszcze': 49},
-]
+# Liczba zaufanych proxy przed aplikacją (np. 1 na Renderze) - adres klienta, na który
+# liczymy nieudane logowania, jest wtedy brany z nagłówka X-Forwarded-For
+ZAUFANE_PROXY = int(os.environ.get('ZAUFANE_PROXY', 0))
+if ZAUFANE_PROXY:
+    app.wsgi_app = ProxyFix(app.wsgi_app, x_for=ZAUFANE_PROXY)
+
+# Schemat bazy aktualizuje `python kalorie.py migruj` przy wdrożeniu - przy aktualnej
+# bazie to tylko odczyt jej wersji (a przy pierwszym uruchomieniu lokalnie - migracje)
+migruj()
+
+# Maksymalna liczba pozycji w jednym zapytaniu /api/oblicz
+MAKS_POZYCJI = 1000
+
+# Maksymalna liczba produktów w jednym zapisie zbiorczym /api/zapisz
+MAKS_ZAPISU = 5000
+
+# Domyślna i największa liczba produktów na stronie /api/produkty
+STRONA_PRODUKTOW = 50
+MAKS_STRONA_PRODUKTOW = 500
+
+# Domyślna i największa liczba zamienników zwracanych przez /api/zamienniki
+ZAMIENNIKI = 10
+MAKS_ZAMIENNIKOW = 100
+
+# Najdłuższy okres podsumowania dziennika (dni)
+MAKS_DNI_DZIENNIKA = 366
+
+# Po jakim czasie odpowiedź Open Food Facts z cache uznajemy za nieaktualną
+CACHE_API_TTL = int(os.environ.get('CACHE_API_TTL', 6 * 3600))
+# Krótszy timeout, gdy w razie awarii mamy czym odpowiedzieć (przeterminowany wpis)
+API_TIMEOUT = 5
+API_TIMEOUT_Z_ZAPASEM = 2
+
+# Klient Open Food Facts z pulą połączeń (jeden na proces workera)
+klient_off = KlientOpenFoodFacts(timeout=API_TIMEOUT)
+
+# Limity zapytań do Open Food Facts na minutę, wspólne dla wszystkich workerów (zasady
+# publicznego API: 10 wyszukiwań i 100 odczytów produktu); 0 = bez limitu. Po wyczerpaniu
+# limitu odpowiadamy bez wyników online (albo z przeterminowanego cache), a nie czekamy.
+LIMITY_API = {
+    'szukaj': float(os.environ.get('LIMIT_API_SZUKAJ', 10)),
+    'produkt': float(os.environ.get('LIMIT_API_PRODUKT', 100)),
+}
+
+# Po imporcie pełnego katalogu (import_off.py) można wyłączyć zapytania do API
+SZUKAJ_ONLINE = os.environ.get('SZUKAJ_ONLINE', '1') != '0'
+
+# Łączny limit czasu /api/szukaj - po nim zwracamy to, co zdążyło przyjść
+SZUKAJ_LIMIT_CZASU = float(os.environ.get('SZUKAJ_LIMIT_CZASU', 3))
+
+# Wątki odpytujące Open Food Facts - baza SQLite odpowiada w ułamku milisekundy
+# i jest przeszukiwana od razu, więc wolne API nie wstrzymuje jej wyników
+pula_wyszukiwania = ThreadPoolExecutor(max_workers=8, thread_name_prefix='szukaj')
+
+ZRODLA = ('lokalne', 'baza', 'online')
+MAKS_WYNIKOW = 25
+LIMIT_BAZY = 20
+
+# Wyniki wyszukiwania w bazie: (znormalizowane zapytanie, wersja produktów) -> lista
+CACHE_WYNIKOW_ROZMIAR = 1000
+cache_wynikow = OrderedDict()
+_cache_wynikow_lock = threading.Lock()
+
+# Indeks nazw z listy lokalnej i bazy do wyszukiwania z literówkami (indeks_przyblizony),
+# budowany we własnym wątku - nie czeka w kolejce za zapytaniami do API
+_indeks_przyblizony = None
+_przebudowa_indeksu = False
+# Najmniejszy odstęp (s) między przebudowami - przy częstych zapisach (import, dodawanie
+# produktów) indeks jest budowany raz na ten czas, a nie po każdej zmianie
+PRZEBUDOWA_INDEKSU_CO = float(os.environ.get('PRZEBUDOWA_INDEKSU_CO', 30))
+_ostatnia_przebudowa = None
+_indeks_przyblizony_lock = threading.Lock()
+pula_indeksu = ThreadPoolExecutor(max_workers=1, thread_name_prefix='indeks')
+
+# Liczniki cache API (w obrębie jednego procesu workera)
+statystyki_cache = {'trafienia': 0, 'chybienia': 0, 'przeterminowane': 0, 'wspolne': 0, 'limit': 0}
+_statystyki_cache_lock = threading.Lock()
+
+
+def policz_cache(rodzaj):
+    """Zwiększa licznik cache API."""
+    with _statystyki_cache_lock:
+        statystyki_cache[rodzaj] += 1
+    rejestr.zwieksz('kalorie_cache_api_total', rodzaj=rodzaj)
+
+
+# Równoległe chybienia cache z tym samym kluczem czekają na jedno zapytanie do API
+wspolne_zapytania_api = WspolneZapytania(przy_dolaczeniu=lambda: policz_cache('wspolne'))
+
+
+# Klucze, pod którymi asgi.py przekazuje w scope pobrane już odpowiedzi API i ich czasy
+ODPOWIEDZI_API_ASGI = 'kalorie.odpowiedzi_api'
+POMIARY_ASGI = 'kalorie.pomiary'
+
+# /metrics odpowiada zalogowanym i z tokenem (nagłówek "Authorization: Bearer ...");
+# wszystkim tylko po jawnym włączeniu METRYKI_PUBLICZNE=1 (np. za siecią wewnętrzną)
+METRYKI_TOKEN = os.environ.get('METRYKI_TOKEN', '')
+METRYKI_PUBLICZNE = os.environ.get('METRYKI_PUBLICZNE', '0') == '1'
+
+
+@app.before_request
+def zacznij_mierzenie():
+    """Zapamiętuje początek zapytania i zaczyna zbierać czasy operacji."""
+    g.start = time.perf_counter()
+    g.pomiary = zacznij_pomiar()
+    # Czasy zmierzone przez serwer ASGI przed przekazaniem zapytania (asgi.py)
+    g.pomiary.extend(request.environ.get('asgi.scope', {}).get(POMIARY_ASGI, ()))
+
+
+@app.after_request
+def zapisz_czas_zapytania(odpowiedz):
+    """Zapisuje czas i status zapytania w metrykach i dodaje nagłówek Server-Timing."""
+    start = g.get('start')
+    if start is None:
+        return odpowiedz
+    czas = time.perf_counter() - start
+    endpoint = request.endpoint or 'brak'
+    rejestr.obserwuj('kalorie_zapytanie_sekundy', czas, endpoint=endpoint)
+    rejestr.zwieksz('kalorie_zapytania_total', endpoint=endpoint, status=odpowiedz.status_code)
+    odpowiedz.headers['Server-Timing'] = server_timing(g.pomiary, czas)
+    return odpowiedz
+
+
+@app.route('/metrics')
+def metryki():
+    """Metryki workera w formacie tekstowym Prometheusa."""
+    z_tokenem = bool(METRYKI_TOKEN) and hmac.compare_digest(
+        request.headers.get('Authorization', '').encode(), f'Bearer {METRYKI_TOKEN}'.encode())
+    if not (METRYKI_PUBLICZNE or z_tokenem or 'zalogowany' in session):
+        return 'Brak dostępu\n', 401, {'Content-Type': 'text/plain; charset=utf-8'}
+    return rejestr.tekst(), 200, {'Content-Type': 'text/plain; version=0.0.4; charset=utf-8'}
 
 
 def wymaga_logowania(f):
@@ -143,13 +184,18 @@ def login():
         login_input = request.form.get('login', '')
         haslo = request.form.get('haslo', '')
 
-        if sprawdz_uzytkownika(login_input, haslo):
-            session['zalogowany'] = True
-            session['uzytkownik'] = login_input
-            session['jest_gosciem'] = (login_input == 'Gość')
-            return redirect(url_for('index'))
-        else:
-            error = 'Nieprawidłowy login lub hasło'
+        try:
+            if sprawdz_uzytkownika(login_input, haslo, request.remote_addr):
+                session['zalogowany'] = True
+                session['uzytkownik'] = login_input
+                session['jest_gosciem'] = (login_input == 'Gość')
+                return redirect(url_for('index'))
+            else:
+                error = 'Nieprawidłowy login lub hasło'
+        except ZaDuzoProb:
+            return render_template('login.html', error='Zbyt wiele nieudanych prób. Spróbuj za kilka minut.'), 429
+        except KolejkaPelna:
+            return render_template('login.html', error='Serwer jest przeciążony. Spróbuj ponownie za chwilę.'), 503
 
     return render_template('login.html', error=error)
 
@@ -170,195 +216,738 @@ def index():
                            jest_gosciem=session.get('jest_gosciem', False))
 
 
-def usun_polskie_znaki(tekst):
-    """Zamienia polskie znaki na łacińskie."""
-    zamiana = {
-        'ą': 'a', 'ć': 'c', 'ę': 'e', 'ł': 'l', 'ń': 'n',
-        'ó': 'o', 'ś': 's', 'ź': 'z', 'ż': 'z',
-        'Ą': 'A', 'Ć': 'C', 'Ę': 'E', 'Ł': 'L', 'Ń': 'N',
-        'Ó': 'O', 'Ś': 'S', 'Ź': 'Z', 'Ż': 'Z'
-    }
-    for pl, lat in zamiana.items():
-        tekst = tekst.replace(pl, lat)
-    return tekst
+def klucz_cache_api(query):
+    """Normalizuje zapytanie do klucza cache (wielkość liter, białe znaki)."""
+    return ' '.join(query.lower().split())
 
 
-def dodaj_polskie_znaki(tekst):
-    """Próbuje dodać polskie znaki do tekstu (heurystyka)."""
-    zamiana = {
-        'a': 'ą', 'c': 'ć', 'e': 'ę', 'l': 'ł', 'n': 'ń',
-        'o': 'ó', 's': 'ś', 'z': 'ż'
-    }
-    warianty = [tekst]
-    # Generuj warianty z polskimi znakami
-    for lat, pl in zamiana.items():
-        if lat in tekst.lower():
-            warianty.append(tekst.replace(lat, pl).replace(lat.upper(), pl.upper()))
-    return warianty
+@mierzona('api')
+def wyszukaj_w_api(query):
+    """Zwraca produkty z Open Food Facts, korzystając z cache odpowiedzi."""
+    klucz = klucz_cache_api(query)
+    return odpowiedz_api_z_cache(klucz, 'szukaj', lambda timeout: klient_off.szukaj(klucz, timeout=timeout))
 
 
-def wyszukaj_w_api(query):
-    """Wysyła zapytanie do Open Food Facts API."""
-    url = 'https://pl.openfoodfacts.org/cgi/search.pl'
-    params = {
-        'search_terms': query,
-        'search_simple': 1,
-        'action': 'process',
-        'json': 1,
-        'page_size': 15,
-        'fields': 'code,product_name,brands,nutriments'
-    }
-    response = requests.get(url, params=params, timeout=5)
-    return response.json().get('products', [])
+@mierzona('api_kod')
+def wyszukaj_kod_w_api(kod):
+    """Zwraca [produkt] o podanym kodzie kreskowym z Open Food Facts (albo []), korzystając z cache.
+
+    Zapamiętywana jest też odpowiedź "brak produktu" - skaner nie pyta API o ten sam nieznany kod.
+    """
+    return odpowiedz_api_z_cache(f'kod:{kod}', 'produkt', lambda timeout: klient_off.produkt(kod, timeout=timeout))
+
+
+def sprawdz_limit_api(rodzaj):
+    """Zabiera żeton z limitu zapytań `rodzaj` (LIMITY_API). Wyczerpany limit -> LimitPrzekroczony."""
+    na_minute = LIMITY_API[rodzaj]
+    if na_minute > 0 and not pobierz_zeton(f'off_{rodzaj}', na_minute / 60, na_minute):
+        policz_cache('limit')
+        raise LimitPrzekroczony(f"Wyczerpany limit zapytań do Open Food Facts ({rodzaj})")
 
 
+def odpowiedz_api_z_cache(klucz, rodzaj, zapytanie):
+    """Odpowiedź API spod klucza cache; `zapytanie(timeout)` pobiera ją z Open Food Facts.
+
+    Świeży wpis z cache jest zwracany bez zapytania do API. Równoległe chybienia tego samego
+    klucza czekają na jedno zapytanie, które zużywa żeton z limitu `rodzaj`. Gdy API
+    nie odpowiada albo limit jest wyczerpany, zwracany jest przeterminowany wpis
+    (jeśli istnieje), w przeciwnym razie błąd.
+    """
+    wpis = pobierz_z_cache(klucz)
+
+    if wpis and wpis[1] < CACHE_API_TTL:
+        policz_cache('trafienia')
+        return wpis[0]
+
+    def pobierz():
+        sprawdz_limit_api(rodzaj)
+        produkty = zapytanie(API_TIMEOUT_Z_ZAPASEM if wpis else API_TIMEOUT)
+        zapisz_w_cache(klucz, produkty)
+        return produkty
+
+    policz_cache('chybienia')
+    try:
+        return wspolne_zapytania_api.wykonaj(klucz, pobierz)
+    except requests.RequestException:
+        if wpis:
+            policz_cache('przeterminowane')
+            return wpis[0]
+        raise
+
+
+@mierzona('lokalne')
 def wyszukaj_lokalne(query):
     """Wyszukuje w lokalnej liście produktów."""
-    query_lower = usun_polskie_znaki(query.lower())
-    wyniki = []
-    for p in PRODUKTY_LOKALNE:
-        nazwa_lower = usun_polskie_znaki(p['nazwa'].lower())
-        if query_lower in nazwa_lower:
-            wyniki.append(p.copy())
-    return wyniki
+    return [p.jako_slownik() for p in dane_lokalne().indeks.szukaj(query)]
+
 
+@mierzona('baza')
+def wyszukaj_w_bazie(query, limit=LIMIT_BAZY):
+    """Wyszukuje w lokalnej bazie SQLite (indeks pełnotekstowy)."""
+    return [produkt_z_bazy(row) for row in znajdz_produkty(query, limit=limit)]
 
-def wyszukaj_w_bazie(query):
-    """Wyszukuje w lokalnej bazie SQLite."""
-    query_lower = f"%{query}%"
-    query_bez_pl = f"%{usun_polskie_znaki(query)}%"
 
-    conn = get_connection()
-    cursor = conn.cursor()
+def produkt_z_bazy(row):
+    """Zamienia wiersz (id, nazwa, kalorie, bialko, weglowodany, tluszcze, kategoria, kod) na produkt odpowiedzi."""
+    return {
+        'id': f'db_{row[0]}',
+        'nazwa': row[1],
+        'kalorie': row[2],
+        'bialko': row[3],
+        'weglowodany': row[4],
+        'tluszcze': row[5],
+        'kod': row[7]
+    }
+
+
+def kod_produktu(produkt):
+    """Znormalizowany kod kreskowy produktu z wyników albo None (brak lub niepoprawny kod)."""
+    try:
+        return normalizuj_kod(produkt.get('kod'))
+    except ValueError:
+        return None
+
+
+def zrodlo_w_indeksie(produkt):
+    """Źródło produktu z indeksu przybliżonego: wiersze bazy to krotki, reszta to lista lokalna."""
+    return 'baza' if isinstance(produkt, tuple) else 'lokalne'
 
-    cursor.execute("""
-        SELECT id, nazwa, kalorie, bialko, weglowodany, tluszcze
-        FROM produkty
-        WHERE nazwa LIKE ? OR nazwa LIKE ?
-        LIMIT 20
-    """, (query_lower, query_bez_pl))
 
+def zbuduj_indeks_przyblizony(wersja):
+    """Buduje indeks nazw listy lokalnej i bazy, z popularnością z dziennika."""
+    popularnosc = popularnosc_produktow()
+    produkty = [(p, p.nazwa, popularnosc.get(p.nazwa, 0)) for p in dane_lokalne().produkty]
+    produkty.extend((row, row[1], popularnosc.get(row[1], 0)) for row in przegladaj_produkty())
+    return IndeksPrzyblizony(produkty, wersja)
+
+
+def przebuduj_indeks_przyblizony(opoznienie=0.0):
+    """Po `opoznienie` s buduje indeks dla aktualnej wersji produktów i podmienia nim poprzedni."""
+    global _indeks_przyblizony, _przebudowa_indeksu, _ostatnia_przebudowa
+    try:
+        time.sleep(opoznienie)
+        _ostatnia_przebudowa = time.monotonic()
+        indeks = zbuduj_indeks_przyblizony(wersja_produktow())
+        with _indeks_przyblizony_lock:
+            _indeks_przyblizony = indeks
+    finally:
+        with _indeks_przyblizony_lock:
+            _przebudowa_indeksu = False
+
+
+def indeks_przyblizony(wersja=None):
+    """Indeks do wyszukiwania z literówkami i poprawiania pisowni fraz albo None.
+
+    Indeks powstaje w tle - pierwszy przy pierwszym użyciu, kolejny po zmianie produktów,
+    najwcześniej PRZEBUDOWA_INDEKSU_CO s po początku poprzedniej budowy (budowa dla dużej
+    bazy trwa dłużej niż zapytanie). Do tego czasu odpowiada poprzedni, a przed zbudowaniem
+    pierwszego - None (bez literówek i poprawiania pisowni).
+    """
+    global _przebudowa_indeksu
+    if wersja is None:
+        wersja = wersja_produktow()
+    indeks = _indeks_przyblizony
+    if indeks is not None and indeks.wersja == wersja:
+        return indeks
+    with _indeks_przyblizony_lock:
+        if not _przebudowa_indeksu:
+            _przebudowa_indeksu = True
+            opoznienie = 0.0
+            if _ostatnia_przebudowa is not None:
+                opoznienie = max(0.0, _ostatnia_przebudowa + PRZEBUDOWA_INDEKSU_CO - time.monotonic())
+            pula_indeksu.submit(przebuduj_indeks_przyblizony, opoznienie)
+        return _indeks_przyblizony
+
+
+@mierzona('przyblizone')
+def wyszukaj_przyblizone(indeks, query, zrodla, limit=MAKS_WYNIKOW + 1):
+    """Wyszukuje z literówkami w liście lokalnej i bazie (ranking wspólny dla obu źródeł)."""
     wyniki = []
-    for row in cursor.fetchall():
-        wyniki.append({
-            'id': f'db_{row[0]}',
-            'nazwa': row[1],
-            'kalorie': row[2],
-            'bialko': row[3],
-            'weglowodany': row[4],
-            'tluszcze': row[5]
-        })
-
-    conn.close()
+    for p in indeks.szukaj(query, limit, filtr=lambda p: zrodlo_w_indeksie(p) in zrodla):
+        if zrodlo_w_indeksie(p) == 'baza':
+            wyniki.append(dict(produkt_z_bazy(p), zrodlo='baza'))
+        else:
+            wyniki.append(dict(p.jako_slownik(), zrodlo='lokalne'))
     return wyniki
 
 
 @app.route('/api/szukaj')
 @wymaga_logowania
 def szukaj_produkty():
-    """Wyszukuje produkty w lokalnej bazie i Open Food Facts API."""
+    """Wyszukuje produkty w lokalnej bazie i Open Food Facts API.
+
+    Parametr `zrodla` (np. "lokalne,baza") ogranicza źródła. Odpowiedź bez źródła
+    "online" zależy tylko od zawartości bazy, więc dostaje ETag i na zapytanie
+    warunkowe z aktualnym ETagiem odpowiadamy 304 bez wyszukiwania.
+
+    Nagłówek X-Obciete-Zrodla wymienia źródła, których wyniki nie zmieściły się
+    w odpowiedzi - dla pozostałych klient może sam zawężać wyniki przy dłuższej frazie.
+    Gdy nazwy z listy lokalnej i bazy nie zawierają frazy, szukamy z literówkami
+    i ustawiamy nagłówek X-Przyblizone - takich wyników klient nie zawęża. Dopóki
+    indeks literówek nie jest zbudowany dla aktualnej wersji produktów, odpowiedź
+    bez trafień nie dostaje ETagu.
+
+    Uruchomiona przez asgi.py dostaje odpowiedzi API pobrane już asynchronicznie
+    i nie czeka na sieć w wątku. Po wyczerpaniu limitu zapytań do API (LIMITY_API)
+    odpowiedź zawiera tylko wyniki z listy lokalnej i bazy.
+    """
     query = request.args.get('q', '').strip()
+    zrodla = [z for z in request.args.get('zrodla', ','.join(ZRODLA)).split(',') if z in ZRODLA]
 
     if not query or len(query) < 2:
         return jsonify([])
 
+    wersja = wersja_produktow()
+    etag = None
+    if 'online' not in zrodla:
+        etag = hashlib.sha1(
+            f"{normalizuj(query)}|{','.join(zrodla)}|{wersja}|{dane_lokalne().wersja}".encode()
+        ).hexdigest()
+        if request.if_none_match.contains(etag):
+            return odpowiedz_wyszukiwania(app.response_class(status=304), etag)
+
+    koniec = time.monotonic() + SZUKAJ_LIMIT_CZASU
+
+    # Zapytania do API startują w tle, zanim przeszukamy listę lokalną i bazę
+    gotowe_api = request.environ.get('asgi.scope', {}).get(ODPOWIEDZI_API_ASGI)
+    zadania_api = []
+    if 'online' in zrodla and SZUKAJ_ONLINE and gotowe_api is None:
+        zadania_api = [pula_wyszukiwania.submit(w_kontekscie(wyszukaj_w_api), zapytanie_do_api(query))]
+
     wszystkie_produkty = []
     znalezione_nazwy = set()
+    znalezione_kody = set()
+
+    def dodaj_wynik(p):
+        """Dodaje produkt, którego nie ma jeszcze w wynikach (po nazwie i kodzie kreskowym)."""
+        kod = kod_produktu(p)
+        if p['nazwa'].lower() in znalezione_nazwy or kod in znalezione_kody:
+            return False
+        znalezione_nazwy.add(p['nazwa'].lower())
+        if kod:
+            znalezione_kody.add(kod)
+        wszystkie_produkty.append(p)
+        return True
 
     # 1. Szukaj w lokalnej liście (owoce, warzywa, mięso)
-    for p in wyszukaj_lokalne(query):
-        if p['nazwa'].lower() not in znalezione_nazwy:
-            znalezione_nazwy.add(p['nazwa'].lower())
-            p['zrodlo'] = 'lokalne'
-            wszystkie_produkty.append(p)
+    for p in wyszukaj_lokalne(query) if 'lokalne' in zrodla else []:
+        dodaj_wynik(dict(p, zrodlo='lokalne'))
+
+    # Baza jest pytana o jeden wynik więcej, żeby wiedzieć, czy lista jest pełna
+    wyniki_bazy = wyszukaj_w_bazie_z_cache(query, wersja) if 'baza' in zrodla else []
+    obciete = set()
+    if len(wyniki_bazy) > LIMIT_BAZY:
+        obciete.add('baza')
+        wyniki_bazy = wyniki_bazy[:LIMIT_BAZY]
 
     # 2. Szukaj w bazie SQLite (stare produkty użytkownika)
-    for p in wyszukaj_w_bazie(query):
-        if p['nazwa'].lower() not in znalezione_nazwy:
-            znalezione_nazwy.add(p['nazwa'].lower())
-            p['zrodlo'] = 'baza'
-            wszystkie_produkty.append(p)
+    for p in wyniki_bazy:
+        dodaj_wynik(dict(p, zrodlo='baza'))
+
+    # Brak trafień w nazwach - szukaj z literówkami
+    przyblizone = False
+    zrodla_indeksu = [z for z in ('lokalne', 'baza') if z in zrodla]
+    if not wszystkie_produkty and zrodla_indeksu:
+        indeks = indeks_przyblizony(wersja)
+        if indeks is None or indeks.wersja != wersja:
+            etag = None  # wynik z nieaktualnym indeksem (albo bez niego) nie może trafić do cache
+        for p in wyszukaj_przyblizone(indeks, query, zrodla_indeksu) if indeks else []:
+            if dodaj_wynik(p):
+                przyblizone = True
+
+    # Czekaj na odpowiedzi API najwyżej do upływu limitu czasu
+    if zadania_api:
+        wait(zadania_api, timeout=max(0, koniec - time.monotonic()))
+
+    # 3. Szukaj w Open Food Facts API - produkt zapisany już w bazie (ten sam kod) jest pomijany
+    for produkty in gotowe_api if gotowe_api is not None else map(wynik_zadania, zadania_api):
+        for product in produkty:
+            nazwa = product.get('product_name', '')
+            if not nazwa or nazwa.lower() in znalezione_nazwy:
+                continue
+
+            p = produkt_z_off(product)
+            p['zrodlo'] = 'online'
+            dodaj_wynik(p)
+
+    obciete.update(p['zrodlo'] for p in wszystkie_produkty[MAKS_WYNIKOW:])
+    odpowiedz = jsonify(wszystkie_produkty[:MAKS_WYNIKOW])
+    odpowiedz.headers['X-Obciete-Zrodla'] = ','.join(z for z in ZRODLA if z in obciete)
+    if przyblizone:
+        odpowiedz.headers['X-Przyblizone'] = '1'
+    return odpowiedz_wyszukiwania(odpowiedz, etag)
+
+
+def zapytanie_do_api(query):
+    """Fraza wysyłana do Open Food Facts: słowa zapytania zapisane jak w znanych nazwach
+    produktów (z polskimi znakami i bez literówek), np. "zolty ser" -> "żółty ser".
+    Przed zbudowaniem indeksu fraza idzie bez zmian."""
+    indeks = indeks_przyblizony()
+    if indeks is None:
+        return query
+    return ' '.join(indeks.pisownia_slowa(slowo) for slowo in query.split())
+
+
+def odpowiedz_wyszukiwania(odpowiedz, etag):
+    """Ustawia nagłówki cache odpowiedzi /api/szukaj."""
+    if etag:
+        odpowiedz.set_etag(etag)
+        # Przeglądarka może trzymać odpowiedź, ale przed użyciem pyta o jej aktualność
+        odpowiedz.cache_control.private = True
+        odpowiedz.cache_control.no_cache = True
+    else:
+        odpowiedz.cache_control.no_store = True
+    return odpowiedz
+
+
+def wyszukaj_w_bazie_z_cache(query, wersja):
+    """Wyszukuje w bazie, zapamiętując wynik do następnej zmiany tabeli produkty."""
+    klucz = (normalizuj(query), wersja)
+    with _cache_wynikow_lock:
+        if klucz in cache_wynikow:
+            cache_wynikow.move_to_end(klucz)
+            return cache_wynikow[klucz]
+
+    wyniki = wyszukaj_w_bazie(query, limit=LIMIT_BAZY + 1)
+    with _cache_wynikow_lock:
+        cache_wynikow[klucz] = wyniki
+        # Wpisy ze starszą wersją nigdy nie zostaną trafione - wypadną jako najstarsze
+        while len(cache_wynikow) > CACHE_WYNIKOW_ROZMIAR:
+            cache_wynikow.popitem(last=False)
+    return wyniki
 
-    # 3. Szukaj w Open Food Facts API
-    try:
-        zapytania = [query]
-        query_bez_pl = usun_polskie_znaki(query)
-        if query == query_bez_pl:
-            warianty = {
-                'jab': 'jabł', 'mie': 'mię', 'mas': 'masł',
-                'zol': 'żół', 'ryz': 'ryż', 'ogor': 'ogór', 'miod': 'miód'
-            }
-            for klucz, wariant in warianty.items():
-                if query.lower().startswith(klucz) and klucz != wariant:
-                    zapytania.append(query.lower().replace(klucz, wariant))
-
-        for q in zapytania[:2]:
-            for product in wyszukaj_w_api(q):
-                nazwa = product.get('product_name', '')
-                if not nazwa or nazwa.lower() in znalezione_nazwy:
-                    continue
-
-                marka = product.get('brands', '')
-                pelna_nazwa = f"{nazwa} ({marka})" if marka else nazwa
-
-                if pelna_nazwa.lower() in znalezione_nazwy:
-                    continue
-                znalezione_nazwy.add(pelna_nazwa.lower())
-
-                nutriments = product.get('nutriments', {})
-                kalorie = nutriments.get('energy-kcal_100g') or nutriments.get('energy_100g', 0)
-                if isinstance(kalorie, str):
-                    kalorie = 0
-                if kalorie > 900:
-                    kalorie = kalorie / 4.184
-
-                wszystkie_produkty.append({
-                    'id': product.get('code', ''),
-                    'nazwa': pelna_nazwa,
-                    'kalorie': round(float(kalorie), 1),
-                    'bialko': round(float(nutriments.get('proteins_100g', 0) or 0), 1),
-                    'weglowodany': round(float(nutriments.get('carbohydrates_100g', 0) or 0), 1),
-                    'tluszcze': round(float(nutriments.get('fat_100g', 0) or 0), 1),
-                    'zrodlo': 'online'
-                })
 
+def wynik_zadania(zadanie):
+    """Zwraca wynik zakończonego zadania wyszukiwania.
+
+    Zadanie, które nie zdążyło przed limitem czasu albo skończyło się błędem sieci,
+    daje pustą listę - dokończy się w tle (i np. zapisze odpowiedź w cache).
+    """
+    if not zadanie.done():
+        return []
+    try:
+        return zadanie.result()
     except requests.RequestException:
-        pass  # Kontynuuj z lokalnymi wynikami
+        return []  # Kontynuuj z pozostałymi wynikami
 
-    return jsonify(wszystkie_produkty[:25])
 
+# Największa liczba całkowita w SQLite (64 bity ze znakiem) - większe id nie istnieje w bazie
+MAKS_ID_BAZY = 2 ** 63 - 1
 
-@app.route('/api/zapisz', methods=['POST'])
+
+def id_z_bazy(id_produktu):
+    """Zwraca id w tabeli produkty z identyfikatora db_<id> albo None (inny lub niepoprawny)."""
+    cyfry = id_produktu[3:] if id_produktu.startswith('db_') else ''
+    if not (cyfry.isascii() and cyfry.isdigit()):
+        return None
+    id_bazy = int(cyfry)
+    return id_bazy if id_bazy <= MAKS_ID_BAZY else None
+
+
+def nazwa_pozycji(pozycja):
+    """Nazwa produktu z pozycji albo None, gdy jej brak albo nie jest tekstem."""
+    nazwa = pozycja.get('nazwa')
+    return nazwa if isinstance(nazwa, str) else None
+
+
+def wartosci_pozycji(pozycja, po_id, po_nazwie):
+    """Zwraca (nazwa, wartości na 100g) produktu wskazanego w pozycji albo None.
+
+    Kolejność: id z bazy (db_<id>), id lub nazwa z listy lokalnej, nazwa w bazie,
+    a na końcu wartości podane wprost w pozycji (np. produkt z Open Food Facts).
+    """
+    id_produktu = str(pozycja.get('id', ''))
+    nazwa = nazwa_pozycji(pozycja)
+
+    id_bazy = id_z_bazy(id_produktu)
+    if id_bazy is not None:
+        wiersz = po_id.get(id_bazy)
+        if wiersz:
+            return wiersz[1], wiersz[2:6]
+
+    lokalne = dane_lokalne()
+    lokalny = lokalne.po_id.get(id_produktu) or lokalne.po_nazwie.get(nazwa)
+    if lokalny:
+        return lokalny['nazwa'], [lokalny[s] for s in SKLADNIKI]
+
+    if nazwa in po_nazwie:
+        wiersz = po_nazwie[nazwa]
+        return wiersz[1], wiersz[2:6]
+
+    if nazwa and all(isinstance(pozycja.get(s), (int, float)) for s in SKLADNIKI):
+        return nazwa, [pozycja[s] for s in SKLADNIKI]
+
+    return None
+
+
+@app.route('/api/oblicz', methods=['POST'])
 @wymaga_logowania
-def zapisz_produkt():
-    """Zapisuje produkt z internetu do lokalnej bazy."""
-    data = request.json
+def oblicz_danie():
+    """Oblicza wartości odżywcze listy pozycji (produkt + gramy) i ich sumę.
+
+    Przyjmuje {"pozycje": [{"id": "db_1" | "lok_jablko", "nazwa": "...", "gramy": 150}, ...]}.
+    Wszystkie produkty z bazy są pobierane jednym zapytaniem zbiorczym.
+    """
+    data = request.get_json(silent=True)
+    pozycje = data.get('pozycje') if isinstance(data, dict) else data
+    blad = sprawdz_pozycje(pozycje)
+    if blad:
+        return jsonify({'error': blad}), 400
+
+    wyniki = []
+    suma = dict.fromkeys(SKLADNIKI, 0.0)
+    for wynik, wartosci in przelicz_pozycje(pozycje):
+        wyniki.append(wynik)
+        if wartosci is None:
+            continue
+        for skladnik, wartosc in przelicz_porcje(wartosci, wynik['gramy']).items():
+            wynik[skladnik] = round(wartosc, 1)
+            suma[skladnik] += wartosc
+
+    return jsonify({
+        'pozycje': wyniki,
+        'suma': {skladnik: round(wartosc, 1) for skladnik, wartosc in suma.items()}
+    })
+
+
+def sprawdz_pozycje(pozycje):
+    """Zwraca opis błędu, jeśli pozycje z zapytania nie są listą obiektów w limicie, albo None."""
+    if not isinstance(pozycje, list) or not all(isinstance(p, dict) for p in pozycje):
+        return 'Oczekiwano listy pozycji'
+    if len(pozycje) > MAKS_POZYCJI:
+        return f'Maksymalnie {MAKS_POZYCJI} pozycji w jednym zapytaniu'
+    return None
+
+
+def przelicz_pozycje(pozycje):
+    """Odnajduje produkty pozycji - wszystkie z bazy jednym zapytaniem zbiorczym.
+
+    Zwraca pary (wynik, wartości na 100g). Dla błędnej pozycji wynik zawiera 'blad',
+    a wartości to None.
+    """
+    ids, nazwy = set(), set()
+    for p in pozycje:
+        id_bazy = id_z_bazy(str(p.get('id', '')))
+        nazwa = nazwa_pozycji(p)
+        if id_bazy is not None:
+            ids.add(id_bazy)
+        elif nazwa is not None and nazwa not in dane_lokalne().po_nazwie:
+            nazwy.add(nazwa)
+    po_id, po_nazwie = pobierz_produkty(ids, nazwy)
+
+    wyniki = []
+    for p in pozycje:
+        wynik = {'id': p.get('id'), 'nazwa': p.get('nazwa')}
+
+        try:
+            gramy = float(p.get('gramy', 100))
+        except (TypeError, ValueError):
+            gramy = -1
+        if not 0 <= gramy < float('inf'):
+            wynik['blad'] = 'Nieprawidłowa ilość'
+            wyniki.append((wynik, None))
+            continue
+
+        produkt = wartosci_pozycji(p, po_id, po_nazwie)
+        if not produkt:
+            wynik['blad'] = 'Nie znaleziono produktu'
+            wyniki.append((wynik, None))
+            continue
+
+        wynik.update({'nazwa': produkt[0], 'gramy': gramy})
+        wyniki.append((wynik, produkt[1]))
+    return wyniki
+
+
+def uzytkownik_dziennika():
+    """Login, pod którym zapisujemy dziennik, albo None dla gościa (wspólne konto)."""
+    if session.get('jest_gosciem'):
+        return None
+    return session.get('uzytkownik')
+
+
+def data_z_parametru(tekst):
+    """Zamienia datę RRRR-MM-DD na obiekt date (pusta = dzisiaj); błędna -> ValueError."""
+    return date.fromisoformat(tekst) if tekst else date.today()
+
+
+def suma_ze_skladnikow(wiersz):
+    """Zamienia wartości (kolejność jak w SKLADNIKI) na zaokrąglony słownik."""
+    return {skladnik: round(wartosc, 1) for skladnik, wartosc in zip(SKLADNIKI, wiersz)}
 
-    nazwa = data.get('nazwa', '').strip()
-    if not nazwa:
-        return jsonify({'error': 'Brak nazwy produktu'}), 400
 
-    conn = get_connection()
-    cursor = conn.cursor()
+@app.route('/api/dziennik', methods=['GET', 'POST'])
+@wymaga_logowania
+def dziennik():
+    """Wpisy dziennika z jednego dnia (GET ?data=) albo dodanie pozycji (POST).
+
+    POST przyjmuje {"data": "2024-05-01", "pozycje": [...]} w formacie /api/oblicz.
+    """
+    uzytkownik = uzytkownik_dziennika()
+    if not uzytkownik:
+        return jsonify({'error': 'Dziennik jest niedostępny na koncie gościa'}), 403
+
+    data = request.get_json(silent=True) if request.method == 'POST' else request.args
+    if not isinstance(data, dict):
+        return jsonify({'error': 'Oczekiwano obiektu JSON'}), 400
+    try:
+        dzien = data_z_parametru(data.get('data')).isoformat()
+    except (TypeError, ValueError):
+        return jsonify({'error': 'Nieprawidłowa data (oczekiwano RRRR-MM-DD)'}), 400
+
+    if request.method == 'POST':
+        pozycje = data.get('pozycje')
+        blad = sprawdz_pozycje(pozycje)
+        if blad:
+            return jsonify({'error': blad}), 400
+        przeliczone = przelicz_pozycje(pozycje)
+        ids = iter(dodaj_do_dziennika(uzytkownik, dzien, [
+            (wynik['nazwa'], wynik['gramy'], wartosci) for wynik, wartosci in przeliczone if wartosci is not None
+        ]))
+        for wynik, wartosci in przeliczone:
+            if wartosci is not None:
+                wynik['wpis'] = next(ids)
+                wynik.update(suma_ze_skladnikow(przelicz_porcje(wartosci, wynik['gramy']).values()))
+        return jsonify({'data': dzien, 'pozycje': [wynik for wynik, _ in przeliczone]})
+
+    wpisy = [
+        {'id': w[0], 'nazwa': w[1], 'gramy': w[2], **suma_ze_skladnikow(w[3:7])}
+        for w in wpisy_dziennika(uzytkownik, dzien)
+    ]
+    podsumowanie = podsumowanie_dziennika(uzytkownik, dzien, dzien)
+    suma = suma_ze_skladnikow(podsumowanie[0][2:6] if podsumowanie else (0.0,) * len(SKLADNIKI))
+    return jsonify({'data': dzien, 'wpisy': wpisy, 'suma': suma})
+
+
+@app.route('/api/dziennik/<int:id_wpisu>', methods=['DELETE'])
+@wymaga_logowania
+def usun_wpis_dziennika(id_wpisu):
+    """Usuwa wpis z dziennika zalogowanego użytkownika."""
+    uzytkownik = uzytkownik_dziennika()
+    if not uzytkownik:
+        return jsonify({'error': 'Dziennik jest niedostępny na koncie gościa'}), 403
+    if not usun_z_dziennika(uzytkownik, id_wpisu):
+        return jsonify({'error': 'Nie znaleziono wpisu'}), 404
+    return jsonify({'success': True})
+
+
+@app.route('/api/dziennik/podsumowanie')
+@wymaga_logowania
+def podsumowanie_dziennika_api():
+    """Sumy dzienne albo tygodniowe z ostatnich `dni` dni (domyślnie 90) do `do` włącznie.
+
+    Czyta gotowe sumy - koszt zależy od liczby dni, a nie liczby wpisów.
+    """
+    uzytkownik = uzytkownik_dziennika()
+    if not uzytkownik:
+        return jsonify({'error': 'Dziennik jest niedostępny na koncie gościa'}), 403
+
+    okres = request.args.get('okres', 'dzien')
+    if okres not in ('dzien', 'tydzien'):
+        return jsonify({'error': 'Okres musi być "dzien" albo "tydzien"'}), 400
+    try:
+        do = data_z_parametru(request.args.get('do'))
+        dni = int(request.args.get('dni', 90))
+    except ValueError:
+        return jsonify({'error': 'Nieprawidłowe parametry'}), 400
+    if not 1 <= dni <= MAKS_DNI_DZIENNIKA:
+        return jsonify({'error': f'Liczba dni musi być od 1 do {MAKS_DNI_DZIENNIKA}'}), 400
+
+    od = do - timedelta(days=dni - 1)
+    if okres == 'tydzien':
+        od -= timedelta(days=od.weekday())  # tydzień zawierający pierwszy dzień zakresu
+    tabela = 'dziennik_dni' if okres == 'dzien' else 'dziennik_tygodnie'
+    okresy = [
+        {'data': w[0], 'pozycje': w[1], **suma_ze_skladnikow(w[2:6])}
+        for w in podsumowanie_dziennika(uzytkownik, od.isoformat(), do.isoformat(), tabela)
+    ]
+    return jsonify({'od': od.isoformat(), 'do': do.isoformat(), 'okres': okres, 'okresy': okresy})
+
+
+def klucz_strony(wiersz) -> str:
+    """Koduje klucz (nazwa, id) ostatniego produktu strony jako parametr `po` następnej."""
+    return base64.urlsafe_b64encode(json.dumps([wiersz[1], wiersz[0]]).encode()).decode()
+
+
+def klucz_z_parametru(tekst):
+    """Odczytuje klucz strony z parametru `po` (brak -> None). Błędny klucz -> ValueError."""
+    if not tekst:
+        return None
+    klucz = json.loads(base64.urlsafe_b64decode(tekst.encode()))
+    if (not isinstance(klucz, list) or len(klucz) != 2
+            or not isinstance(klucz[0], str) or type(klucz[1]) is not int
+            or not 0 <= klucz[1] <= MAKS_ID_BAZY):
+        raise ValueError('Nieprawidłowy klucz strony')
+    return tuple(klucz)
+
+
+@app.route('/api/produkty')
+@wymaga_logowania
+def lista_produktow_api():
+    """Przeglądanie produktów z bazy w kolejności nazw, stronami.
+
+    Parametr `po` to wartość `nastepna` z poprzedniej strony (stronicowanie po kluczu,
+    więc każda strona kosztuje tyle samo), `kategoria` zawęża listę, a `limit`
+    to liczba produktów na stronie.
+    """
+    kategoria = request.args.get('kategoria') or None
+    try:
+        limit = int(request.args.get('limit', STRONA_PRODUKTOW))
+        po = klucz_z_parametru(request.args.get('po'))
+    except ValueError:
+        return jsonify({'error': 'Nieprawidłowe parametry'}), 400
+    if not 1 <= limit <= MAKS_STRONA_PRODUKTOW:
+        return jsonify({'error': f'Limit musi być od 1 do {MAKS_STRONA_PRODUKTOW}'}), 400
+
+    # Jeden wiersz ponad limit mówi, czy istnieje następna strona
+    wiersze = list(przegladaj_produkty(kategoria, po, limit + 1))
+    nastepna = klucz_strony(wiersze[limit - 1]) if len(wiersze) > limit else None
+    produkty = [
+        {'id': w[0], 'nazwa': w[1], **dict(zip(SKLADNIKI, w[2:6])), 'kategoria': w[6], 'kod': w[7]}
+        for w in wiersze[:limit]
+    ]
+    return jsonify({'produkty': produkty, 'nastepna': nastepna})
+
+
+@app.route('/api/kod/<kod>')
+@wymaga_logowania
+def produkt_po_kodzie_api(kod):
+    """Produkt o podanym kodzie kreskowym (EAN) - zapytanie skanerów.
 
+    Najpierw punktowe wyszukanie w indeksie kodów bazy, a dopiero gdy kodu tam nie ma -
+    Open Food Facts (przez cache odpowiedzi API). Uruchomiona przez asgi.py dostaje
+    odpowiedź API (albo jej błąd) pobraną już asynchronicznie.
+    """
     try:
-        cursor.execute("""
-            INSERT INTO produkty (nazwa, kalorie, bialko, weglowodany, tluszcze, kategoria)
-            VALUES (?, ?, ?, ?, ?, ?)
-        """, (
-            nazwa,
-            data.get('kalorie', 0),
-            data.get('bialko', 0),
-            data.get('weglowodany', 0),
-            data.get('tluszcze', 0),
-            'zapisane'
-        ))
-        conn.commit()
-        return jsonify({'success': True, 'id': cursor.lastrowid})
-    except Exception as e:
+        kod = normalizuj_kod(kod)
+    except ValueError:
+        kod = None
+    if kod is None:
+        return jsonify({'error': 'Nieprawidłowy kod kreskowy'}), 400
+
+    wiersz = produkt_po_kodzie(kod)
+    if wiersz:
+        return jsonify(dict(produkt_z_bazy(wiersz), zrodlo='baza'))
+
+    if SZUKAJ_ONLINE:
+        gotowe_api = request.environ.get('asgi.scope', {}).get(ODPOWIEDZI_API_ASGI)
+        try:
+            if isinstance(gotowe_api, requests.RequestException):
+                raise gotowe_api
+            produkty = gotowe_api if gotowe_api is not None else wyszukaj_kod_w_api(kod)
+        except requests.RequestException:
+            return jsonify({'error': 'Open Food Facts jest chwilowo niedostępne'}), 503
+        for product in produkty:
+            p = produkt_z_off(product)
+            if p:
+                return jsonify(dict(p, kod=kod, zrodlo='online'))
+
+    return jsonify({'error': 'Nie znaleziono produktu'}), 404
+
+
+@app.route('/api/zamienniki')
+@wymaga_logowania
+def zamienniki_api():
+    """Zamienniki produktu - produkty o najbardziej podobnych wartościach odżywczych.
+
+    Produkt wskazuje `id` (db_<id> albo id z listy lokalnej) lub `nazwa`, `k` to liczba
+    zamienników, a `kategoria` ogranicza je do jednej kategorii. Odległość to odległość
+    euklidesowa wartości na 100g (10 kcal jak 1 g składnika), liczona drzewem k-d
+    produktów listy lokalnej i bazy.
+    """
+    kategoria = request.args.get('kategoria') or None
+    try:
+        k = int(request.args.get('k', ZAMIENNIKI))
+    except ValueError:
+        return jsonify({'error': 'Nieprawidłowe parametry'}), 400
+    if not 1 <= k <= MAKS_ZAMIENNIKOW:
+        return jsonify({'error': f'Liczba zamienników musi być od 1 do {MAKS_ZAMIENNIKOW}'}), 400
+
+    (wzor, wartosci), = przelicz_pozycje([{'id': request.args.get('id', ''), 'nazwa': request.args.get('nazwa')}])
+    if wartosci is None:
+        return jsonify({'error': wzor['blad']}), 404
+
+    from obliczenia import zamienniki_produktow  # NumPy dopiero przy pierwszym zapytaniu
+
+    # Sam produkt i ta sama nazwa w obu źródłach (lista lokalna i baza) zajmują miejsca
+    # wśród najbliższych - szukamy ich coraz więcej, aż zostanie k różnych zamienników
+    szukane = k + 1
+    while True:
+        najblizsze = zamienniki_produktow().najblizsze(wartosci, szukane, kategoria)
+        po_id, _ = pobierz_produkty(ids=[p for _, p in najblizsze if isinstance(p, int)])
+
+        zamienniki = []
+        nazwy = {wzor['nazwa'].lower()}
+        for odleglosc, p in najblizsze:
+            if isinstance(p, int):
+                wiersz = po_id.get(p)
+                if wiersz is None:
+                    continue  # usunięty po zbudowaniu indeksu
+                produkt = dict(produkt_z_bazy(wiersz), kategoria=wiersz[6], zrodlo='baza')
+            else:
+                produkt = dict(p.jako_slownik(), kategoria=p.kategoria, zrodlo='lokalne')
+            if produkt['nazwa'].lower() in nazwy:
+                continue
+            nazwy.add(produkt['nazwa'].lower())
+            zamienniki.append(dict(produkt, odleglosc=round(odleglosc, 2)))
+
+        # Mniej najbliższych niż szukanych - indeks nie ma więcej produktów
+        if len(zamienniki) >= k or len(najblizsze) < szukane:
+            break
+        szukane *= 2
+
+    return jsonify({
+        'produkt': {'nazwa': wzor['nazwa'], **dict(zip(SKLADNIKI, wartosci))},
+        'zamienniki': zamienniki[:k]
+    })
+
+
+@app.route('/api/cache')
+@wymaga_logowania
+def statystyki_cache_api():
+    """Zwraca liczniki trafień cache odpowiedzi Open Food Facts."""
+    with _statystyki_cache_lock:
+        wynik = dict(statystyki_cache)
+    wynik['wpisy'] = rozmiar_cache()
+    return jsonify(wynik)
+
+
+@app.route('/api/zapisz', methods=['POST'])
+@wymaga_logowania
+def zapisz_produkt():
+    """Zapisuje produkt z internetu do lokalnej bazy.
+
+    Lista produktów (albo {"produkty": [...]}) jest zapisywana zbiorczo, w jednej transakcji:
+    istniejące nazwy są aktualizowane, a odpowiedź zawiera raport dodanych,
+    zaktualizowanych i pominiętych pozycji.
+    """
+    data = request.get_json(silent=True)
+
+    if isinstance(data, dict) and 'produkty' in data:
+        data = data['produkty']
+    if isinstance(data, list):
+        if len(data) > MAKS_ZAPISU:
+            return jsonify({'error': f'Za dużo produktów (maks. {MAKS_ZAPISU})'}), 400
+        if not all(isinstance(p, dict) for p in data):
+            return jsonify({'error': 'Nieprawidłowe dane'}), 400
+        raport = zapisz_produkty([{**p, 'kategoria': p.get('kategoria') or 'zapisane'} for p in data])
+        return jsonify(raport)
+
+    if not isinstance(data, dict):
+        return jsonify({'error': 'Nieprawidłowe dane'}), 400
+
+    nazwa = data.get('nazwa')
+    if not isinstance(nazwa, str) or not nazwa.strip():
+        return jsonify({'error': 'Brak nazwy produktu'}), 400
+
+    # Pojedynczy produkt: tylko dodanie, istniejąca nazwa to błąd (jak dotąd)
+    raport = zapisz_produkty([{**data, 'kategoria': 'zapisane'}], nadpisz=False)
+    if not raport['dodane']:
         return jsonify({'error': 'Produkt już istnieje lub błąd zapisu'}), 400
-    finally:
-        conn.close()
+    wiersz = get_connection().execute(
+        "SELECT id FROM produkty WHERE nazwa = ?", (raport['dodane'][0],)
+    ).fetchone()
+    return jsonify({'success': True, 'id': wiersz[0]})
 
 
 if __name__ == '__main__':
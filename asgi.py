@@ -0,0 +1,192 @@
+"""
+Tryb ASGI aplikacji: uvicorn asgi:app
+
+Wyszukiwanie ze źródłem online i odczyt kodu kreskowego spoza bazy czekają na
+Open Food Facts asynchronicznie (httpx), więc tysiące równoległych zapytań nie
+zajmują po wątku każde. Pozostałą część
+zapytania, inne trasy, logowanie i sesje obsługuje ta sama aplikacja Flask,
+uruchamiana w puli wątków.
+"""
+
+import asyncio
+import os
+from urllib.parse import parse_qs
+
+import requests
+from a2wsgi import WSGIMiddleware
+from itsdangerous import BadSignature
+from werkzeug.http import parse_cookie
+
+from app import (app as aplikacja_flask, ZRODLA, SZUKAJ_ONLINE, SZUKAJ_LIMIT_CZASU, CACHE_API_TTL, API_TIMEOUT,
+                 API_TIMEOUT_Z_ZAPASEM, ODPOWIEDZI_API_ASGI, POMIARY_ASGI, klucz_cache_api, zapytanie_do_api,
+                 policz_cache, sprawdz_limit_api)
+from kalorie import pobierz_z_cache, zapisz_w_cache, normalizuj_kod, produkt_po_kodzie
+from metryki import mierzona, zacznij_pomiar
+from openfoodfacts import KlientOpenFoodFactsAsync, WspolneZapytaniaAsync
+
+# Trasa odczytu produktu po kodzie kreskowym (/api/kod/<kod>)
+SCIEZKA_KODU = '/api/kod/'
+
+# Wątki dla synchronicznej części zapytań (widoki Flaska)
+ASGI_WATKI = int(os.environ.get('ASGI_WATKI', 32))
+
+flask_w_watkach = WSGIMiddleware(aplikacja_flask, workers=ASGI_WATKI)
+
+_klient = None
+# Zapytania do API, które nie zdążyły przed limitem czasu - kończą się w tle (i trafiają do cache)
+_w_tle = set()
+# Równoległe chybienia cache z tym samym kluczem czekają na jedno zapytanie do API
+_wspolne_zapytania = WspolneZapytaniaAsync(przy_dolaczeniu=lambda: policz_cache('wspolne'))
+
+
+def klient_off() -> KlientOpenFoodFactsAsync:
+    """Klient API tworzony w pętli zdarzeń workera przy pierwszym użyciu."""
+    global _klient
+    if _klient is None:
+        _klient = KlientOpenFoodFactsAsync(timeout=API_TIMEOUT)
+    return _klient
+
+
+async def odpowiedz_api_z_cache_async(klucz, rodzaj, zapytanie):
+    """Odpowiednik app.odpowiedz_api_z_cache: cache odpowiedzi, jedno zapytanie na równoległe
+    chybienia w limicie zapytań `rodzaj`, a przy awarii API albo wyczerpanym limicie
+    przeterminowany wpis. `zapytanie(timeout)` to korutyna pobierająca odpowiedź."""
+    wpis = await asyncio.to_thread(pobierz_z_cache, klucz)
+
+    if wpis and wpis[1] < CACHE_API_TTL:
+        policz_cache('trafienia')
+        return wpis[0]
+
+    async def pobierz():
+        await asyncio.to_thread(sprawdz_limit_api, rodzaj)
+        produkty = await zapytanie(API_TIMEOUT_Z_ZAPASEM if wpis else API_TIMEOUT)
+        await asyncio.to_thread(zapisz_w_cache, klucz, produkty)
+        return produkty
+
+    policz_cache('chybienia')
+    try:
+        return await _wspolne_zapytania.wykonaj(klucz, pobierz)
+    except requests.RequestException:
+        if wpis:
+            policz_cache('przeterminowane')
+            return wpis[0]
+        raise
+
+
+@mierzona('api')
+async def wyszukaj_w_api_async(query):
+    """Odpowiednik app.wyszukaj_w_api."""
+    klucz = klucz_cache_api(query)
+    return await odpowiedz_api_z_cache_async(klucz, 'szukaj',
+                                             lambda timeout: klient_off().szukaj(klucz, timeout=timeout))
+
+
+@mierzona('api_kod')
+async def wyszukaj_kod_w_api_async(kod):
+    """Odpowiednik app.wyszukaj_kod_w_api."""
+    return await odpowiedz_api_z_cache_async(f'kod:{kod}', 'produkt',
+                                             lambda timeout: klient_off().produkt(kod, timeout=timeout))
+
+
+async def odpowiedz_kodu(kod):
+    """Odpowiedź API dla kodu kreskowego spoza bazy (lista produktów albo błąd) do przekazania
+    widokowi /api/kod/ albo None, gdy kod jest w bazie lub niepoprawny (widok obsłuży go sam)."""
+    try:
+        kod = normalizuj_kod(kod)
+    except ValueError:
+        return None
+    if kod is None or await asyncio.to_thread(produkt_po_kodzie, kod):
+        return None
+    try:
+        return await wyszukaj_kod_w_api_async(kod)
+    except requests.RequestException as e:
+        return e
+
+
+def _zakonczone_w_tle(zadanie):
+    _w_tle.discard(zadanie)
+    if not zadanie.cancelled():
+        zadanie.exception()  # odebrany błąd nie jest zgłaszany jako nieobsłużony
+
+
+async def odpowiedzi_api(zapytania):
+    """Pobiera odpowiedzi dla wszystkich fraz naraz, czekając najwyżej SZUKAJ_LIMIT_CZASU.
+
+    Fraza bez odpowiedzi w limicie albo z błędem sieci daje pustą listę.
+    """
+    zadania = [asyncio.ensure_future(wyszukaj_w_api_async(q)) for q in zapytania]
+    gotowe, _ = await asyncio.wait(zadania, timeout=SZUKAJ_LIMIT_CZASU)
+
+    wyniki = []
+    for zadanie in zadania:
+        if zadanie not in gotowe:
+            _w_tle.add(zadanie)
+            zadanie.add_done_callback(_zakonczone_w_tle)
+            wyniki.append([])
+            continue
+        try:
+            wyniki.append(zadanie.result())
+        except requests.RequestException:
+            wyniki.append([])
+    return wyniki
+
+
+def zalogowany(scope) -> bool:
+    """Sprawdza ciasteczko sesji Flaska, tak jak wymaga_logowania (bez uruchamiania widoku)."""
+    naglowek = '; '.join(v.decode('latin1') for k, v in scope.get('headers', ()) if k == b'cookie')
+    wartosc = parse_cookie(naglowek).get(aplikacja_flask.config['SESSION_COOKIE_NAME'])
+    serializer = aplikacja_flask.session_interface.get_signing_serializer(aplikacja_flask)
+    if not wartosc or serializer is None:
+        return False
+    try:
+        sesja = serializer.loads(wartosc, max_age=int(aplikacja_flask.permanent_session_lifetime.total_seconds()))
+    except BadSignature:
+        return False
+    return 'zalogowany' in sesja
+
+
+async def cykl_zycia(receive, send):
+    """Obsługa zdarzeń startu i zatrzymania serwera (zamyka klienta API)."""
+    while True:
+        wiadomosc = await receive()
+        if wiadomosc['type'] == 'lifespan.startup':
+            await send({'type': 'lifespan.startup.complete'})
+        elif wiadomosc['type'] == 'lifespan.shutdown':
+            if _klient is not None:
+                await _klient.zamknij()
+            await send({'type': 'lifespan.shutdown.complete'})
+            return
+
+
+async def app(scope, receive, send):
+    """Aplikacja ASGI.
+
+    Dla /api/szukaj ze źródłem online i dla /api/kod/ z kodem spoza bazy (zalogowany
+    użytkownik) odpowiedzi API są pobierane tutaj, bez blokowania wątku, i przekazywane
+    w scope do widoku Flaska, który łączy je z wynikami lokalnymi. Wszystko inne trafia
+    prosto do Flaska.
+    """
+    if scope['type'] == 'lifespan':
+        await cykl_zycia(receive, send)
+        return
+
+    if scope['type'] == 'http' and scope['path'] == '/api/szukaj' and SZUKAJ_ONLINE:
+        parametry = parse_qs(scope['query_string'].decode('latin1'), keep_blank_values=True)
+        query = parametry.get('q', [''])[0].strip()
+        zrodla = parametry.get('zrodla', [','.join(ZRODLA)])[0].split(',')
+        if 'online' in zrodla and len(query) >= 2 and zalogowany(scope):
+            pomiary = zacznij_pomiar()
+            # Poprawienie pisowni czyta wersję produktów z bazy
+            fraza = await asyncio.to_thread(zapytanie_do_api, query)
+            odpowiedzi = await odpowiedzi_api([fraza])
+            scope = dict(scope, **{ODPOWIEDZI_API_ASGI: odpowiedzi, POMIARY_ASGI: pomiary})
+
+    elif (scope['type'] == 'http' and scope['path'].startswith(SCIEZKA_KODU) and scope['method'] == 'GET'
+          and SZUKAJ_ONLINE and zalogowany(scope)):
+        kod = scope['path'][len(SCIEZKA_KODU):]
+        pomiary = zacznij_pomiar()
+        odpowiedz = await odpowiedz_kodu(kod) if '/' not in kod else None
+        if odpowiedz is not None:
+            scope = dict(scope, **{ODPOWIEDZI_API_ASGI: odpowiedz, POMIARY_ASGI: pomiary})
+
+    await flask_w_watkach(scope, receive, send)
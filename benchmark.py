@@ -0,0 +1,917 @@
+"""
+Benchmarki warstwy bazy danych i API.
+Każdy scenariusz działa na tymczasowej kopii bazy - plik kalorie.db nie jest ruszany.
+
+Użycie: python benchmark.py <scenariusz> [opcje]
+"""
+
+import argparse
+import atexit
+import gzip
+import heapq
+import json
+import os
+import random
+import shutil
+import socket
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from urllib.parse import parse_qs, urlparse
+
+# Baza benchmarku musi być ustawiona przed importem modułów aplikacji
+_KATALOG = tempfile.mkdtemp(prefix='kalorie-bench-')
+atexit.register(shutil.rmtree, _KATALOG, ignore_errors=True)
+os.environ['KALORIE_DB'] = str(Path(_KATALOG) / 'bench.db')
+
+import requests  # noqa: E402
+
+import kalorie  # noqa: E402
+
+
+SLOWA = (
+    "jabłko", "gruszka", "śliwka", "mleko", "ser", "żółty", "twaróg", "jogurt", "masło",
+    "chleb", "bułka", "żytni", "kurczak", "indyk", "wołowina", "schab", "szynka", "kiełbasa",
+    "łosoś", "dorsz", "ryż", "makaron", "kasza", "płatki", "owsiane", "sok", "napój", "baton",
+    "czekolada", "ciastka", "pomidor", "ogórek", "marchew", "ziemniak", "cebula", "papryka",
+    "naturalny", "light", "bio", "wędzony", "pieczony", "gotowany", "suszony", "mrożony",
+)
+
+
+def nazwy_produktow(liczba: int, ziarno: int = 1):
+    """Generuje powtarzalne, zróżnicowane nazwy produktów."""
+    los = random.Random(ziarno)
+    for i in range(liczba):
+        slowa = los.sample(SLOWA, los.randint(2, 4))
+        yield f"{' '.join(slowa).capitalize()} {i}"
+
+
+def zasiej_produkty(liczba: int):
+    """Wypełnia bazę benchmarku syntetycznymi produktami."""
+    conn = kalorie.get_connection()
+    with conn:
+        conn.executemany("""
+            INSERT OR IGNORE INTO produkty (nazwa, kalorie, bialko, weglowodany, tluszcze, kategoria, nazwa_szukaj)
+            VALUES (?, ?, ?, ?, ?, ?, ?)
+        """, ((nazwa, i % 900, i % 40, i % 80, i % 50, 'test', kalorie.normalizuj(nazwa))
+              for i, nazwa in enumerate(nazwy_produktow(liczba))))
+
+
+class StubOpenFoodFacts:
+    """Lokalny serwer udający wyszukiwarkę Open Food Facts.
+
+    Odpowiada po `opoznienie` sekundach kodem `status` i liczy otrzymane zapytania.
+    """
+
+    def __init__(self, opoznienie: float = 0.0, status: int = 200):
+        self.opoznienie = opoznienie
+        self.status = status
+        self.zapytania = 0
+        self._lock = threading.Lock()
+        stub = self
+
+        class Obsluga(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+            wbufsize = -1  # nagłówki i treść w jednym pakiecie (bez opóźnień Nagle'a)
+
+            def do_GET(self):
+                with stub._lock:
+                    stub.zapytania += 1
+                time.sleep(stub.opoznienie)
+                fraza = parse_qs(urlparse(self.path).query).get('search_terms', [''])[0]
+                tresc = json.dumps({'products': [
+                    {'code': f'590{i:010d}', 'product_name': f'{fraza.capitalize()} {i}', 'brands': 'Stub',
+                     'nutriments': {'energy-kcal_100g': 50 + i, 'proteins_100g': 1.5,
+                                    'carbohydrates_100g': 12, 'fat_100g': 0.4}}
+                    for i in range(15)
+                ]}).encode()
+                self.send_response(stub.status)
+                self.send_header('Content-Type', 'application/json')
+                if 'gzip' in self.headers.get('Accept-Encoding', ''):
+                    tresc = gzip.compress(tresc)
+                    self.send_header('Content-Encoding', 'gzip')
+                self.send_header('Content-Length', str(len(tresc)))
+                self.end_headers()
+                self.wfile.write(tresc)
+
+            def log_message(self, *args):
+                pass
+
+        class Serwer(ThreadingHTTPServer):
+            request_queue_size = 1024  # setki równoległych połączeń przy teście obciążeniowym
+
+        self.serwer = Serwer(('127.0.0.1', 0), Obsluga)
+        self.serwer.daemon_threads = True
+        self.adres = f'http://127.0.0.1:{self.serwer.server_port}'
+        threading.Thread(target=self.serwer.serve_forever, daemon=True).start()
+
+    def zatrzymaj(self):
+        self.serwer.shutdown()
+        self.serwer.server_close()
+
+
+def mierz_w_watkach(funkcja, watki: int, czas: float) -> float:
+    """Wywołuje funkcję w pętli w kilku wątkach i zwraca liczbę wywołań na sekundę."""
+    licznik = [0] * watki
+    koniec = time.perf_counter() + czas
+
+    def petla(nr):
+        while time.perf_counter() < koniec:
+            funkcja()
+            licznik[nr] += 1
+
+    watki_lista = [threading.Thread(target=petla, args=(i,)) for i in range(watki)]
+    start = time.perf_counter()
+    for w in watki_lista:
+        w.start()
+    for w in watki_lista:
+        w.join()
+    return sum(licznik) / (time.perf_counter() - start)
+
+
+def scenariusz_polaczenia(args):
+    """Porównuje połączenie otwierane przy każdym wywołaniu z pulą połączeń per wątek."""
+    kalorie.init_db()
+    zasiej_produkty(args.produkty)
+
+    def odczyt_stary():
+        conn = sqlite3.connect(kalorie.DB_PATH)
+        conn.execute("SELECT id, nazwa FROM produkty WHERE nazwa LIKE ? LIMIT 20", ('%test%',)).fetchall()
+        conn.close()
+
+    def zapis_stary():
+        conn = sqlite3.connect(kalorie.DB_PATH, timeout=30)
+        conn.execute("UPDATE statystyki SET wartosc = wartosc + 1 WHERE klucz = 'odwiedziny'")
+        conn.commit()
+        conn.close()
+
+    def odczyt_pula():
+        conn = kalorie.get_connection()
+        conn.execute("SELECT id, nazwa FROM produkty WHERE nazwa LIKE ? LIMIT 20", ('%test%',)).fetchall()
+
+    def zapis_pula():
+        conn = kalorie.get_connection()
+        with conn:
+            conn.execute("UPDATE statystyki SET wartosc = wartosc + 1 WHERE klucz = 'odwiedziny'")
+
+    # "Przed" mierzymy w domyślnym trybie dziennika, "po" w trybie WAL
+    kalorie.zamknij_polaczenie()
+    conn = sqlite3.connect(kalorie.DB_PATH)
+    conn.execute("PRAGMA journal_mode = DELETE")
+    conn.close()
+
+    print(f"{'Scenariusz':<28} {'przed [op/s]':>14} {'po [op/s]':>14}")
+    print("-" * 58)
+    warianty = (("odczyt", odczyt_stary, odczyt_pula), ("zapis", zapis_stary, zapis_pula))
+    wyniki = {nazwa: [mierz_w_watkach(stara, args.watki, args.czas)] for nazwa, stara, _ in warianty}
+
+    kalorie.get_connection()  # przełącza plik z powrotem w tryb WAL
+    for nazwa, _, nowa in warianty:
+        wyniki[nazwa].append(mierz_w_watkach(nowa, args.watki, args.czas))
+
+    for nazwa, (przed, po) in wyniki.items():
+        print(f"{nazwa + f' ({args.watki} wątki)':<28} {przed:>14.0f} {po:>14.0f}")
+
+
+def mierz_opoznienie(funkcja, argumenty, powtorzenia: int = 3) -> float:
+    """Zwraca średni czas jednego wywołania w milisekundach."""
+    start = time.perf_counter()
+    for _ in range(powtorzenia):
+        for arg in argumenty:
+            funkcja(arg)
+    return (time.perf_counter() - start) * 1000 / (powtorzenia * len(argumenty))
+
+
+def scenariusz_wyszukiwanie(args):
+    """Porównuje wyszukiwanie LIKE '%fraza%' z indeksem pełnotekstowym."""
+    kalorie.init_db()
+    zasiej_produkty(args.produkty)
+    frazy = ["jab", "jabl", "jablko", "mle", "zolty", "kiel", "lososi", "platki ows", "xyz"]
+    conn = kalorie.get_connection()
+
+    def like(fraza):
+        conn.execute("""
+            SELECT id, nazwa, kalorie, bialko, weglowodany, tluszcze
+            FROM produkty WHERE nazwa LIKE ? OR nazwa LIKE ? LIMIT 20
+        """, (f"%{fraza}%", f"%{kalorie.usun_polskie_znaki(fraza)}%")).fetchall()
+
+    def fts(fraza):
+        kalorie.znajdz_produkty(fraza, limit=20)
+
+    print(f"Produktów w bazie: {args.produkty}")
+    print(f"LIKE '%fraza%': {mierz_opoznienie(like, frazy):8.2f} ms/zapytanie")
+    print(f"FTS5 trigram:   {mierz_opoznienie(fts, frazy):8.2f} ms/zapytanie")
+
+
+def scenariusz_klient_api(args):
+    """Porównuje nowe połączenie na zapytanie (requests.get) z sesją klienta Open Food Facts."""
+    from openfoodfacts import Bezpiecznik, KlientOpenFoodFacts, UslugaNiedostepna
+
+    stub = StubOpenFoodFacts(opoznienie=args.opoznienie)
+    klient = KlientOpenFoodFacts(adres=stub.adres)
+    url = f'{stub.adres}/cgi/search.pl'
+    frazy = [f'jab{i}' for i in range(200)]
+
+    zimne = mierz_opoznienie(lambda f: requests.get(url, params={'search_terms': f}, timeout=5).json(), frazy, 1)
+    cieple = mierz_opoznienie(klient.szukaj, frazy, 1)
+    print(f"Opóźnienie serwera: {args.opoznienie * 1000:.0f} ms")
+    print(f"zimne połączenie (requests.get): {zimne:6.2f} ms/zapytanie")
+    print(f"ciepłe połączenie (sesja):       {cieple:6.2f} ms/zapytanie")
+    stub.zatrzymaj()
+
+    # Bezpiecznik: upstream zwraca 503, klient przestaje go odpytywać po serii błędów
+    stub = StubOpenFoodFacts(status=503)
+    klient = KlientOpenFoodFacts(adres=stub.adres, bezpiecznik=Bezpiecznik(prog_bledow=3, czas_otwarcia=60))
+    odrzucone = 0
+    for fraza in frazy[:20]:
+        try:
+            klient.szukaj(fraza)
+        except UslugaNiedostepna:
+            odrzucone += 1
+        except requests.RequestException:
+            pass
+    print(f"Bezpiecznik: 20 wyszukiwań przy awarii -> {stub.zapytania} zapytań do serwera, "
+          f"{odrzucone} odrzuconych bez połączenia")
+    stub.zatrzymaj()
+
+
+def scenariusz_limit_api(args):
+    """Czasy łączenia równoległych identycznych zapytań do API i odpowiedzi po wyczerpaniu
+    limitu zapytań. Poprawność tych mechanizmów sprawdza test_limit_api.py.
+
+    Open Food Facts zastępuje serwer-atrapa, który liczy otrzymane zapytania.
+    """
+    kalorie.init_db()
+    kalorie.zamknij_polaczenie()
+
+    # Pobranie żetonu z wiadra w bazie - koszt dodawany do każdego zapytania do API
+    powtorzenia = 1000
+    start = time.perf_counter()
+    for _ in range(powtorzenia):
+        kalorie.pobierz_zeton('bench', 1000, 1000)
+    print(f"pobranie żetonu z limitu: {(time.perf_counter() - start) / powtorzenia * 1000:.3f} ms")
+
+    stub = StubOpenFoodFacts(opoznienie=max(args.opoznienie, 0.2))
+    os.environ['OFF_URL'] = stub.adres
+    os.environ['LIMIT_API_SZUKAJ'] = '30'
+    import app
+
+    try:
+        # Równoległe chybienia cache dla tej samej frazy - jedno zapytanie do API
+        bariera = threading.Barrier(args.watki)
+
+        def szukaj():
+            bariera.wait()
+            app.wyszukaj_w_api('jabłko')
+
+        watki = [threading.Thread(target=szukaj) for _ in range(args.watki)]
+        start = time.perf_counter()
+        for w in watki:
+            w.start()
+        for w in watki:
+            w.join()
+        print(f"{args.watki} równoległych wyszukiwań tej samej frazy: {time.perf_counter() - start:.2f} s, "
+              f"{stub.zapytania} zapytań do API (opóźnienie atrapy {stub.opoznienie:.2f} s)")
+
+        # Różne frazy ponad limit: odpowiedź bez wyników online, bez czekania na API
+        klient = app.app.test_client()
+        with klient.session_transaction() as sesja:
+            sesja['zalogowany'] = True
+            sesja['uzytkownik'] = 'bench'
+        przed = stub.zapytania
+        czasy = {True: [], False: []}
+        for i in range(100):
+            start = time.perf_counter()
+            produkty = klient.get(f'/api/szukaj?q=gruszka{i}').get_json()
+            czasy[any(p['zrodlo'] == 'online' for p in produkty)].append((time.perf_counter() - start) * 1000)
+        wyslane = stub.zapytania - przed
+        print(f"100 różnych fraz przy limicie 30/min -> {wyslane} zapytań do API, "
+              f"{len(czasy[True])} odpowiedzi z wynikami online")
+        for online, opis in ((True, 'z API'), (False, 'bez API (limit)')):
+            if czasy[online]:
+                print(f"  odpowiedź {opis:<16} p50 {percentyl(sorted(czasy[online]), 50):8.2f} ms")
+    finally:
+        stub.zatrzymaj()
+
+
+def scenariusz_odwiedziny(args):
+    """Porównuje UPDATE licznika przy każdej wizycie z licznikiem z zapisem odroczonym."""
+    kalorie.init_db()
+    zapisy = [0]
+
+    def zapis_przy_wizycie():
+        conn = kalorie.get_connection()
+        with conn:
+            conn.execute("UPDATE statystyki SET wartosc = wartosc + 1 WHERE klucz = 'odwiedziny'")
+            conn.execute("SELECT wartosc FROM statystyki WHERE klucz = 'odwiedziny'").fetchone()
+        zapisy[0] += 1
+
+    licznik = kalorie.LicznikOdwiedzin(klucz='odwiedziny_bench')
+    zapis_licznika = licznik.zapisz
+
+    def zapisz_i_policz():
+        zapisy[0] += 1
+        zapis_licznika()
+
+    licznik.zapisz = zapisz_i_policz
+
+    print(f"{'Wariant':<28} {'wizyt/s':>10} {'transakcji zapisu':>20}")
+    print("-" * 60)
+    for nazwa, funkcja in (("UPDATE przy każdej wizycie", zapis_przy_wizycie), ("zapis odroczony", licznik.zwieksz)):
+        zapisy[0] = 0
+        predkosc = mierz_w_watkach(funkcja, args.watki, args.czas)
+        print(f"{nazwa:<28} {predkosc:>10.0f} {zapisy[0]:>20}")
+
+    licznik.zapisz()
+    wizyty = licznik.wartosc()
+    print(f"\nLicznik w bazie po zapisie: {wizyty}")
+
+
+def scenariusz_logowanie(args):
+    """Mierzy liczbę logowań na sekundę przy koszcie hashowania z HASLO_METODA."""
+    kalorie.init_db()
+    kalorie.dodaj_uzytkownika('bench', 'tajne-haslo')
+    kalorie.limit_logowan.proby = 10 ** 9
+
+    def logowanie():
+        try:
+            kalorie.sprawdz_uzytkownika('bench', 'tajne-haslo')
+            udane[0] += 1
+        except kalorie.KolejkaPelna:
+            odrzucone[0] += 1
+
+    print(f"Metoda hashowania: {kalorie.HASLO_METODA}, wątki puli: {kalorie.HASLA_WATKI}")
+    for watki in (1, args.watki, 4 * kalorie.HASLA_KOLEJKA):
+        udane, odrzucone = [0], [0]
+        start = time.perf_counter()
+        mierz_w_watkach(logowanie, watki, args.czas)
+        predkosc = udane[0] / (time.perf_counter() - start)
+        print(f"{watki:>3} równoległych logowań: {predkosc:7.1f} logowań/s, "
+              f"odrzuconych od razu (pełna kolejka): {odrzucone[0]}")
+
+
+def scenariusz_obliczenia(args):
+    """Porównuje liczenie jadłospisów w pętli (przelicz_porcje) z obliczeniami na macierzach."""
+    import numpy as np
+    from obliczenia import TabelaSkladnikow, sumy_tygodniowe
+
+    kalorie.init_db()
+    los = np.random.default_rng(1)
+    uzytkownicy, dni, pozycje_dnia = 1000, 7, 10
+
+    print(f"Jadłospisy: {uzytkownicy} użytkowników x {dni} dni x {pozycje_dnia} pozycji")
+    print(f"{'Produktów':>10} {'wczytanie [ms]':>15} {'pętla [ms]':>12} {'NumPy [ms]':>12} "
+          f"{'filtr pętla [ms]':>17} {'filtr NumPy [ms]':>17}")
+    print("-" * 88)
+    for rozmiar in args.rozmiary:
+        zasiej_produkty(rozmiar)
+
+        start = time.perf_counter()
+        tabela = TabelaSkladnikow.z_bazy()
+        wczytanie = (time.perf_counter() - start) * 1000
+
+        liczba = uzytkownicy * dni * pozycje_dnia
+        grupy = np.repeat(np.arange(uzytkownicy * dni), pozycje_dnia)
+        ids = tabela.ids[los.integers(0, len(tabela), liczba)]
+        gramy = los.uniform(20, 300, liczba).round()
+
+        # Ścieżka skalarna: wiersze z pobierz_produkty, porcja po porcji
+        po_id, _ = kalorie.pobierz_produkty(ids=ids.tolist())
+        start = time.perf_counter()
+        petla = [dict.fromkeys(kalorie.SKLADNIKI, 0.0) for _ in range(uzytkownicy * dni)]
+        for grupa, id_produktu, g in zip(grupy.tolist(), ids.tolist(), gramy.tolist()):
+            porcja = kalorie.przelicz_porcje(po_id[id_produktu][2:6], g)
+            suma = petla[grupa]
+            for skladnik in kalorie.SKLADNIKI:
+                suma[skladnik] += porcja[skladnik]
+        czas_petli = (time.perf_counter() - start) * 1000
+
+        start = time.perf_counter()
+        dzienne = tabela.sumy(grupy, ids, gramy, uzytkownicy * dni)
+        sumy_tygodniowe(dzienne.reshape(uzytkownicy, dni, -1))
+        czas_numpy = (time.perf_counter() - start) * 1000
+
+        # Filtr: porcja 100g ma najwyżej 300 kcal i co najmniej 20g białka
+        wiersze = kalorie.get_connection().execute(
+            "SELECT id, nazwa, kalorie, bialko, weglowodany, tluszcze FROM produkty").fetchall()
+        start = time.perf_counter()
+        [w[0] for w in wiersze if w[2] <= 300 and w[3] >= 20]
+        czas_filtra_petli = (time.perf_counter() - start) * 1000
+        start = time.perf_counter()
+        tabela.pasujace(300, 20)
+        czas_filtra_numpy = (time.perf_counter() - start) * 1000
+
+        print(f"{len(tabela):>10} {wczytanie:>15.1f} {czas_petli:>12.1f} {czas_numpy:>12.1f} "
+              f"{czas_filtra_petli:>17.1f} {czas_filtra_numpy:>17.1f}")
+
+
+def scenariusz_przegladanie(args):
+    """Porównuje listę produktów z fetchall ze strumieniem przegladaj_produkty
+    i stronę z OFFSET ze stroną po kluczu (nazwa, id) - w połowie tabeli."""
+    kalorie.init_db()
+    conn = kalorie.get_connection()
+
+    def pierwszy_i_pamiec(funkcja):
+        tracemalloc.start()
+        start = time.perf_counter()
+        wiersze = funkcja()
+        next(iter(wiersze))
+        pierwszy = (time.perf_counter() - start) * 1000
+        for _ in wiersze:
+            pass
+        _, szczyt = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        return pierwszy, szczyt / 2 ** 20
+
+    print(f"{'Produktów':>10} {'1. wiersz fetchall [ms]':>24} {'1. wiersz strumień [ms]':>24} "
+          f"{'pamięć fetchall [MB]':>21} {'pamięć strumień [MB]':>21} {'OFFSET [ms]':>12} {'klucz [ms]':>11}")
+    print("-" * 121)
+    for rozmiar in args.rozmiary:
+        zasiej_produkty(rozmiar)
+        liczba = conn.execute("SELECT COUNT(*) FROM produkty").fetchone()[0]
+
+        fetchall = pierwszy_i_pamiec(lambda: conn.execute(
+            "SELECT id, nazwa, kalorie, bialko, weglowodany, tluszcze, kategoria FROM produkty ORDER BY nazwa"
+        ).fetchall())
+        strumien = pierwszy_i_pamiec(kalorie.przegladaj_produkty)
+
+        # Strona 50 produktów od połowy tabeli
+        srodek = conn.execute("SELECT nazwa, id FROM produkty ORDER BY nazwa, id LIMIT 1 OFFSET ?",
+                              (liczba // 2,)).fetchone()
+        offset = mierz_opoznienie(lambda _: conn.execute(
+            "SELECT id, nazwa, kalorie, bialko, weglowodany, tluszcze, kategoria FROM produkty "
+            "ORDER BY nazwa, id LIMIT 50 OFFSET ?", (liczba // 2,)).fetchall(), [None])
+        klucz = mierz_opoznienie(lambda _: list(kalorie.przegladaj_produkty(po=srodek, limit=50)), [None])
+
+        print(f"{liczba:>10} {fetchall[0]:>24.2f} {strumien[0]:>24.2f} "
+              f"{fetchall[1]:>21.1f} {strumien[1]:>21.1f} {offset:>12.2f} {klucz:>11.2f}")
+
+
+def scenariusz_zamienniki(args):
+    """Porównuje wyszukiwanie 10 zamienników drzewem k-d z przeglądem całej tabeli
+    (pętla w Pythonie i NumPy) oraz mierzy dopisanie nowych produktów do indeksu."""
+    import numpy as np
+    from obliczenia import SKALA_ODLEGLOSCI, ZamiennikiProduktow
+
+    kalorie.init_db()
+    los = np.random.default_rng(1)
+    conn = kalorie.get_connection()
+
+    print(f"{'Produktów':>10} {'budowa [s]':>11} {'drzewo [ms]':>12} {'kategoria [ms]':>15} "
+          f"{'pętla [ms]':>11} {'NumPy [ms]':>11} {'+100 produktów [ms]':>20}")
+    print("-" * 97)
+    for rozmiar in args.rozmiary:
+        zasiej_produkty(rozmiar)
+
+        start = time.perf_counter()
+        indeks = ZamiennikiProduktow.z_bazy()
+        budowa = time.perf_counter() - start
+
+        wzorce = (los.random((200, len(kalorie.SKLADNIKI))) * [900, 40, 80, 50]).tolist()
+        drzewo = mierz_opoznienie(lambda w: indeks.najblizsze(w, 10), wzorce, 1)
+        indeks.drzewo('test')  # drzewo kategorii budowane przy pierwszym zapytaniu
+        kategoria = mierz_opoznienie(lambda w: indeks.najblizsze(w, 10, 'test'), wzorce, 1)
+
+        wiersze = conn.execute("SELECT id, kalorie, bialko, weglowodany, tluszcze FROM produkty").fetchall()
+        skala = SKALA_ODLEGLOSCI.tolist()
+
+        def petla(wzorzec):
+            return heapq.nsmallest(10, wiersze, key=lambda w: sum(
+                ((a - b) / s) ** 2 for a, b, s in zip(w[1:], wzorzec, skala)))
+
+        czas_petli = mierz_opoznienie(petla, wzorce[:5], 1)
+
+        def przeglad(wzorzec):
+            odleglosci = ((indeks.punkty - np.asarray(wzorzec) / SKALA_ODLEGLOSCI) ** 2).sum(axis=1)
+            najblizsze = np.argpartition(odleglosci, 10)[:10]
+            return np.sqrt(np.sort(odleglosci[najblizsze]))
+
+        numpy = mierz_opoznienie(przeglad, wzorce[:20], 1)
+
+        with conn:
+            conn.executemany("""
+                INSERT INTO produkty (nazwa, kalorie, bialko, weglowodany, tluszcze, kategoria, nazwa_szukaj)
+                VALUES (?, ?, ?, ?, ?, 'test', ?)
+            """, ((f"Zamiennik {rozmiar} {i}", i, i % 40, i % 80, i % 50, f"zamiennik {rozmiar} {i}")
+                  for i in range(100)))
+        start = time.perf_counter()
+        indeks = indeks.aktualizuj()
+        dopisanie = (time.perf_counter() - start) * 1000
+
+        print(f"{len(indeks):>10} {budowa:>11.2f} {drzewo:>12.3f} {kategoria:>15.3f} "
+              f"{czas_petli:>11.1f} {numpy:>11.2f} {dopisanie:>20.1f}")
+
+
+# Sylaby do budowy słownika syntetycznych słów w scenariuszu literowki
+SYLABY = ("ma", "ko", "rze", "sło", "wa", "ni", "ką", "ty", "po", "mi", "ło", "be", "cz", "ja",
+          "ża", "grusz", "dro", "bi", "le", "śni", "pa", "ro", "ge", "tu", "sz", "ól", "na", "ek")
+
+
+def literowka(slowo: str, los) -> str:
+    """Wprowadza jedną literówkę (zamiana, usunięcie, wstawienie lub przestawienie) poza pierwszą literą."""
+    if len(slowo) < 4:
+        return slowo
+    i = los.randrange(1, len(slowo) - 1)
+    rodzaj = los.randrange(4)
+    litera = los.choice('abcdeiklmnoprstuwyz')
+    if rodzaj == 0:
+        return slowo[:i] + litera + slowo[i + 1:]
+    if rodzaj == 1:
+        return slowo[:i] + slowo[i + 1:]
+    if rodzaj == 2:
+        return slowo[:i] + litera + slowo[i:]
+    return slowo[:i] + slowo[i + 1] + slowo[i] + slowo[i + 2:]
+
+
+def scenariusz_literowki(args):
+    """Czas budowy indeksu przybliżonego i zapytań z literówkami dla rosnącej liczby nazw."""
+    from indeks import IndeksPrzyblizony
+
+    los = random.Random(1)
+    slownik = sorted({''.join(los.choices(SYLABY, k=los.randint(2, 4))) for _ in range(30000)} | set(SLOWA))
+    # Częstość słów w nazwach jak w języku naturalnym (rozkład Zipfa)
+    wagi = [1 / (i + 1) for i in range(len(slownik))]
+    los.shuffle(wagi)
+
+    print(f"Słownik: {len(slownik)} słów")
+    print(f"{'Nazw':>10} {'budowa [s]':>11} {'literówka [ms]':>15} {'p95 [ms]':>9} "
+          f"{'początek [ms]':>14} {'2 słowa [ms]':>13} {'trafione':>9}")
+    print("-" * 88)
+    for rozmiar in args.rozmiary:
+        nazwy = [' '.join(los.choices(slownik, wagi, k=los.randint(2, 4))).capitalize() + f" {i}"
+                 for i in range(rozmiar)]
+        start = time.perf_counter()
+        indeks = IndeksPrzyblizony([(i, nazwa, los.randrange(20)) for i, nazwa in enumerate(nazwy)])
+        budowa = time.perf_counter() - start
+
+        proby = [los.choice(nazwy) for _ in range(300)]
+        slowa = [kalorie.normalizuj(n.split()[0]) for n in proby]
+        z_literowka = [literowka(s, los) for s in slowa]
+        poczatki = [s[:los.randint(2, len(s))] for s in slowa]
+        dwa_slowa = [literowka(kalorie.normalizuj(' '.join(n.split()[:2])), los) for n in proby]
+
+        # Bez zapamiętanych dopasowań słów - każde zapytanie liczy odległości od nowa
+        def szukaj(fraza):
+            indeks.podobne_slowa.cache_clear()
+            return indeks.szukaj(fraza, 25)
+
+        czasy = []
+        trafione = 0
+        for fraza, slowo in zip(z_literowka, slowa):
+            indeks.podobne_slowa.cache_clear()
+            start = time.perf_counter()
+            wyniki = indeks.szukaj(fraza, 25)
+            czasy.append((time.perf_counter() - start) * 1000)
+            trafione += any(kalorie.normalizuj(nazwy[i].split()[0]) == slowo for i in wyniki)
+        czasy.sort()
+        poczatek = mierz_opoznienie(szukaj, poczatki, 1)
+        dwa = mierz_opoznienie(szukaj, dwa_slowa, 1)
+
+        print(f"{len(indeks):>10} {budowa:>11.2f} {sum(czasy) / len(czasy):>15.3f} {percentyl(czasy, 95):>9.3f} "
+              f"{poczatek:>14.3f} {dwa:>13.3f} {trafione / len(proby):>9.0%}")
+
+
+def slad_pisania(liczba_slow: int, ziarno: int = 1):
+    """Frazy wysyłane przez przeglądarkę przy wpisywaniu kolejnych słów.
+
+    Zapytanie idzie po przerwie w pisaniu dłuższej niż debounce (300 ms) albo po
+    ostatniej literze; połowa słów jest wpisywana bez polskich znaków.
+    """
+    los = random.Random(ziarno)
+    for _ in range(liczba_slow):
+        slowo = los.choice(SLOWA)
+        if los.random() < 0.5:
+            slowo = kalorie.usun_polskie_znaki(slowo)
+        for dlugosc in range(2, len(slowo) + 1):
+            if dlugosc == len(slowo) or los.random() < 0.3:
+                yield slowo[:dlugosc]
+
+
+def percentyl(posortowane, p: float) -> float:
+    """Percentyl (metoda najbliższego rangą) z posortowanej listy."""
+    if not posortowane:
+        return 0.0
+    return posortowane[min(len(posortowane) - 1, max(0, int(round(p / 100 * len(posortowane))) - 1))]
+
+
+class KlientFlask:
+    """Zapytania przez klienta testowego Flaska (w tym samym procesie)."""
+
+    def __init__(self, aplikacja):
+        self.klient = aplikacja.test_client()
+
+    def zapytanie(self, metoda: str, sciezka: str, **kwargs) -> int:
+        return self.klient.open(sciezka, method=metoda, **kwargs).status_code
+
+
+class KlientHttp:
+    """Zapytania HTTP do uruchomionego serwera (jedna sesja keep-alive na użytkownika)."""
+
+    def __init__(self, adres: str):
+        self.adres = adres
+        self.sesja = requests.Session()
+
+    def zapytanie(self, metoda: str, sciezka: str, **kwargs) -> int:
+        return self.sesja.request(metoda, self.adres + sciezka, allow_redirects=False, timeout=30, **kwargs).status_code
+
+
+def uruchom_serwer(polecenie, srodowisko: dict):
+    """Startuje serwer aplikacji (moduł pythona z argumentami, "{port}" zostanie podstawiony)
+    na wolnym porcie i czeka, aż zacznie odpowiadać."""
+    with socket.socket() as gniazdo:
+        gniazdo.bind(('127.0.0.1', 0))
+        port = gniazdo.getsockname()[1]
+    proces = subprocess.Popen(
+        [sys.executable, '-m'] + [str(arg).format(port=port) for arg in polecenie],
+        cwd=Path(__file__).parent, env=dict(os.environ, **srodowisko), stdout=subprocess.DEVNULL,
+    )
+    adres = f'http://127.0.0.1:{port}'
+    koniec = time.monotonic() + 30
+    while time.monotonic() < koniec:
+        try:
+            requests.get(adres + '/login', timeout=1)
+            return proces, adres
+        except requests.ConnectionError:
+            if proces.poll() is not None:
+                raise RuntimeError(f"{polecenie[0]} zakończył się przy starcie")
+            time.sleep(0.1)
+    proces.terminate()
+    raise RuntimeError(f"{polecenie[0]} nie odpowiada")
+
+
+def obciazenie(nowy_klient, uzytkownicy: int, czas: float, slowa_w_sesji: int = 5):
+    """Odtwarza sesje użytkowników równolegle przez `czas` sekund.
+
+    Sesja: logowanie, wpisanie kilku słów (dla każdej frazy dwa zapytania, jak
+    w przeglądarce: lokalne i baza oraz online), zapisanie produktu, wylogowanie.
+    Zwraca {operacja: lista czasów [ms]}, {operacja: liczba błędów} i czas trwania.
+    """
+    czasy = {}
+    bledy = {}
+    lock = threading.Lock()
+    przebieg = time.monotonic_ns()  # nazwy zapisywanych produktów nie powtarzają się między przebiegami
+    koniec = time.perf_counter() + czas
+
+    def uzytkownik(nr):
+        klient = nowy_klient()
+        lokalne = {}
+        slad = slad_pisania(10 ** 9, ziarno=nr)
+        sesja = 0
+
+        def zmierz(operacja, metoda, sciezka, oczekiwane=(200, 302), **kwargs):
+            start = time.perf_counter()
+            status = klient.zapytanie(metoda, sciezka, **kwargs)
+            lokalne.setdefault(operacja, []).append((time.perf_counter() - start) * 1000)
+            if status not in oczekiwane:
+                with lock:
+                    bledy[operacja] = bledy.get(operacja, 0) + 1
+
+        while time.perf_counter() < koniec:
+            sesja += 1
+            zmierz('login', 'POST', '/login', data={'login': 'bench', 'haslo': 'tajne-haslo'}, oczekiwane=(302,))
+            fraz = 0
+            for fraza in slad:
+                zmierz('szukaj', 'GET', f'/api/szukaj?q={fraza}&zrodla=lokalne,baza')
+                zmierz('szukaj_online', 'GET', f'/api/szukaj?q={fraza}&zrodla=online')
+                fraz += 1
+                if fraz >= slowa_w_sesji * 3 or time.perf_counter() >= koniec:
+                    break
+            zmierz('zapisz', 'POST', '/api/zapisz', oczekiwane=(200,), json={
+                'nazwa': f'Produkt testowy {przebieg}-{nr}-{sesja}', 'kalorie': 120, 'bialko': 5, 'weglowodany': 20, 'tluszcze': 2,
+            })
+            zmierz('logout', 'GET', '/logout')
+
+        with lock:
+            for operacja, lista in lokalne.items():
+                czasy.setdefault(operacja, []).extend(lista)
+
+    watki = [threading.Thread(target=uzytkownik, args=(nr,)) for nr in range(uzytkownicy)]
+    start = time.perf_counter()
+    for w in watki:
+        w.start()
+    for w in watki:
+        w.join()
+    return czasy, bledy, time.perf_counter() - start
+
+
+def podsumuj(czasy: dict, bledy: dict, trwanie: float) -> dict:
+    """Percentyle opóźnień [ms] i przepustowość [zapytań/s] dla każdej operacji."""
+    wynik = {}
+    zapytania = sum(map(len, czasy.values()))
+    wynik['razem'] = {
+        'zapytania': zapytania,
+        'bledy': sum(bledy.values()),
+        'na_sekunde': round(zapytania / trwanie, 1),
+    }
+    for operacja, lista in sorted(czasy.items()):
+        lista = sorted(lista)
+        wynik[operacja] = {
+            'zapytania': len(lista),
+            'bledy': bledy.get(operacja, 0),
+            'na_sekunde': round(len(lista) / trwanie, 1),
+            'p50_ms': round(percentyl(lista, 50), 2),
+            'p95_ms': round(percentyl(lista, 95), 2),
+            'p99_ms': round(percentyl(lista, 99), 2),
+        }
+    return wynik
+
+
+def porownaj(wyniki: dict, bazowe: dict, tolerancja: float):
+    """Zwraca opisy regresji: p95 gorsze lub przepustowość niższa o więcej niż `tolerancja`."""
+    regresje = []
+    for cel, operacje in wyniki['cele'].items():
+        for operacja, w in operacje.items():
+            b = bazowe.get('cele', {}).get(cel, {}).get(operacja)
+            if not b:
+                continue
+            if 'p95_ms' in w and w['p95_ms'] > b['p95_ms'] * (1 + tolerancja):
+                regresje.append(f"{cel}/{operacja}: p95 {b['p95_ms']} -> {w['p95_ms']} ms")
+            if w['na_sekunde'] < b['na_sekunde'] * (1 - tolerancja):
+                regresje.append(f"{cel}/{operacja}: {b['na_sekunde']} -> {w['na_sekunde']} zapytań/s")
+    return regresje
+
+
+def scenariusz_obciazenie(args):
+    """Test obciążeniowy aplikacji: ślad pisania przez klienta testowego Flaska, gunicorna
+    i opcjonalnie uvicorna (tryb ASGI).
+
+    Open Food Facts zastępuje lokalny serwer-atrapa z opóźnieniem --opoznienie.
+    Wynik (JSON) trafia do --wynik albo na standardowe wyjście; z --porownaj
+    scenariusz kończy się kodem 1, jeśli wynik jest gorszy od bazowego.
+    """
+    kalorie.init_db()
+    zasiej_produkty(args.produkty)
+    kalorie.dodaj_uzytkownika('bench', 'tajne-haslo')
+    kalorie.zamknij_polaczenie()
+
+    stub = StubOpenFoodFacts(opoznienie=args.opoznienie)
+    os.environ['OFF_URL'] = stub.adres
+    # Atrapa to nie publiczne API - limit zapytań nie ograniczałby pomiaru
+    os.environ['LIMIT_API_SZUKAJ'] = '0'
+    import app
+
+    wyniki = {
+        'produkty': args.produkty,
+        'uzytkownicy': args.watki,
+        'czas_s': args.czas,
+        'opoznienie_api_ms': args.opoznienie * 1000,
+        'cele': {},
+    }
+    serwery = {}
+    if args.workery:
+        serwery['gunicorn'] = ['gunicorn', 'app:app', '-b', '127.0.0.1:{port}', '-w', args.workery,
+                               '--threads', args.watki, '--log-level', 'warning']
+        if args.asgi:
+            serwery['uvicorn'] = ['uvicorn', 'asgi:app', '--port', '{port}', '--workers', args.workery,
+                                  '--log-level', 'warning']
+
+    try:
+        czasy, bledy, trwanie = obciazenie(lambda: KlientFlask(app.app), args.watki, args.czas)
+        wyniki['cele']['flask'] = podsumuj(czasy, bledy, trwanie)
+        for cel, polecenie in serwery.items():
+            proces, adres = uruchom_serwer(polecenie, {'OFF_URL': stub.adres})
+            try:
+                czasy, bledy, trwanie = obciazenie(lambda: KlientHttp(adres), args.watki, args.czas)
+                wyniki['cele'][cel] = podsumuj(czasy, bledy, trwanie)
+            finally:
+                proces.terminate()
+                proces.wait()
+    finally:
+        stub.zatrzymaj()
+
+    print(f"{'Cel':<10} {'Operacja':<15} {'zapytań/s':>10} {'p50 [ms]':>10} {'p95 [ms]':>10} {'p99 [ms]':>10} "
+          f"{'błędy':>6}", file=sys.stderr)
+    for cel, operacje in wyniki['cele'].items():
+        for operacja, w in operacje.items():
+            print(f"{cel:<10} {operacja:<15} {w['na_sekunde']:>10} {w.get('p50_ms', ''):>10} "
+                  f"{w.get('p95_ms', ''):>10} {w.get('p99_ms', ''):>10} {w['bledy']:>6}", file=sys.stderr)
+
+    tekst = json.dumps(wyniki, indent=2, ensure_ascii=False)
+    if args.wynik:
+        Path(args.wynik).write_text(tekst + '\n', encoding='utf-8')
+    else:
+        print(tekst)
+
+    if args.porownaj:
+        regresje = porownaj(wyniki, json.loads(Path(args.porownaj).read_text(encoding='utf-8')), args.tolerancja)
+        for opis in regresje:
+            print(f"REGRESJA {opis}", file=sys.stderr)
+        if regresje:
+            return 1
+    return 0
+
+
+# Liczba uruchomień procesu w każdym wariancie scenariusza start
+STARTY = 5
+
+# Pomiar w osobnym procesie: import aplikacji i opcjonalnie pierwsze wyszukiwanie (czasy w ms)
+KOD_STARTU = """
+import sys, time
+start = time.perf_counter()
+import app
+zaimportowano = time.perf_counter()
+if sys.argv[1] == 'szukaj':
+    klient = app.app.test_client()
+    with klient.session_transaction() as sesja:
+        sesja['zalogowany'] = True
+        sesja['uzytkownik'] = 'bench'
+    klient.get('/api/szukaj?q=jablko&zrodla=lokalne,baza')
+print((zaimportowano - start) * 1000, (time.perf_counter() - start) * 1000, 'numpy' in sys.modules)
+"""
+
+
+def scenariusz_start(args):
+    """Start workera: import aplikacji na aktualnej i na nowej bazie (z migracjami schematu)
+    oraz pierwsze wyszukiwanie, które ładuje odłożone moduły i dane.
+
+    Każdy pomiar to nowy proces, tak jak start workera. Na koniec moduły importowane
+    przez app, które ładują się najdłużej (python -X importtime).
+    """
+    kalorie.init_db()
+    zasiej_produkty(args.produkty)
+    kalorie.zamknij_polaczenie()
+
+    def uruchom(polecenie, baza=None):
+        srodowisko = dict(os.environ, KALORIE_DB=str(baza)) if baza else None
+        return subprocess.run([sys.executable, *polecenie], cwd=Path(__file__).parent, env=srodowisko,
+                              capture_output=True, text=True, check=True)
+
+    warianty = (
+        ('import app, aktualna baza', 'import', lambda i: None),
+        ('import app, nowa baza', 'import', lambda i: Path(_KATALOG) / f'nowa{i}.db'),
+        ('import + pierwsze wyszukiwanie', 'szukaj', lambda i: None),
+    )
+    print(f"{'wariant':<32} {'import [ms]':>12} {'razem [ms]':>12}  NumPy")
+    for opis, tryb, baza in warianty:
+        pomiary = [uruchom(['-c', KOD_STARTU, tryb], baza(i)).stdout.split() for i in range(STARTY)]
+        importy = sorted(float(p[0]) for p in pomiary)
+        razem = sorted(float(p[1]) for p in pomiary)
+        numpy = pomiary[0][2] == 'True'
+        print(f"{opis:<32} {percentyl(importy, 50):12.1f} {percentyl(razem, 50):12.1f}  "
+              f"{'tak' if numpy else 'nie'}")
+
+    # Linie "import time: własny | łącznie | moduł" - wcięcie nazwy to poziom zagnieżdżenia,
+    # a moduły importowane przez app są wypisywane przed nim, o poziom głębiej
+    bezposrednie = []
+    for linia in uruchom(['-X', 'importtime', '-c', 'import app']).stderr.splitlines():
+        if not linia.startswith('import time:') or linia.endswith('imported package'):
+            continue
+        _, lacznie, nazwa = linia.split('|')
+        poziom = len(nazwa) - len(nazwa.lstrip())
+        if poziom == 1 and nazwa.strip() == 'app':
+            app_lacznie = int(lacznie)
+            break
+        if poziom == 1:
+            bezposrednie = []
+        elif poziom == 3:
+            bezposrednie.append((int(lacznie), nazwa.strip()))
+    print(f"\npython -X importtime -c 'import app': {app_lacznie / 1000:.1f} ms, najdłuższe importy:")
+    for lacznie, nazwa in heapq.nlargest(8, bezposrednie):
+        print(f"  {nazwa:<24} {lacznie / 1000:8.1f} ms")
+
+
+SCENARIUSZE = {
+    'klient_api': scenariusz_klient_api,
+    'limit_api': scenariusz_limit_api,
+    'literowki': scenariusz_literowki,
+    'logowanie': scenariusz_logowanie,
+    'obciazenie': scenariusz_obciazenie,
+    'obliczenia': scenariusz_obliczenia,
+    'odwiedziny': scenariusz_odwiedziny,
+    'polaczenia': scenariusz_polaczenia,
+    'przegladanie': scenariusz_przegladanie,
+    'start': scenariusz_start,
+    'wyszukiwanie': scenariusz_wyszukiwanie,
+    'zamienniki': scenariusz_zamienniki,
+}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('scenariusz', choices=sorted(SCENARIUSZE))
+    parser.add_argument('--produkty', type=int, default=1000, help="liczba produktów w bazie")
+    parser.add_argument('--watki', type=int, default=4, help="liczba równoległych wątków")
+    parser.add_argument('--czas', type=float, default=2.0, help="czas pomiaru jednego wariantu [s]")
+    parser.add_argument('--rozmiary', type=int, nargs='+', default=[10000, 100000, 1000000],
+                        help="liczby produktów w scenariuszach obliczenia, przegladanie, literowki i zamienniki")
+    parser.add_argument('--opoznienie', type=float, default=0.0, help="opóźnienie serwera-atrapy API [s]")
+    parser.add_argument('--workery', type=int, default=2,
+                        help="workery gunicorna w scenariuszu obciazenie (0 = tylko klient testowy)")
+    parser.add_argument('--asgi', action='store_true',
+                        help="w scenariuszu obciazenie także tryb ASGI (uvicorn asgi:app)")
+    parser.add_argument('--wynik', help="plik JSON z wynikiem scenariusza obciazenie")
+    parser.add_argument('--porownaj', help="plik JSON z wynikiem bazowym - kod 1 przy regresji")
+    parser.add_argument('--tolerancja', type=float, default=0.2, help="dopuszczalne pogorszenie przy --porownaj")
+    args = parser.parse_args()
+
+    return SCENARIUSZE[args.scenariusz](args) or 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,164 @@
+"""
+Import zrzutu bazy Open Food Facts do lokalnej bazy produktów.
+
+Obsługuje eksport CSV (rozdzielany tabulatorami) i JSONL, także spakowane gzipem.
+Plik jest czytany strumieniowo, a produkty zapisywane partiami w jednej transakcji
+na partię. Postęp jest zapisywany razem z partią, więc przerwany import można wznowić.
+
+Użycie: python import_off.py en.openfoodfacts.org.products.csv.gz [--partia 5000]
+"""
+
+import argparse
+import csv
+import gzip
+import json
+import sys
+import time
+from pathlib import Path
+
+from kalorie import init_db, get_connection, normalizuj, normalizuj_kod
+from openfoodfacts import produkt_z_off
+
+# Pola wartości odżywczych, które czytamy z kolumn eksportu CSV
+POLA_ODZYWCZE = ('energy-kcal_100g', 'energy_100g', 'proteins_100g', 'carbohydrates_100g', 'fat_100g')
+
+
+def otworz(plik: Path):
+    """Otwiera plik tekstowy, rozpakowując go w locie, jeśli jest skompresowany."""
+    if plik.suffix == '.gz':
+        return gzip.open(plik, 'rt', encoding='utf-8', newline='')
+    return open(plik, encoding='utf-8', newline='')
+
+
+def liczba(wartosc):
+    """Zamienia tekst z CSV na liczbę; puste i niepoprawne wartości pomija."""
+    try:
+        return float(wartosc) if wartosc else None
+    except ValueError:
+        return None
+
+
+def czytaj_csv(plik):
+    """Zwraca kolejne produkty z eksportu CSV w formacie odpowiedzi API."""
+    csv.field_size_limit(sys.maxsize)
+    for wiersz in csv.DictReader(plik, delimiter='\t', quoting=csv.QUOTE_NONE):
+        nutriments = {}
+        for pole in POLA_ODZYWCZE:
+            wartosc = liczba(wiersz.get(pole))
+            if wartosc is not None:
+                nutriments[pole] = wartosc
+        yield {
+            'code': wiersz.get('code', ''),
+            'product_name': wiersz.get('product_name_pl') or wiersz.get('product_name', ''),
+            'brands': wiersz.get('brands', ''),
+            'nutriments': nutriments,
+        }
+
+
+def czytaj_jsonl(plik):
+    """Zwraca kolejne produkty z eksportu JSONL."""
+    for linia in plik:
+        try:
+            product = json.loads(linia)
+        except ValueError:
+            yield {}
+            continue
+        if product.get('product_name_pl'):
+            product['product_name'] = product['product_name_pl']
+        yield product
+
+
+def wiersz_produktu(product, kategoria):
+    """Zwraca krotkę do INSERT albo None dla produktów bez nazwy lub wartości odżywczych.
+
+    Niepoprawny kod kreskowy nie odrzuca produktu - zapisujemy go bez kodu.
+    """
+    nutriments = product.get('nutriments') or {}
+    if not any(pole in nutriments for pole in POLA_ODZYWCZE):
+        return None
+    try:
+        p = produkt_z_off(product)
+    except (TypeError, ValueError):
+        return None
+    if p is None:
+        return None
+    try:
+        kod = normalizuj_kod(p['kod'])
+    except ValueError:
+        kod = None
+    nazwa = p['nazwa'].strip()[:200]
+    return (nazwa, p['kalorie'], p['bialko'], p['weglowodany'], p['tluszcze'], kategoria, kod, normalizuj(nazwa))
+
+
+def importuj(sciezka: Path, format_pliku: str, partia: int, kategoria: str, od_nowa: bool):
+    """Importuje plik i wypisuje postęp. Zwraca liczbę dodanych produktów."""
+    init_db()
+    conn = get_connection()
+    klucz_postepu = f"import_off:{sciezka.name}"
+
+    pominiete = 0
+    if not od_nowa:
+        wynik = conn.execute("SELECT wartosc FROM statystyki WHERE klucz = ?", (klucz_postepu,)).fetchone()
+        pominiete = wynik[0] if wynik else 0
+        if pominiete:
+            print(f"Wznawiam import od rekordu {pominiete}.")
+
+    dodane = 0
+    przetworzone = pominiete
+    start = time.perf_counter()
+
+    def zapisz_partie(wiersze):
+        nonlocal dodane
+        # Produkt z nazwą albo kodem kreskowym, który już jest w bazie, jest pomijany
+        with conn:
+            cursor = conn.executemany("""
+                INSERT OR IGNORE INTO produkty (nazwa, kalorie, bialko, weglowodany, tluszcze, kategoria, kod,
+                                                nazwa_szukaj)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+            """, wiersze)
+            dodane += cursor.rowcount
+            conn.execute("INSERT OR REPLACE INTO statystyki (klucz, wartosc) VALUES (?, ?)",
+                         (klucz_postepu, przetworzone))
+        predkosc = (przetworzone - pominiete) / max(time.perf_counter() - start, 1e-9)
+        print(f"  {przetworzone} rekordów, dodano {dodane} ({predkosc:.0f} rekordów/s)")
+
+    with otworz(sciezka) as plik:
+        czytnik = czytaj_csv(plik) if format_pliku == 'csv' else czytaj_jsonl(plik)
+        wiersze = []
+        for nr, product in enumerate(czytnik):
+            if nr < pominiete:
+                continue
+            przetworzone = nr + 1
+            wiersz = wiersz_produktu(product, kategoria)
+            if wiersz:
+                wiersze.append(wiersz)
+            if przetworzone % partia == 0:
+                zapisz_partie(wiersze)
+                wiersze = []
+        zapisz_partie(wiersze)
+
+    czas = time.perf_counter() - start
+    print(f"\nGotowe: {przetworzone - pominiete} rekordów w {czas:.1f} s, dodano {dodane} produktów.")
+    return dodane
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Import zrzutu Open Food Facts (CSV/JSONL, także .gz)")
+    parser.add_argument('plik', type=Path)
+    parser.add_argument('--format', choices=('csv', 'jsonl'), help="domyślnie na podstawie rozszerzenia")
+    parser.add_argument('--partia', type=int, default=5000, help="liczba rekordów na transakcję")
+    parser.add_argument('--kategoria', default='openfoodfacts', help="kategoria nadawana produktom")
+    parser.add_argument('--od-nowa', action='store_true', help="ignoruj zapisany postęp importu")
+    args = parser.parse_args()
+
+    format_pliku = args.format
+    if not format_pliku:
+        rozszerzenia = args.plik.suffixes
+        format_pliku = 'jsonl' if '.jsonl' in rozszerzenia or '.json' in rozszerzenia else 'csv'
+
+    importuj(args.plik, format_pliku, args.partia, args.kategoria, args.od_nowa)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
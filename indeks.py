@@ -0,0 +1,283 @@
+"""
+Indeksy w pamięci do wyszukiwania produktów po nazwie.
+
+IndeksNazw szuka fragmentu nazwy - zapytanie sprawdza tylko kandydatów z indeksu n-gramów.
+IndeksPrzyblizony dopasowuje słowa frazy z literówkami (ograniczona odległość edycyjna).
+"""
+
+import heapq
+import itertools
+import re
+from bisect import bisect_left
+from collections import defaultdict
+from functools import lru_cache
+
+from kalorie import OSTATNI_ZNAK, normalizuj, usun_polskie_znaki
+
+# Najdłuższy indeksowany n-gram; dłuższe frazy zawężamy najrzadszym trigramem
+DLUGOSC_NGRAMU = 3
+
+# Słowo nazwy lub frazy: co najmniej dwie litery (liczby i pojedyncze litery są pomijane)
+SLOWO = re.compile(r'[^\W\d_]{2,}')
+
+# Liczba pierwszych znaków słowa, w których nie szukamy literówek - mocno zawęża
+# przeglądane słowa (jak prefix_length w wyszukiwarkach pełnotekstowych)
+DOKLADNY_POCZATEK = 1
+
+# Dłuższe słowa frazy są przycinane - odległość liczymy na bitach liczby 64-bitowej
+MAKS_DLUGOSC_SLOWA = 63
+
+# Ile ostatnio dopasowanych słów frazy pamiętać (przy pisaniu kolejne zapytania je powtarzają)
+CACHE_SLOW = 4096
+
+
+def ngramy(tekst: str, n: int):
+    """Zwraca zbiór wszystkich n-gramów tekstu."""
+    return {tekst[i:i + n] for i in range(len(tekst) - n + 1)}
+
+
+class IndeksNazw:
+    """Indeks n-gramów (1-3 znaki) znormalizowanych nazw produktów."""
+
+    def __init__(self, produkty):
+        self.produkty = []
+        self.nazwy = []
+        self.ngramy = defaultdict(list)
+        for produkt in produkty:
+            self.dodaj(produkt)
+
+    def dodaj(self, produkt, nazwa_szukaj: str = None):
+        """Dodaje produkt (słownik z kluczem 'nazwa') do indeksu.
+
+        Można podać gotową, znormalizowaną nazwę, żeby jej nie liczyć ponownie.
+        """
+        nr = len(self.produkty)
+        nazwa = nazwa_szukaj if nazwa_szukaj is not None else normalizuj(produkt['nazwa'])
+        self.produkty.append(produkt)
+        self.nazwy.append(nazwa)
+        for n in range(1, DLUGOSC_NGRAMU + 1):
+            for ngram in ngramy(nazwa, n):
+                self.ngramy[ngram].append(nr)
+
+    def szukaj(self, fraza: str):
+        """Zwraca produkty, których nazwa zawiera frazę (w kolejności dodania)."""
+        szukana = normalizuj(fraza)
+        if not szukana:
+            return []
+
+        # Krótka fraza sama jest n-gramem - lista z indeksu to gotowy wynik
+        if len(szukana) <= DLUGOSC_NGRAMU:
+            return [self.produkty[nr] for nr in self.ngramy.get(szukana, ())]
+
+        kandydaci = min(
+            (self.ngramy.get(ngram, ()) for ngram in ngramy(szukana, DLUGOSC_NGRAMU)),
+            key=len
+        )
+        return [self.produkty[nr] for nr in kandydaci if szukana in self.nazwy[nr]]
+
+    def __len__(self):
+        return len(self.produkty)
+
+
+def tolerancja(slowo: str) -> int:
+    """Dopuszczalna liczba literówek w słowie frazy: 0 do 3 znaków, 1 do 7, dalej 2."""
+    return 0 if len(slowo) <= 3 else 1 if len(slowo) <= 7 else 2
+
+
+def odleglosci_poczatkow(szukane: str, kody, alfabet, maks: int):
+    """Dla każdego słowa (kolumny `kody`) najmniejsza odległość edycyjna `szukane` od jego początku.
+
+    Algorytm bitowy Myersa (wariant Hyyrö): kolumna tablicy Levenshteina jest trzymana
+    jako dwie maski bitów, a krok o jeden znak słowa to kilka operacji na liczbach -
+    tu naraz dla wszystkich słów (tablice NumPy). Znaki po końcu słowa mają kod 0,
+    który niczego nie dopasowuje, więc odległość już wtedy nie maleje.
+    Wystarczy len(szukane) + maks kroków - dłuższe początki są dalej niż maks.
+    """
+    import numpy as np
+
+    dlugosc = len(szukane)
+    pasuje = np.zeros(len(alfabet) + 1, dtype=np.uint64)  # bity pozycji znaku w `szukane`
+    for i, znak in enumerate(szukane):
+        if znak in alfabet:
+            pasuje[alfabet[znak]] |= np.uint64(1 << i)
+
+    liczba = kody.shape[1]
+    jeden = np.uint64(1)
+    ostatni = np.uint64(dlugosc - 1)
+    vp = np.full(liczba, (1 << dlugosc) - 1, dtype=np.uint64)
+    vn = np.zeros(liczba, dtype=np.uint64)
+    odleglosc = np.full(liczba, dlugosc, dtype=np.int64)
+    najmniejsza = odleglosc.copy()
+    for znaki in kody[:dlugosc + maks]:
+        eq = pasuje[znaki]
+        xv = eq | vn
+        xh = (((eq & vp) + vp) ^ vp) | eq
+        hp = vn | ~(xh | vp)
+        hn = vp & xh
+        odleglosc += ((hp >> ostatni) & jeden).view(np.int64)
+        odleglosc -= ((hn >> ostatni) & jeden).view(np.int64)
+        np.minimum(najmniejsza, odleglosc, out=najmniejsza)
+        hp = (hp << jeden) | jeden
+        vp = (hn << jeden) | ~(xv | hp)
+        vn = hp & xv
+    return najmniejsza
+
+
+class IndeksPrzyblizony:
+    """Wyszukiwanie z literówkami po słowach znormalizowanych nazw.
+
+    Każde słowo frazy jest dopasowywane do początków słów nazw z odległością edycyjną
+    najwyżej `tolerancja(slowo)`. Sprawdzane są tylko słowa o tej samej pierwszej literze
+    (zakres posortowanej listy słów), wszystkie naraz - odleglosci_poczatkow.
+
+    Kolejność wyników: najpierw nazwy zaczynające się od słowa pasującego do pierwszego
+    słowa frazy, potem mniejsza suma odległości, a na końcu popularność produktu.
+    """
+
+    def __init__(self, produkty, wersja=None):
+        """produkty: krotki (produkt, nazwa, popularnosc); produkt jest zwracany w wynikach."""
+        self.wersja = wersja
+        # Numer produktu to jego miejsce w rankingu popularności - listy wystąpień są od razu posortowane
+        uporzadkowane = sorted(produkty, key=lambda p: (-p[2], len(p[1]), p[1]))
+        self.produkty = [p[0] for p in uporzadkowane]
+        self.slowa_nazw = []
+        self.wystapienia = {}
+        self.pierwsze = defaultdict(list)
+        self.pisownia = {}
+
+        for nr, (_, nazwa, _) in enumerate(uporzadkowane):
+            slowa = []
+            for oryginal in SLOWO.findall(nazwa.lower()):
+                slowo = usun_polskie_znaki(oryginal)
+                lista = self.wystapienia.setdefault(slowo, [])
+                if not lista or lista[-1] != nr:
+                    lista.append(nr)
+                # Zapamiętujemy pisownię z polskimi znakami, jeśli któraś nazwa ją ma
+                if self.pisownia.get(slowo, slowo) == slowo:
+                    self.pisownia[slowo] = oryginal
+                slowa.append(slowo)
+            if slowa:
+                self.pierwsze[slowa[0]].append(nr)
+            self.slowa_nazw.append(tuple(slowa))
+        self.pierwsze = dict(self.pierwsze)
+
+        # Słowa jako macierz kodów znaków (znak x słowo), uzupełniona zerami.
+        # NumPy jest importowany dopiero tutaj - start workera go nie potrzebuje.
+        import numpy as np
+
+        self.slowa = sorted(self.wystapienia)
+        dlugosc = max(map(len, self.slowa), default=0)
+        dlugosc = max(dlugosc, 1)
+        punkty = np.array(self.slowa, dtype=f'<U{dlugosc}').view(np.uint32).reshape(len(self.slowa), dlugosc)
+        znaki, kody = np.unique(np.concatenate(([0], punkty.ravel())), return_inverse=True)
+        self.alfabet = {chr(z): kod for kod, z in enumerate(znaki.tolist()) if z}
+        self.kody = np.ascontiguousarray(kody[1:].reshape(punkty.shape).T)
+        self.podobne_slowa = lru_cache(maxsize=CACHE_SLOW)(self.podobne_slowa)
+
+    def podobne_slowa(self, szukane: str):
+        """Słowa, których początek różni się od `szukane` najwyżej o tolerancja(szukane) edycji.
+
+        Zwraca {slowo: odległość} (zapamiętany wynik - nie należy go zmieniać).
+        `szukane` musi być znormalizowane.
+        """
+        szukane = szukane[:MAKS_DLUGOSC_SLOWA]
+        maks = tolerancja(szukane)
+        poczatek = szukane[:DOKLADNY_POCZATEK] if maks else szukane
+        od = bisect_left(self.slowa, poczatek)
+        do = bisect_left(self.slowa, poczatek + OSTATNI_ZNAK, od)
+        if not maks:
+            return dict.fromkeys(self.slowa[od:do], 0)
+
+        odleglosci = odleglosci_poczatkow(szukane, self.kody[:, od:do], self.alfabet, maks)
+        return {self.slowa[od + i]: int(odleglosci[i]) for i in (odleglosci <= maks).nonzero()[0].tolist()}
+
+    def szukaj(self, fraza: str, limit: int, filtr=None):
+        """Zwraca do `limit` produktów pasujących do frazy, od najlepiej dopasowanych.
+
+        `filtr` (funkcja produkt -> bool) pozwala pominąć część produktów.
+        """
+        dopasowania = [self.podobne_slowa(slowo) for slowo in SLOWO.findall(normalizuj(fraza))]
+        if not dopasowania or not all(dopasowania):
+            return []
+        if len(dopasowania) == 1:
+            numery = self._najlepsze_dla_slowa(dopasowania[0], limit, filtr)
+        else:
+            numery = self._najlepsze_dla_frazy(dopasowania, limit, filtr)
+        return [self.produkty[nr] for nr in numery]
+
+    def _najlepsze_dla_slowa(self, dopasowane, limit, filtr):
+        """Jedno słowo: listy wystąpień są scalane w kolejności rankingu, aż do `limit` wyników."""
+        wynik = []
+        widziane = set()
+        odleglosci = sorted(set(dopasowane.values()))
+        for listy in (self.pierwsze, self.wystapienia):
+            for odleglosc in odleglosci:
+                for nr in heapq.merge(*(listy.get(s, ()) for s, o in dopasowane.items() if o == odleglosc)):
+                    if nr in widziane or (filtr and not filtr(self.produkty[nr])):
+                        continue
+                    widziane.add(nr)
+                    wynik.append(nr)
+                    if len(wynik) >= limit:
+                        return wynik
+        return wynik
+
+    def _najlepsze_dla_frazy(self, dopasowania, limit, filtr):
+        """Kilka słów: nazwy zawierające dopasowanie każdego słowa, grupowane po sumie odległości.
+
+        Odległości są małymi liczbami, więc zamiast oceniać każdą nazwę osobno, łączymy
+        zbiory nazw dla każdej kombinacji odległości słów (operacje na zbiorach).
+        """
+        poziomy = []
+        for dopasowane in dopasowania:
+            slowa_wg_odleglosci = defaultdict(list)
+            for slowo, odleglosc in dopasowane.items():
+                slowa_wg_odleglosci[odleglosc].append(slowo)
+            poziomy.append([
+                (odleglosc, set().union(*(self.wystapienia[s] for s in slowa)))
+                for odleglosc, slowa in slowa_wg_odleglosci.items()
+            ])
+
+        wg_sumy = defaultdict(set)
+        for kombinacja in itertools.product(*poziomy):
+            wspolne = set.intersection(*(numery for _, numery in kombinacja))
+            if wspolne:
+                wg_sumy[sum(odleglosc for odleglosc, _ in kombinacja)] |= wspolne
+        prefiksowe = set().union(*(self.pierwsze.get(s, ()) for s in dopasowania[0]))
+
+        # Każda nazwa zostaje tylko przy najmniejszej sumie
+        kolejne_sumy = []
+        widziane = set()
+        for suma in sorted(wg_sumy):
+            kolejne_sumy.append(wg_sumy[suma] - widziane)
+            widziane |= wg_sumy[suma]
+
+        wynik = []
+        for czy_prefiks in (True, False):
+            for numery in kolejne_sumy:
+                for nr in sorted(numery & prefiksowe if czy_prefiks else numery - prefiksowe):
+                    if filtr and not filtr(self.produkty[nr]):
+                        continue
+                    wynik.append(nr)
+                    if len(wynik) >= limit:
+                        return wynik
+        return wynik
+
+    def pisownia_slowa(self, slowo: str) -> str:
+        """Słowo frazy zapisane jak w znanych nazwach: z polskimi znakami i bez literówek.
+
+        Niedokończone słowo dostaje tylko polskie znaki najczęstszego słowa, które się
+        od niego zaczyna. Słowo z polskimi znakami albo bez dopasowania zostaje bez zmian.
+        """
+        szukane = slowo.lower()
+        if not SLOWO.fullmatch(szukane) or usun_polskie_znaki(szukane) != szukane:
+            return slowo
+        podobne = self.podobne_slowa(szukane)
+        if not podobne:
+            return slowo
+        najlepsze = min(podobne, key=lambda s: (podobne[s], -len(self.wystapienia[s]), s))
+        if podobne[najlepsze] == 0:
+            return self.pisownia[najlepsze][:len(szukane)]
+        return self.pisownia[najlepsze]
+
+    def __len__(self):
+        return len(self.produkty)
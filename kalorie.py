@@ -3,23 +3,142 @@ Prosta aplikacja do zarządzania bazą danych wartości kalorycznych produktów.
 Baza SQLite z możliwością rozbudowy do aplikacji webowej.
 """
 
+import atexit
+import csv
+import itertools
+import json
+import math
+import os
 import sqlite3
+import sys
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
 from werkzeug.security import generate_password_hash, check_password_hash
 
-DB_PATH = Path(__file__).parent / "kalorie.db"
+from metryki import mierzona
 
+DB_PATH = Path(os.environ.get('KALORIE_DB', Path(__file__).parent / "kalorie.db"))
 
+# Ustawienia połączenia - WAL pozwala czytać w trakcie zapisu,
+# a synchronous=NORMAL w trybie WAL nie robi fsync przy każdym commicie.
+PRAGMY = (
+    "PRAGMA journal_mode = WAL",
+    "PRAGMA synchronous = NORMAL",
+    "PRAGMA cache_size = -8000",
+    "PRAGMA mmap_size = 67108864",
+    "PRAGMA busy_timeout = 5000",
+    "PRAGMA temp_store = MEMORY",
+)
+
+# Liczba zapytań, których skompilowana postać jest trzymana przy połączeniu
+CACHE_ZAPYTAN = 256
+
+# Maksymalna liczba kluczy w jednym zapytaniu "IN (...)"
+ROZMIAR_PARTII_IN = 500
+
+# Znak większy od wszystkich innych - górna granica zakresu tekstów o danym początku
+OSTATNI_ZNAK = '\U0010ffff'
+
+# Ile wierszy pobieramy naraz, gdy wyniki są przeglądane strumieniowo
+ROZMIAR_PARTII_ODCZYTU = 1000
+
+# Kolejność wartości odżywczych w wierszach i wynikach obliczeń (na 100g)
+SKLADNIKI = ('kalorie', 'bialko', 'weglowodany', 'tluszcze')
+
+# Kolumny produktu w zapisie zbiorczym, imporcie i eksporcie (CSV, JSON)
+KOLUMNY_PRODUKTU = ('nazwa',) + SKLADNIKI + ('kategoria', 'kod')
+
+# Tabele sum dziennika: kolumna okresu i wyrażenie wyliczające ją z daty wpisu
+# (tydzień oznaczamy datą jego poniedziałku)
+OKRESY_DZIENNIKA = {
+    'dziennik_dni': ('data', "{0}.data"),
+    'dziennik_tygodnie': ('tydzien', "date({0}.data, '-6 days', 'weekday 1')"),
+}
+
+# Licznik odwiedzin zapisuje przyrosty do bazy co tyle sekund albo po tylu wizytach
+ODWIEDZINY_ZAPIS_CO = 5
+ODWIEDZINY_PROG = 100
+
+# Hashowanie haseł: metoda i koszt nowych hashy (starsze są aktualizowane przy logowaniu),
+# liczba wątków liczących hashe i limit logowań czekających na wolny wątek
+HASLO_METODA = os.environ.get('HASLO_METODA', 'scrypt:32768:8:1')
+HASLA_WATKI = int(os.environ.get('HASLA_WATKI', 2))
+HASLA_KOLEJKA = 16
+# Jak długo trzymać w pamięci hash hasła pobrany z bazy
+HASLA_CACHE_CZAS = 60
+# Limit nieudanych logowań na login z jednego adresu w oknie czasowym (sekundy)
+LOGOWANIE_PROBY = 5
+LOGOWANIE_OKNO = 300
+
+# Cache odpowiedzi Open Food Facts: maksymalna liczba wpisów i wiek, po którym
+# przeterminowany wpis jest usuwany (do tego czasu służy jako awaryjna odpowiedź)
+CACHE_API_MAKS_WPISOW = 5000
+CACHE_API_MAKS_WIEK = 7 * 24 * 3600
+# Jak rzadko odświeżać czas ostatniego użycia wpisu (żeby odczyt nie był zapisem)
+CACHE_API_ODSWIEZ_UZYCIE = 60
+
+_watek = threading.local()
+
+# Tablica zamiany polskich znaków na łacińskie (jedno przejście str.translate)
+ZAMIANA_PL = str.maketrans('ąćęłńóśźżĄĆĘŁŃÓŚŹŻ', 'acelnoszzACELNOSZZ')
+
+
+def usun_polskie_znaki(tekst):
+    """Zamienia polskie znaki na łacińskie."""
+    return tekst.translate(ZAMIANA_PL)
+
+
+def normalizuj(tekst):
+    """Sprowadza nazwę do postaci używanej w wyszukiwaniu (małe litery, bez polskich znaków)."""
+    if tekst is None:
+        return None
+    return usun_polskie_znaki(tekst.lower())
+
+
+def nowe_polaczenie():
+    """Otwiera nowe, skonfigurowane połączenie z bazą danych."""
+    conn = sqlite3.connect(DB_PATH, cached_statements=CACHE_ZAPYTAN)
+    for pragma in PRAGMY:
+        conn.execute(pragma)
+    # Używana przez migracje (wypełnienie nazwa_szukaj i indeksu pełnotekstowego)
+    conn.create_function('normalizuj', 1, normalizuj, deterministic=True)
+    return conn
+
+
+@mierzona('polaczenie')
 def get_connection():
-    """Zwraca połączenie z bazą danych."""
-    return sqlite3.connect(DB_PATH)
+    """Zwraca połączenie z bazą danych.
+
+    Każdy wątek (i każdy proces workera) dostaje jedno długo żyjące połączenie,
+    które jest używane ponownie przy kolejnych wywołaniach - nie należy go zamykać.
+    """
+    conn = getattr(_watek, 'conn', None)
+    # Po fork() (np. gunicorn --preload) połączenie rodzica nie nadaje się do użycia
+    if conn is None or _watek.pid != os.getpid():
+        conn = nowe_polaczenie()
+        _watek.conn = conn
+        _watek.pid = os.getpid()
+    return conn
+
+
+def zamknij_polaczenie():
+    """Zamyka połączenie bieżącego wątku (np. przed usunięciem pliku bazy)."""
+    conn = getattr(_watek, 'conn', None)
+    if conn is not None and _watek.pid == os.getpid():
+        conn.close()
+    _watek.conn = None
 
 
-def init_db():
-    """Inicjalizuje bazę danych - tworzy tabelę produktów jeśli nie istnieje."""
-    conn = get_connection()
-    cursor = conn.cursor()
+# Migracje schematu bazy. Funkcja z pozycji i przenosi bazę z wersji i do i + 1
+# (PRAGMA user_version). Zmiana schematu to nowa funkcja na końcu MIGRACJE - wykonanych
+# migracji się nie zmienia. Bazy sprzed numerowania wersji mają wersję 0 i dowolny
+# wcześniejszy stan schematu, dlatego migracje są idempotentne (IF NOT EXISTS).
 
+def _migracja_schemat(cursor):
+    """Tabele produktów, użytkowników, statystyk, cache API i dziennika z triggerami i indeksem FTS."""
     cursor.execute("""
         CREATE TABLE IF NOT EXISTS produkty (
             id INTEGER PRIMARY KEY AUTOINCREMENT,
@@ -52,37 +171,475 @@ def init_db():
     # Inicjalizuj licznik odwiedzin jeśli nie istnieje
     cursor.execute("INSERT OR IGNORE INTO statystyki (klucz, wartosc) VALUES ('odwiedziny', 0)")
 
-    conn.commit()
-    conn.close()
-    print("Baza danych zainicjalizowana.")
+    # Wersja zawartości tabeli produkty - zmienia się przy każdej modyfikacji
+    # (ETag wyników wyszukiwania i unieważnianie cache wyników)
+    cursor.execute("INSERT OR IGNORE INTO statystyki (klucz, wartosc) VALUES ('wersja_produktow', 0)")
+    for zdarzenie in ('INSERT', 'UPDATE', 'DELETE'):
+        cursor.execute(f"""
+            CREATE TRIGGER IF NOT EXISTS produkty_wersja_{zdarzenie.lower()} AFTER {zdarzenie} ON produkty BEGIN
+                UPDATE statystyki SET wartosc = wartosc + 1 WHERE klucz = 'wersja_produktow';
+            END
+        """)
+
+    # Cache odpowiedzi Open Food Facts współdzielony przez wszystkie workery
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS cache_api (
+            klucz TEXT PRIMARY KEY,
+            odpowiedz TEXT NOT NULL,
+            zapisano REAL NOT NULL,
+            uzyto REAL NOT NULL
+        )
+    """)
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_cache_api_uzyto ON cache_api (uzyto)")
 
+    # Lista produktów z kategorii w kolejności nazw (przegladaj_produkty)
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_produkty_kategoria_nazwa ON produkty (kategoria, nazwa)")
+
+    # Dziennik posiłków - wpis zapamiętuje wartości porcji, bo produkt może nie być w bazie
+    # (lista lokalna, Open Food Facts) albo zmienić się później
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS dziennik (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            uzytkownik TEXT NOT NULL,
+            data TEXT NOT NULL,
+            produkt TEXT NOT NULL,
+            gramy REAL NOT NULL,
+            kalorie REAL NOT NULL,
+            bialko REAL NOT NULL,
+            weglowodany REAL NOT NULL,
+            tluszcze REAL NOT NULL,
+            dodano TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    """)
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_dziennik_uzytkownik_data ON dziennik (uzytkownik, data)")
+
+    # Sumy dzienne i tygodniowe aktualizowane przyrostowo przez triggery -
+    # podsumowanie okresu czyta jeden wiersz na dzień, a nie wszystkie wpisy
+    for tabela, (kolumna, klucz) in OKRESY_DZIENNIKA.items():
+        cursor.execute(f"""
+            CREATE TABLE IF NOT EXISTS {tabela} (
+                uzytkownik TEXT NOT NULL,
+                {kolumna} TEXT NOT NULL,
+                pozycje INTEGER NOT NULL,
+                kalorie REAL NOT NULL,
+                bialko REAL NOT NULL,
+                weglowodany REAL NOT NULL,
+                tluszcze REAL NOT NULL,
+                PRIMARY KEY (uzytkownik, {kolumna})
+            ) WITHOUT ROWID
+        """)
+        cursor.execute(f"""
+            CREATE TRIGGER IF NOT EXISTS {tabela}_dodaj AFTER INSERT ON dziennik BEGIN
+                INSERT INTO {tabela} (uzytkownik, {kolumna}, pozycje, kalorie, bialko, weglowodany, tluszcze)
+                VALUES (new.uzytkownik, {klucz.format('new')}, 1, new.kalorie, new.bialko, new.weglowodany, new.tluszcze)
+                ON CONFLICT (uzytkownik, {kolumna}) DO UPDATE SET
+                    pozycje = pozycje + 1,
+                    kalorie = kalorie + excluded.kalorie,
+                    bialko = bialko + excluded.bialko,
+                    weglowodany = weglowodany + excluded.weglowodany,
+                    tluszcze = tluszcze + excluded.tluszcze;
+            END
+        """)
+        cursor.execute(f"""
+            CREATE TRIGGER IF NOT EXISTS {tabela}_usun AFTER DELETE ON dziennik BEGIN
+                UPDATE {tabela} SET
+                    pozycje = pozycje - 1,
+                    kalorie = kalorie - old.kalorie,
+                    bialko = bialko - old.bialko,
+                    weglowodany = weglowodany - old.weglowodany,
+                    tluszcze = tluszcze - old.tluszcze
+                WHERE uzytkownik = old.uzytkownik AND {kolumna} = {klucz.format('old')};
+                DELETE FROM {tabela}
+                WHERE uzytkownik = old.uzytkownik AND {kolumna} = {klucz.format('old')} AND pozycje = 0;
+            END
+        """)
+
+    # Indeks pełnotekstowy znormalizowanych nazw (trigramy - dopasowanie fragmentów)
+    cursor.execute("SELECT 1 FROM sqlite_master WHERE name = 'produkty_fts'")
+    nowy_indeks = cursor.fetchone() is None
+
+    cursor.execute("""
+        CREATE VIRTUAL TABLE IF NOT EXISTS produkty_fts
+        USING fts5(nazwa, tokenize = 'trigram')
+    """)
+
+    cursor.execute("""
+        CREATE TRIGGER IF NOT EXISTS produkty_fts_dodaj AFTER INSERT ON produkty BEGIN
+            INSERT INTO produkty_fts (rowid, nazwa) VALUES (new.id, normalizuj(new.nazwa));
+        END
+    """)
+
+    cursor.execute("""
+        CREATE TRIGGER IF NOT EXISTS produkty_fts_usun AFTER DELETE ON produkty BEGIN
+            DELETE FROM produkty_fts WHERE rowid = old.id;
+        END
+    """)
+
+    cursor.execute("""
+        CREATE TRIGGER IF NOT EXISTS produkty_fts_zmien AFTER UPDATE OF nazwa ON produkty BEGIN
+            UPDATE produkty_fts SET nazwa = normalizuj(new.nazwa) WHERE rowid = old.id;
+        END
+    """)
+
+    if nowy_indeks:
+        cursor.execute("INSERT INTO produkty_fts (rowid, nazwa) SELECT id, normalizuj(nazwa) FROM produkty")
+
+
+def _migracja_kod_kreskowy(cursor):
+    """Kod kreskowy (EAN) produktu. Indeks unikalny obejmuje tylko produkty z kodem
+    (NULL nie jest indeksowany)."""
+    if 'kod' not in {kolumna[1] for kolumna in cursor.execute("PRAGMA table_info(produkty)")}:
+        cursor.execute("ALTER TABLE produkty ADD COLUMN kod TEXT")
+    cursor.execute("CREATE UNIQUE INDEX IF NOT EXISTS idx_produkty_kod ON produkty (kod) WHERE kod IS NOT NULL")
+
+
+def _migracja_limity_api(cursor):
+    """Wiadra żetonów limitów zapytań do Open Food Facts, wspólne dla wszystkich workerów."""
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS limity_api (
+            klucz TEXT PRIMARY KEY,
+            zetony REAL NOT NULL,
+            czas REAL NOT NULL
+        )
+    """)
+
+
+def _migracja_nazwa_szukaj(cursor):
+    """Znormalizowana nazwa (normalizuj) w kolumnie nazwa_szukaj, zapisywana przez aplikację.
+
+    Wyzwalacze indeksu pełnotekstowego kopiują ją zamiast wywoływać funkcję Pythona,
+    więc produkty może zmieniać każde połączenie (konsola sqlite3, kopie zapasowe).
+    Wiersz zapisany bez niej dostaje nazwę z lower() (małe litery tylko w ASCII, polskie
+    znaki bez zmian) - do następnego zapisu przez aplikację.
+    """
+    if 'nazwa_szukaj' not in {kolumna[1] for kolumna in cursor.execute("PRAGMA table_info(produkty)")}:
+        cursor.execute("ALTER TABLE produkty ADD COLUMN nazwa_szukaj TEXT")
+    cursor.execute("DROP TRIGGER IF EXISTS produkty_fts_dodaj")
+    cursor.execute("DROP TRIGGER IF EXISTS produkty_fts_zmien")
+    cursor.execute("UPDATE produkty SET nazwa_szukaj = normalizuj(nazwa) WHERE nazwa_szukaj IS NULL")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_produkty_nazwa_szukaj ON produkty (nazwa_szukaj)")
+
+    cursor.execute("""
+        CREATE TRIGGER IF NOT EXISTS produkty_nazwa_szukaj_dodaj AFTER INSERT ON produkty
+        WHEN new.nazwa_szukaj IS NULL BEGIN
+            UPDATE produkty SET nazwa_szukaj = lower(new.nazwa) WHERE id = new.id;
+        END
+    """)
+    cursor.execute("""
+        CREATE TRIGGER IF NOT EXISTS produkty_nazwa_szukaj_zmien AFTER UPDATE OF nazwa ON produkty
+        WHEN new.nazwa IS NOT old.nazwa AND new.nazwa_szukaj IS old.nazwa_szukaj BEGIN
+            UPDATE produkty SET nazwa_szukaj = lower(new.nazwa) WHERE id = new.id;
+        END
+    """)
+    cursor.execute("""
+        CREATE TRIGGER IF NOT EXISTS produkty_fts_dodaj AFTER INSERT ON produkty BEGIN
+            INSERT INTO produkty_fts (rowid, nazwa) VALUES (new.id, coalesce(new.nazwa_szukaj, lower(new.nazwa)));
+        END
+    """)
+    cursor.execute("""
+        CREATE TRIGGER IF NOT EXISTS produkty_fts_zmien AFTER UPDATE OF nazwa_szukaj ON produkty BEGIN
+            UPDATE produkty_fts SET nazwa = new.nazwa_szukaj WHERE rowid = old.id;
+        END
+    """)
+
+
+MIGRACJE = (_migracja_schemat, _migracja_kod_kreskowy, _migracja_limity_api, _migracja_nazwa_szukaj)
+WERSJA_SCHEMATU = len(MIGRACJE)
+
+
+def wersja_schematu() -> int:
+    """Zwraca wersję schematu zapisaną w bazie (PRAGMA user_version)."""
+    return get_connection().execute("PRAGMA user_version").fetchone()[0]
+
+
+def migruj() -> int:
+    """Wykonuje brakujące migracje schematu, każdą w osobnej transakcji, i zwraca ich liczbę.
+
+    Dla aktualnej bazy to jedno odczytanie PRAGMA user_version. Procesy startujące
+    równolegle nie wykonają migracji dwa razy - wersja jest sprawdzana ponownie
+    pod blokadą zapisu.
+    """
+    if wersja_schematu() >= WERSJA_SCHEMATU:
+        return 0
 
-def zwieksz_odwiedziny():
-    """Zwiększa licznik odwiedzin o 1 i zwraca nową wartość."""
     conn = get_connection()
-    cursor = conn.cursor()
+    wykonane = 0
+    for wersja, migracja in enumerate(MIGRACJE, start=1):
+        with conn:
+            conn.execute("BEGIN IMMEDIATE")
+            if wersja_schematu() >= wersja:
+                continue
+            migracja(conn.cursor())
+            conn.execute(f"PRAGMA user_version = {wersja}")
+        wykonane += 1
+    return wykonane
 
-    cursor.execute("UPDATE statystyki SET wartosc = wartosc + 1 WHERE klucz = 'odwiedziny'")
-    cursor.execute("SELECT wartosc FROM statystyki WHERE klucz = 'odwiedziny'")
-    wynik = cursor.fetchone()
 
-    conn.commit()
-    conn.close()
+def init_db():
+    """Przygotowuje bazę danych - wykonuje brakujące migracje schematu."""
+    if migruj():
+        print(f"Baza danych zaktualizowana do wersji schematu {WERSJA_SCHEMATU}.")
+
 
+def wersja_produktow() -> int:
+    """Zwraca licznik zmian tabeli produkty."""
+    cursor = get_connection().cursor()
+    cursor.execute("SELECT wartosc FROM statystyki WHERE klucz = 'wersja_produktow'")
+    wynik = cursor.fetchone()
     return wynik[0] if wynik else 0
 
 
+class LicznikOdwiedzin:
+    """Licznik w tabeli statystyki z zapisem odroczonym.
+
+    Przyrosty są zbierane w pamięci procesu i dopisywane do bazy jednym
+    UPDATE ... wartosc = wartosc + n - co `zapis_co` sekund (wątek w tle), po `prog`
+    przyrostach albo przy zamykaniu procesu. Dodawanie przyrostów (zamiast nadpisywania)
+    sprawia, że kilka workerów może zapisywać ten sam licznik.
+    """
+
+    def __init__(self, klucz: str = 'odwiedziny', zapis_co: float = ODWIEDZINY_ZAPIS_CO,
+                 prog: int = ODWIEDZINY_PROG):
+        self.klucz = klucz
+        self.zapis_co = zapis_co
+        self.prog = prog
+        self.oczekujace = 0
+        self.wartosc_w_bazie = None
+        self.odczytano = 0.0
+        self._lock = threading.Lock()
+        self._pid_watku = None
+
+    def zwieksz(self, o: int = 1) -> int:
+        """Dodaje przyrost i zwraca bieżącą (prawie aktualną) wartość licznika."""
+        self._uruchom_watek()
+        with self._lock:
+            self.oczekujace += o
+            do_zapisu = self.oczekujace >= self.prog
+        if do_zapisu:
+            self.zapisz()
+        return self.wartosc()
+
+    def wartosc(self) -> int:
+        """Zwraca wartość z bazy (odczytywaną najwyżej raz na `zapis_co` s) plus niezapisane przyrosty."""
+        if self.wartosc_w_bazie is None or time.monotonic() - self.odczytano > self.zapis_co:
+            cursor = get_connection().cursor()
+            cursor.execute("SELECT wartosc FROM statystyki WHERE klucz = ?", (self.klucz,))
+            wynik = cursor.fetchone()
+            with self._lock:
+                self.wartosc_w_bazie = wynik[0] if wynik else 0
+                self.odczytano = time.monotonic()
+        with self._lock:
+            return self.wartosc_w_bazie + self.oczekujace
+
+    def zapisz(self):
+        """Dopisuje zebrane przyrosty do bazy."""
+        with self._lock:
+            przyrost, self.oczekujace = self.oczekujace, 0
+        if not przyrost:
+            return
+
+        conn = get_connection()
+        try:
+            with conn:
+                conn.execute("INSERT OR IGNORE INTO statystyki (klucz, wartosc) VALUES (?, 0)", (self.klucz,))
+                conn.execute("UPDATE statystyki SET wartosc = wartosc + ? WHERE klucz = ?", (przyrost, self.klucz))
+                wynik = conn.execute("SELECT wartosc FROM statystyki WHERE klucz = ?", (self.klucz,)).fetchone()
+        except sqlite3.Error:
+            with self._lock:
+                self.oczekujace += przyrost  # spróbujemy przy następnym zapisie
+            raise
+
+        with self._lock:
+            self.wartosc_w_bazie = wynik[0]
+            self.odczytano = time.monotonic()
+
+    def _uruchom_watek(self):
+        # Wątek zapisujący startuje w procesie, który faktycznie liczy (po fork() workera)
+        if self._pid_watku == os.getpid():
+            return
+        with self._lock:
+            if self._pid_watku == os.getpid():
+                return
+            self._pid_watku = os.getpid()
+        threading.Thread(target=self._zapisuj_okresowo, daemon=True, name=f'licznik-{self.klucz}').start()
+        atexit.register(self.zapisz)
+
+    def _zapisuj_okresowo(self):
+        while True:
+            time.sleep(self.zapis_co)
+            try:
+                self.zapisz()
+            except sqlite3.Error:
+                pass
+
+
+licznik_odwiedzin = LicznikOdwiedzin()
+
+
+def zwieksz_odwiedziny():
+    """Zwiększa licznik odwiedzin o 1 i zwraca nową wartość."""
+    return licznik_odwiedzin.zwieksz()
+
+
 def pobierz_odwiedziny():
     """Pobiera aktualną liczbę odwiedzin."""
+    return licznik_odwiedzin.wartosc()
+
+
+def pobierz_z_cache(klucz: str):
+    """Zwraca (odpowiedź, wiek w sekundach) z cache API albo None, jeśli brak wpisu."""
     conn = get_connection()
     cursor = conn.cursor()
 
-    cursor.execute("SELECT wartosc FROM statystyki WHERE klucz = 'odwiedziny'")
+    cursor.execute("SELECT odpowiedz, zapisano, uzyto FROM cache_api WHERE klucz = ?", (klucz,))
     wynik = cursor.fetchone()
+    if not wynik:
+        return None
 
-    conn.close()
+    teraz = time.time()
+    if teraz - wynik[2] > CACHE_API_ODSWIEZ_UZYCIE:
+        with conn:
+            cursor.execute("UPDATE cache_api SET uzyto = ? WHERE klucz = ?", (teraz, klucz))
 
-    return wynik[0] if wynik else 0
+    return json.loads(wynik[0]), teraz - wynik[1]
+
+
+def zapisz_w_cache(klucz: str, odpowiedz):
+    """Zapisuje odpowiedź w cache API i usuwa najdawniej używane wpisy ponad limit."""
+    conn = get_connection()
+    teraz = time.time()
+
+    with conn:
+        conn.execute("""
+            INSERT OR REPLACE INTO cache_api (klucz, odpowiedz, zapisano, uzyto)
+            VALUES (?, ?, ?, ?)
+        """, (klucz, json.dumps(odpowiedz), teraz, teraz))
+        conn.execute("DELETE FROM cache_api WHERE zapisano < ?", (teraz - CACHE_API_MAKS_WIEK,))
+        conn.execute("""
+            DELETE FROM cache_api WHERE klucz IN (
+                SELECT klucz FROM cache_api ORDER BY uzyto DESC LIMIT -1 OFFSET ?
+            )
+        """, (CACHE_API_MAKS_WPISOW,))
+
+
+def rozmiar_cache():
+    """Zwraca liczbę wpisów w cache API."""
+    cursor = get_connection().cursor()
+    cursor.execute("SELECT COUNT(*) FROM cache_api")
+    return cursor.fetchone()[0]
+
+
+def pobierz_zeton(klucz: str, na_sekunde: float, pojemnosc: float) -> bool:
+    """Zabiera żeton z wiadra `klucz` wspólnego dla wszystkich procesów (tabela limity_api).
+
+    Wiadro napełnia się `na_sekunde` żetonami na sekundę, najwyżej do `pojemnosc`.
+    Doliczenie przyrostu, sprawdzenie i zabranie żetonu to jeden UPDATE, więc dwa workery
+    nie wezmą tego samego żetonu. Puste wiadro -> False od razu, bez czekania.
+    """
+    conn = get_connection()
+    parametry = {'klucz': klucz, 'tempo': na_sekunde, 'pojemnosc': pojemnosc, 'teraz': time.time()}
+    with conn:
+        conn.execute("INSERT OR IGNORE INTO limity_api (klucz, zetony, czas) VALUES (:klucz, :pojemnosc, :teraz)",
+                     parametry)
+        cursor = conn.execute("""
+            UPDATE limity_api SET
+                zetony = MIN(:pojemnosc, zetony + MAX(0, :teraz - czas) * :tempo) - 1,
+                czas = :teraz
+            WHERE klucz = :klucz AND MIN(:pojemnosc, zetony + MAX(0, :teraz - czas) * :tempo) >= 1
+        """, parametry)
+    return cursor.rowcount == 1
+
+
+class LogowanieOdrzucone(Exception):
+    """Logowanie odrzucone bez sprawdzania hasła."""
+
+
+class ZaDuzoProb(LogowanieOdrzucone):
+    """Przekroczono limit nieudanych logowań dla loginu."""
+
+
+class KolejkaPelna(LogowanieOdrzucone):
+    """Zbyt wiele logowań czeka na sprawdzenie hasła."""
+
+
+class LimitProb:
+    """Limit nieudanych prób logowania na klucz w przesuwanym oknie czasu (w pamięci procesu).
+
+    Kluczem jest para (login, adres klienta) - cudze próby z innego adresu
+    nie blokują właścicielowi konta logowania.
+    """
+
+    def __init__(self, proby: int = LOGOWANIE_PROBY, okno: float = LOGOWANIE_OKNO):
+        self.proby = proby
+        self.okno = okno
+        self.nieudane = {}
+        self._lock = threading.Lock()
+
+    def sprawdz(self, klucz):
+        """Rzuca ZaDuzoProb, jeśli klucz wyczerpał limit prób."""
+        with self._lock:
+            czasy = self.nieudane.get(klucz)
+            if not czasy:
+                return
+            while czasy and time.monotonic() - czasy[0] > self.okno:
+                czasy.popleft()
+            if len(czasy) >= self.proby:
+                raise ZaDuzoProb(klucz)
+
+    def porazka(self, klucz):
+        with self._lock:
+            # Nie pozwól, żeby słownik rósł bez końca przy zgadywaniu loginów
+            if len(self.nieudane) > 10000:
+                granica = time.monotonic() - self.okno
+                self.nieudane = {k: v for k, v in self.nieudane.items() if v and v[-1] > granica}
+            self.nieudane.setdefault(klucz, deque(maxlen=self.proby)).append(time.monotonic())
+
+    def sukces(self, klucz):
+        with self._lock:
+            self.nieudane.pop(klucz, None)
+
+
+limit_logowan = LimitProb()
+
+# Sprawdzanie hashy (kosztowne obliczeniowo) w ograniczonej puli wątków
+_pula_hasel = ThreadPoolExecutor(max_workers=HASLA_WATKI, thread_name_prefix='hasla')
+_miejsca_w_kolejce = threading.BoundedSemaphore(HASLA_KOLEJKA)
+
+# login -> (hash hasła, czas pobrania z bazy)
+_hasla = {}
+
+
+def w_puli_hasel(funkcja, *args):
+    """Wykonuje funkcję w puli hashowania; przy pełnej kolejce rzuca KolejkaPelna."""
+    if not _miejsca_w_kolejce.acquire(blocking=False):
+        raise KolejkaPelna()
+    try:
+        return _pula_hasel.submit(funkcja, *args).result()
+    finally:
+        _miejsca_w_kolejce.release()
+
+
+def pobierz_hash(login: str):
+    """Zwraca hash hasła użytkownika (z pamięci, jeśli świeży) albo None, jeśli brak użytkownika."""
+    wpis = _hasla.get(login)
+    if wpis and time.monotonic() - wpis[1] < HASLA_CACHE_CZAS:
+        return wpis[0]
+
+    cursor = get_connection().cursor()
+    cursor.execute("SELECT haslo FROM uzytkownicy WHERE login = ?", (login,))
+    wynik = cursor.fetchone()
+    if not wynik:
+        return None
+
+    if len(_hasla) > 10000:
+        _hasla.clear()
+    _hasla[login] = (wynik[0], time.monotonic())
+    return wynik[0]
+
+
+def wymaga_aktualizacji(haslo_hash: str) -> bool:
+    """Czy hash powstał inną metodą lub z innymi parametrami niż HASLO_METODA."""
+    return haslo_hash.split('$', 1)[0] != HASLO_METODA
 
 
 def dodaj_uzytkownika(login: str, haslo: str):
@@ -91,40 +648,51 @@ def dodaj_uzytkownika(login: str, haslo: str):
     cursor = conn.cursor()
 
     try:
-        haslo_hash = generate_password_hash(haslo)
-        cursor.execute("""
-            INSERT INTO uzytkownicy (login, haslo)
-            VALUES (?, ?)
-        """, (login, haslo_hash))
-        conn.commit()
+        haslo_hash = generate_password_hash(haslo, method=HASLO_METODA)
+        with conn:
+            cursor.execute("""
+                INSERT INTO uzytkownicy (login, haslo)
+                VALUES (?, ?)
+            """, (login, haslo_hash))
         print(f"Dodano użytkownika: {login}")
     except sqlite3.IntegrityError:
         print(f"Użytkownik '{login}' już istnieje.")
-    finally:
-        conn.close()
 
 
-def sprawdz_uzytkownika(login: str, haslo: str) -> bool:
-    """Sprawdza dane logowania użytkownika."""
-    conn = get_connection()
-    cursor = conn.cursor()
+def sprawdz_uzytkownika(login: str, haslo: str, adres: str = None) -> bool:
+    """Sprawdza dane logowania użytkownika łączącego się z adresu `adres`.
 
-    cursor.execute("SELECT haslo FROM uzytkownicy WHERE login = ?", (login,))
-    wynik = cursor.fetchone()
-    conn.close()
-
-    if not wynik:
-        return False
+    Rzuca ZaDuzoProb po serii nieudanych prób z tego adresu i KolejkaPelna, gdy pula
+    sprawdzania haseł jest przeciążona. Hash w starym formacie jest po udanym
+    logowaniu zastępowany hashem według HASLO_METODA (jeśli się nie uda - przy
+    następnym logowaniu).
+    """
+    klucz = (login, adres)
+    limit_logowan.sprawdz(klucz)
+    haslo_hash = pobierz_hash(login)
 
     # Gość - puste hasło, logowanie bez hasła
-    if wynik[0] == '' and haslo == '':
+    if haslo_hash == '' and haslo == '':
         return True
 
     # Normalny użytkownik - sprawdź hash hasła
-    if wynik[0] and check_password_hash(wynik[0], haslo):
-        return True
+    if not haslo_hash or not w_puli_hasel(check_password_hash, haslo_hash, haslo):
+        limit_logowan.porazka(klucz)
+        return False
+
+    limit_logowan.sukces(klucz)
+    if wymaga_aktualizacji(haslo_hash):
+        # Hasło jest już sprawdzone - przeciążenie albo zablokowana baza nie mogą odrzucić logowania
+        try:
+            nowy_hash = w_puli_hasel(generate_password_hash, haslo, HASLO_METODA)
+            conn = get_connection()
+            with conn:
+                conn.execute("UPDATE uzytkownicy SET haslo = ? WHERE login = ?", (nowy_hash, login))
+            _hasla.pop(login, None)
+        except (KolejkaPelna, sqlite3.Error):
+            pass
 
-    return False
+    return True
 
 
 def dodaj_produkt(nazwa: str, kalorie: float, bialko: float, weglowodany: float, tluszcze: float, kategoria: str = None):
@@ -133,62 +701,329 @@ def dodaj_produkt(nazwa: str, kalorie: float, bialko: float, weglowodany: float,
     cursor = conn.cursor()
 
     try:
-        cursor.execute("""
-            INSERT INTO produkty (nazwa, kalorie, bialko, weglowodany, tluszcze, kategoria)
-            VALUES (?, ?, ?, ?, ?, ?)
-        """, (nazwa, kalorie, bialko, weglowodany, tluszcze, kategoria))
-        conn.commit()
+        with conn:
+            cursor.execute("""
+                INSERT INTO produkty (nazwa, kalorie, bialko, weglowodany, tluszcze, kategoria, nazwa_szukaj)
+                VALUES (?, ?, ?, ?, ?, ?, ?)
+            """, (nazwa, kalorie, bialko, weglowodany, tluszcze, kategoria, normalizuj(nazwa)))
         print(f"Dodano produkt: {nazwa}")
     except sqlite3.IntegrityError:
         print(f"Produkt '{nazwa}' już istnieje w bazie.")
-    finally:
-        conn.close()
 
 
-def lista_produktow(kategoria: str = None):
-    """Wyświetla listę wszystkich produktów."""
+def normalizuj_kod(kod):
+    """Kod kreskowy jako ciąg cyfr (12-cyfrowy UPC-A uzupełniony zerem do EAN-13)
+    albo None, gdy go brak. Kod z innymi znakami albo dłuższy niż GTIN-14 -> ValueError."""
+    kod = str(kod).strip() if kod is not None else ''
+    if not kod:
+        return None
+    if not (kod.isascii() and kod.isdigit()) or len(kod) > 14:
+        raise ValueError('Nieprawidłowy kod kreskowy')
+    return '0' + kod if len(kod) == 12 else kod
+
+
+def produkt_do_zapisu(dane):
+    """Zamienia produkt (słownik z kluczami KOLUMNY_PRODUKTU albo krotkę w tej kolejności)
+    na wiersz do zapisu. Brakujące wartości odżywcze to 0; błędne dane -> ValueError."""
+    if isinstance(dane, dict):
+        wartosci = [dane.get(k) for k in KOLUMNY_PRODUKTU]
+    else:
+        wartosci = (list(dane) + [None] * len(KOLUMNY_PRODUKTU))[:len(KOLUMNY_PRODUKTU)]
+
+    nazwa = wartosci[0].strip() if isinstance(wartosci[0], str) else ''
+    if not nazwa:
+        raise ValueError('Brak nazwy produktu')
+
+    liczby = []
+    for wartosc in wartosci[1:5]:
+        try:
+            liczba = float(wartosc) if wartosc not in (None, '') else 0.0
+        except (TypeError, ValueError):
+            raise ValueError('Nieprawidłowa wartość odżywcza') from None
+        if not 0 <= liczba < math.inf:
+            raise ValueError('Nieprawidłowa wartość odżywcza')
+        liczby.append(liczba)
+
+    kategoria = wartosci[5].strip() if isinstance(wartosci[5], str) and wartosci[5].strip() else None
+    return (nazwa, *liczby, kategoria, normalizuj_kod(wartosci[6]))
+
+
+def zapisz_produkty(produkty, nadpisz: bool = True):
+    """Dodaje wiele produktów w jednej transakcji (executemany, upsert po nazwie).
+
+    Produkt, który już istnieje, jest aktualizowany (albo pomijany, gdy nadpisz=False),
+    a produkt bez zmian, błędny i z kodem kreskowym innego produktu - pomijany.
+    Produkt bez kodu zachowuje kod zapisany wcześniej. Zwraca raport:
+    {'dodane': [nazwy], 'zaktualizowane': [nazwy], 'pominiete': [{'nazwa', 'powod'}]}.
+    """
+    raport = {'dodane': [], 'zaktualizowane': [], 'pominiete': []}
+    wiersze = {}
+    kody = set()
+    for dane in produkty:
+        try:
+            wiersz = produkt_do_zapisu(dane)
+        except ValueError as e:
+            nazwa = dane.get('nazwa') if isinstance(dane, dict) else (dane[0] if dane else None)
+            raport['pominiete'].append({'nazwa': nazwa, 'powod': str(e)})
+            continue
+        if wiersz[0] in wiersze:
+            raport['pominiete'].append({'nazwa': wiersz[0], 'powod': 'Powtórzona nazwa'})
+            continue
+        if wiersz[-1] in kody:
+            raport['pominiete'].append({'nazwa': wiersz[0], 'powod': 'Powtórzony kod kreskowy'})
+            continue
+        if wiersz[-1]:
+            kody.add(wiersz[-1])
+        wiersze[wiersz[0]] = wiersz
+
     conn = get_connection()
-    cursor = conn.cursor()
+    with conn:
+        # Blokada zapisu od początku - stan produktów nie zmieni się między odczytem a zapisem
+        conn.execute("BEGIN IMMEDIATE")
+        istniejace = {}
+        wlasciciele_kodow = {}
+        for kolumna, klucze in (('nazwa', list(wiersze)), ('kod', list(kody))):
+            for i in range(0, len(klucze), ROZMIAR_PARTII_IN):
+                partia = klucze[i:i + ROZMIAR_PARTII_IN]
+                for stary in conn.execute(f"""
+                    SELECT {', '.join(KOLUMNY_PRODUKTU)}
+                    FROM produkty WHERE {kolumna} IN ({','.join('?' * len(partia))})
+                """, partia):
+                    istniejace[stary[0]] = stary
+                    if stary[-1]:
+                        wlasciciele_kodow[stary[-1]] = stary[0]
+
+        do_zapisu = []
+        for nazwa, wiersz in wiersze.items():
+            stary = istniejace.get(nazwa)
+            if stary is not None and wiersz[-1] is None:
+                wiersz = wiersz[:-1] + stary[-1:]
+            wlasciciel = wlasciciele_kodow.get(wiersz[-1], nazwa)
+            if wlasciciel != nazwa:
+                raport['pominiete'].append({'nazwa': nazwa, 'powod': f'Kod kreskowy ma już produkt {wlasciciel}'})
+                continue
+            if stary is None:
+                raport['dodane'].append(nazwa)
+            elif not nadpisz:
+                raport['pominiete'].append({'nazwa': nazwa, 'powod': 'Produkt już istnieje'})
+                continue
+            elif stary == wiersz:
+                raport['pominiete'].append({'nazwa': nazwa, 'powod': 'Bez zmian'})
+                continue
+            else:
+                raport['zaktualizowane'].append(nazwa)
+            do_zapisu.append(wiersz)
+
+        conn.executemany("""
+            INSERT INTO produkty (nazwa, kalorie, bialko, weglowodany, tluszcze, kategoria, kod, nazwa_szukaj)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+            ON CONFLICT (nazwa) DO UPDATE SET
+                kalorie = excluded.kalorie,
+                bialko = excluded.bialko,
+                weglowodany = excluded.weglowodany,
+                tluszcze = excluded.tluszcze,
+                kategoria = excluded.kategoria,
+                kod = excluded.kod,
+                nazwa_szukaj = excluded.nazwa_szukaj
+        """, [(*wiersz, normalizuj(wiersz[0])) for wiersz in do_zapisu])
+    return raport
+
+
+def format_pliku_produktow(sciezka: Path, format_pliku: str = None) -> str:
+    """'json' albo 'csv' - podany wprost lub na podstawie rozszerzenia pliku."""
+    return format_pliku or ('json' if sciezka.suffix.lower() == '.json' else 'csv')
+
+
+def wczytaj_produkty(sciezka: Path, format_pliku: str = None):
+    """Wczytuje produkty z pliku CSV (nagłówek z KOLUMNY_PRODUKTU) albo JSON (lista obiektów)."""
+    with open(sciezka, encoding='utf-8-sig', newline='') as plik:
+        if format_pliku_produktow(sciezka, format_pliku) == 'json':
+            dane = json.load(plik)
+            produkty = dane.get('produkty', []) if isinstance(dane, dict) else dane
+            if not isinstance(produkty, list):
+                raise ValueError('Plik JSON musi zawierać listę produktów')
+            return produkty
+        return list(csv.DictReader(plik))
+
+
+def importuj_produkty(sciezka: Path, format_pliku: str = None, nadpisz: bool = True):
+    """Importuje produkty z pliku CSV/JSON jedną transakcją. Zwraca raport zapisz_produkty."""
+    return zapisz_produkty(wczytaj_produkty(sciezka, format_pliku), nadpisz)
+
+
+def eksportuj_produkty(sciezka: Path, format_pliku: str = None) -> int:
+    """Zapisuje wszystkie produkty do pliku CSV albo JSON. Zwraca ich liczbę."""
+    cursor = get_connection().cursor()
+    cursor.execute(f"SELECT {', '.join(KOLUMNY_PRODUKTU)} FROM produkty ORDER BY nazwa")
+    liczba = 0
+    with open(sciezka, 'w', encoding='utf-8', newline='') as plik:
+        if format_pliku_produktow(sciezka, format_pliku) == 'json':
+            plik.write('[')
+            for wiersz in cursor:
+                plik.write(',\n' if liczba else '\n')
+                plik.write(json.dumps(dict(zip(KOLUMNY_PRODUKTU, wiersz)), ensure_ascii=False))
+                liczba += 1
+            plik.write('\n]\n')
+        else:
+            pisarz = csv.writer(plik)
+            pisarz.writerow(KOLUMNY_PRODUKTU)
+            for wiersz in cursor:
+                pisarz.writerow(wiersz)
+                liczba += 1
+    return liczba
+
 
+def wypisz_raport(raport):
+    """Wypisuje podsumowanie zapisu zbiorczego."""
+    print(f"Dodano: {len(raport['dodane'])}, zaktualizowano: {len(raport['zaktualizowane'])}, "
+          f"pominięto: {len(raport['pominiete'])}")
+    for pozycja in raport['pominiete']:
+        if pozycja['powod'] != 'Bez zmian':
+            print(f"  pominięto {pozycja['nazwa']!r}: {pozycja['powod']}")
+
+
+def wiersze_partiami(cursor, rozmiar: int = ROZMIAR_PARTII_ODCZYTU):
+    """Zwraca wiersze wykonanego zapytania, pobierając je partiami (fetchmany)."""
+    while True:
+        partia = cursor.fetchmany(rozmiar)
+        if not partia:
+            return
+        yield from partia
+
+
+def szukaj_produktow(fraza: str, limit: int = None):
+    """Wyszukuje produkty po fragmencie nazwy, bez względu na wielkość liter i polskie znaki.
+
+    Generator krotek (id, nazwa, kalorie, bialko, weglowodany, tluszcze, kategoria, kod):
+    najpierw produkty, których nazwa zaczyna się od frazy, potem pozostałe według trafności.
+    Fraza krótsza niż 3 znaki dopasowuje tylko początek nazwy.
+    Wiersze są pobierane z bazy partiami, w miarę czytania wyników.
+    """
+    szukana = normalizuj(fraza.strip())
+    if not szukana:
+        return
+
+    cursor = get_connection().cursor()
+    limit_sql = -1 if limit is None else limit
+
+    # Trigramy wymagają co najmniej 3 znaków - krótsze frazy to tylko początki nazw, z zakresu
+    # indeksu idx_produkty_nazwa_szukaj (fragment ze środka nazwy wymagałby przejrzenia tabeli)
+    if len(szukana) < 3:
+        cursor.execute("""
+            SELECT id, nazwa, kalorie, bialko, weglowodany, tluszcze, kategoria, kod
+            FROM produkty
+            WHERE nazwa_szukaj >= ? AND nazwa_szukaj < ?
+            ORDER BY nazwa_szukaj
+            LIMIT ?
+        """, (szukana, szukana + OSTATNI_ZNAK, limit_sql))
+        yield from wiersze_partiami(cursor)
+        return
+
+    fraza_fts = '"' + szukana.replace('"', '""') + '"'
+
+    cursor.execute("""
+        SELECT p.id, p.nazwa, p.kalorie, p.bialko, p.weglowodany, p.tluszcze, p.kategoria, p.kod
+        FROM produkty_fts f JOIN produkty p ON p.id = f.rowid
+        WHERE produkty_fts MATCH ?
+        ORDER BY f.nazwa
+        LIMIT ?
+    """, ('^' + fraza_fts, limit_sql))
+    liczba = 0
+    for wiersz in wiersze_partiami(cursor):
+        liczba += 1
+        yield wiersz
+
+    if limit is not None and liczba >= limit:
+        return
+
+    # Pozostałe trafienia - bez tych, których nazwa zaczyna się od frazy (już zwrócone)
+    cursor.execute("""
+        SELECT p.id, p.nazwa, p.kalorie, p.bialko, p.weglowodany, p.tluszcze, p.kategoria, p.kod
+        FROM produkty_fts f JOIN produkty p ON p.id = f.rowid
+        WHERE produkty_fts MATCH ? AND instr(f.nazwa, ?) != 1
+        ORDER BY f.rank
+        LIMIT ?
+    """, (fraza_fts, szukana, -1 if limit is None else limit - liczba))
+    yield from wiersze_partiami(cursor)
+
+
+def znajdz_produkty(fraza: str, limit: int = None):
+    """Lista wyników szukaj_produktow."""
+    return list(szukaj_produktow(fraza, limit))
+
+
+def przegladaj_produkty(kategoria: str = None, po=None, limit: int = None):
+    """Produkty posortowane po (nazwa, id), od pierwszego po kluczu `po` = (nazwa, id).
+
+    Stronicowanie po kluczu: kolejna strona to zakres indeksu (nazwa albo kategoria, nazwa)
+    zaczynający się za ostatnim wierszem poprzedniej, bez OFFSET. Zwraca generator krotek
+    (id, nazwa, kalorie, bialko, weglowodany, tluszcze, kategoria, kod), pobieranych partiami.
+    """
+    warunki, parametry = [], []
     if kategoria:
-        cursor.execute("SELECT * FROM produkty WHERE kategoria = ? ORDER BY nazwa", (kategoria,))
-    else:
-        cursor.execute("SELECT * FROM produkty ORDER BY nazwa")
+        warunki.append("kategoria = ?")
+        parametry.append(kategoria)
+    if po is not None:
+        warunki.append("(nazwa, id) > (?, ?)")
+        parametry.extend(po)
+
+    cursor = get_connection().cursor()
+    cursor.execute(f"""
+        SELECT id, nazwa, kalorie, bialko, weglowodany, tluszcze, kategoria, kod
+        FROM produkty {'WHERE ' + ' AND '.join(warunki) if warunki else ''}
+        ORDER BY nazwa, id
+        LIMIT ?
+    """, (*parametry, -1 if limit is None else limit))
+    return wiersze_partiami(cursor)
+
+
+def produkt_po_kodzie(kod: str):
+    """Produkt o podanym (znormalizowanym) kodzie kreskowym - jedno wyszukanie w indeksie kodów.
+
+    Zwraca krotkę (id, nazwa, kalorie, bialko, weglowodany, tluszcze, kategoria, kod) albo None.
+    """
+    cursor = get_connection().cursor()
+    cursor.execute("""
+        SELECT id, nazwa, kalorie, bialko, weglowodany, tluszcze, kategoria, kod
+        FROM produkty WHERE kod = ?
+    """, (kod,))
+    return cursor.fetchone()
+
 
-    produkty = cursor.fetchall()
-    conn.close()
+def lista_produktow(kategoria: str = None):
+    """Wyświetla listę wszystkich produktów (wiersze są wypisywane w trakcie odczytu)."""
+    produkty = przegladaj_produkty(kategoria)
+    pierwszy = next(produkty, None)
 
-    if not produkty:
+    if pierwszy is None:
         print("Brak produktów w bazie.")
         return
 
     print(f"\n{'Nazwa':<30} {'kcal':>8} {'B':>8} {'W':>8} {'T':>8} {'Kategoria':<15}")
     print("-" * 85)
 
-    for p in produkty:
+    liczba = 0
+    for p in itertools.chain([pierwszy], produkty):
         kategoria_str = p[6] if p[6] else "-"
         print(f"{p[1]:<30} {p[2]:>8.1f} {p[3]:>8.1f} {p[4]:>8.1f} {p[5]:>8.1f} {kategoria_str:<15}")
+        liczba += 1
 
-    print(f"\nRazem produktów: {len(produkty)}")
+    print(f"\nRazem produktów: {liczba}")
 
 
 def szukaj_produkt(fraza: str):
     """Wyszukuje produkty po nazwie."""
-    conn = get_connection()
-    cursor = conn.cursor()
-
-    cursor.execute("SELECT * FROM produkty WHERE nazwa LIKE ? ORDER BY nazwa", (f"%{fraza}%",))
-    produkty = cursor.fetchall()
-    conn.close()
+    produkty = szukaj_produktow(fraza)
+    pierwszy = next(produkty, None)
 
-    if not produkty:
+    if pierwszy is None:
         print(f"Nie znaleziono produktów zawierających '{fraza}'.")
         return
 
     print(f"\n{'Nazwa':<30} {'kcal':>8} {'B':>8} {'W':>8} {'T':>8}")
     print("-" * 70)
 
-    for p in produkty:
+    for p in itertools.chain([pierwszy], produkty):
         print(f"{p[1]:<30} {p[2]:>8.1f} {p[3]:>8.1f} {p[4]:>8.1f} {p[5]:>8.1f}")
 
 
@@ -197,37 +1032,115 @@ def usun_produkt(nazwa: str):
     conn = get_connection()
     cursor = conn.cursor()
 
-    cursor.execute("DELETE FROM produkty WHERE nazwa = ?", (nazwa,))
+    with conn:
+        cursor.execute("DELETE FROM produkty WHERE nazwa = ?", (nazwa,))
 
     if cursor.rowcount > 0:
         print(f"Usunięto produkt: {nazwa}")
     else:
         print(f"Nie znaleziono produktu: {nazwa}")
 
-    conn.commit()
-    conn.close()
+
+def pobierz_produkty(ids=(), nazwy=()):
+    """Pobiera wiele produktów naraz - jedno zapytanie na każde 500 kluczy.
+
+    Zwraca dwa słowniki: {id: wiersz} i {nazwa: wiersz},
+    gdzie wiersz to (id, nazwa, kalorie, bialko, weglowodany, tluszcze, kategoria, kod).
+    """
+    cursor = get_connection().cursor()
+    po_id, po_nazwie = {}, {}
+
+    for kolumna, klucze, wynik in (('id', list(set(ids)), po_id), ('nazwa', list(set(nazwy)), po_nazwie)):
+        for i in range(0, len(klucze), ROZMIAR_PARTII_IN):
+            partia = klucze[i:i + ROZMIAR_PARTII_IN]
+            cursor.execute(f"""
+                SELECT id, nazwa, kalorie, bialko, weglowodany, tluszcze, kategoria, kod
+                FROM produkty WHERE {kolumna} IN ({','.join('?' * len(partia))})
+            """, partia)
+            for wiersz in cursor.fetchall():
+                wynik[wiersz[0] if kolumna == 'id' else wiersz[1]] = wiersz
+
+    return po_id, po_nazwie
+
+
+def przelicz_porcje(wartosci_na_100g, gramy: float):
+    """Przelicza wartości odżywcze (kolejność jak w SKLADNIKI) na podaną porcję."""
+    mnoznik = gramy / 100
+    return {skladnik: wartosc * mnoznik for skladnik, wartosc in zip(SKLADNIKI, wartosci_na_100g)}
 
 
 def oblicz_porcje(nazwa: str, gramy: float):
     """Oblicza wartości odżywcze dla podanej porcji produktu."""
-    conn = get_connection()
-    cursor = conn.cursor()
-
-    cursor.execute("SELECT * FROM produkty WHERE nazwa = ?", (nazwa,))
-    produkt = cursor.fetchone()
-    conn.close()
+    _, po_nazwie = pobierz_produkty(nazwy=[nazwa])
+    produkt = po_nazwie.get(nazwa)
 
     if not produkt:
         print(f"Nie znaleziono produktu: {nazwa}")
         return
 
-    mnoznik = gramy / 100
+    porcja = przelicz_porcje(produkt[2:6], gramy)
 
     print(f"\n{produkt[1]} - {gramy}g:")
-    print(f"  Kalorie:     {produkt[2] * mnoznik:.1f} kcal")
-    print(f"  Białko:      {produkt[3] * mnoznik:.1f} g")
-    print(f"  Węglowodany: {produkt[4] * mnoznik:.1f} g")
-    print(f"  Tłuszcze:    {produkt[5] * mnoznik:.1f} g")
+    print(f"  Kalorie:     {porcja['kalorie']:.1f} kcal")
+    print(f"  Białko:      {porcja['bialko']:.1f} g")
+    print(f"  Węglowodany: {porcja['weglowodany']:.1f} g")
+    print(f"  Tłuszcze:    {porcja['tluszcze']:.1f} g")
+
+
+def dodaj_do_dziennika(uzytkownik: str, data: str, pozycje):
+    """Zapisuje pozycje (nazwa, gramy, wartości na 100g) w dzienniku. Zwraca id wpisów."""
+    conn = get_connection()
+    ids = []
+    with conn:
+        for nazwa, gramy, wartosci_na_100g in pozycje:
+            porcja = przelicz_porcje(wartosci_na_100g, gramy)
+            cursor = conn.execute("""
+                INSERT INTO dziennik (uzytkownik, data, produkt, gramy, kalorie, bialko, weglowodany, tluszcze)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+            """, (uzytkownik, data, nazwa, gramy, *(porcja[s] for s in SKLADNIKI)))
+            ids.append(cursor.lastrowid)
+    return ids
+
+
+def usun_z_dziennika(uzytkownik: str, id_wpisu: int) -> bool:
+    """Usuwa wpis użytkownika z dziennika. Zwraca False, jeśli takiego wpisu nie ma."""
+    conn = get_connection()
+    with conn:
+        cursor = conn.execute("DELETE FROM dziennik WHERE id = ? AND uzytkownik = ?", (id_wpisu, uzytkownik))
+    return cursor.rowcount > 0
+
+
+def wpisy_dziennika(uzytkownik: str, data: str):
+    """Zwraca wpisy z jednego dnia: krotki (id, produkt, gramy, kalorie, bialko, weglowodany, tluszcze)."""
+    cursor = get_connection().cursor()
+    cursor.execute("""
+        SELECT id, produkt, gramy, kalorie, bialko, weglowodany, tluszcze
+        FROM dziennik WHERE uzytkownik = ? AND data = ?
+        ORDER BY id
+    """, (uzytkownik, data))
+    return cursor.fetchall()
+
+
+def podsumowanie_dziennika(uzytkownik: str, od: str, do: str, tabela: str = 'dziennik_dni'):
+    """Zwraca sumy dzienne (lub tygodniowe) z zakresu dat, bez przeglądania wpisów.
+
+    Krotki (data, pozycje, kalorie, bialko, weglowodany, tluszcze) - tylko okresy z wpisami.
+    """
+    kolumna, _ = OKRESY_DZIENNIKA[tabela]
+    cursor = get_connection().cursor()
+    cursor.execute(f"""
+        SELECT {kolumna}, pozycje, kalorie, bialko, weglowodany, tluszcze
+        FROM {tabela} WHERE uzytkownik = ? AND {kolumna} BETWEEN ? AND ?
+        ORDER BY {kolumna}
+    """, (uzytkownik, od, do))
+    return cursor.fetchall()
+
+
+def popularnosc_produktow():
+    """Zwraca {nazwa produktu: liczba wpisów w dzienniku}."""
+    cursor = get_connection().cursor()
+    cursor.execute("SELECT produkt, COUNT(*) FROM dziennik GROUP BY produkt")
+    return dict(cursor.fetchall())
 
 
 def menu_interaktywne():
@@ -241,6 +1154,8 @@ def menu_interaktywne():
         print("3. Szukaj produktu")
         print("4. Oblicz porcję")
         print("5. Usuń produkt")
+        print("6. Import produktów (CSV/JSON)")
+        print("7. Eksport produktów (CSV/JSON)")
         print("0. Wyjście")
 
         wybor = input("\nWybierz opcję: ").strip()
@@ -277,6 +1192,20 @@ def menu_interaktywne():
             nazwa = input("Nazwa produktu do usunięcia: ").strip()
             usun_produkt(nazwa)
 
+        elif wybor == "6":
+            sciezka = Path(input("Plik (.csv lub .json): ").strip())
+            try:
+                wypisz_raport(importuj_produkty(sciezka))
+            except (OSError, ValueError, csv.Error) as e:
+                print(f"Błąd importu: {e}")
+
+        elif wybor == "7":
+            sciezka = Path(input("Plik (.csv lub .json): ").strip())
+            try:
+                print(f"Wyeksportowano produktów: {eksportuj_produkty(sciezka)}")
+            except OSError as e:
+                print(f"Błąd eksportu: {e}")
+
         elif wybor == "0":
             print("Do widzenia!")
             break
@@ -286,4 +1215,16 @@ def menu_interaktywne():
 
 
 if __name__ == "__main__":
-    menu_interaktywne()
+    # python kalorie.py migruj - aktualizacja schematu bazy, raz przy wdrożeniu
+    if sys.argv[1:] == ['migruj']:
+        wykonane = migruj()
+        print(f"Wykonane migracje: {wykonane}, wersja schematu: {wersja_schematu()}")
+    # python kalorie.py import|eksport plik.csv - bez menu, np. w skryptach
+    elif len(sys.argv) == 3 and sys.argv[1] in ('import', 'eksport'):
+        init_db()
+        if sys.argv[1] == 'import':
+            wypisz_raport(importuj_produkty(Path(sys.argv[2])))
+        else:
+            print(f"Wyeksportowano produktów: {eksportuj_produkty(Path(sys.argv[2]))}")
+    else:
+        menu_interaktywne()
@@ -0,0 +1,167 @@
+"""
+Lekkie metryki w pamięci procesu: histogramy czasów i liczniki.
+
+Rejestr jest eksportowany w formacie tekstowym Prometheusa, a czasy zmierzone
+w trakcie jednego zapytania HTTP trafiają dodatkowo do nagłówka Server-Timing.
+Każdy worker gunicorna ma własny rejestr.
+"""
+
+import inspect
+import threading
+import time
+from bisect import bisect_left
+from contextvars import ContextVar, copy_context
+from functools import wraps
+
+# Górne granice przedziałów histogramów czasu (sekundy)
+PRZEDZIALY = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+# Histogram czasów operacji mierzonych dekoratorem `mierzona`
+METRYKA_OPERACJI = 'kalorie_operacja_sekundy'
+
+
+class Histogram:
+    """Liczba obserwacji w przedziałach PRZEDZIALY oraz ich suma."""
+
+    def __init__(self):
+        self.kubelki = [0] * (len(PRZEDZIALY) + 1)  # ostatni: powyżej największej granicy
+        self.suma = 0.0
+        self.liczba = 0
+
+    def dodaj(self, wartosc: float):
+        self.kubelki[bisect_left(PRZEDZIALY, wartosc)] += 1
+        self.suma += wartosc
+        self.liczba += 1
+
+
+class Rejestr:
+    """Histogramy i liczniki z etykietami, bezpieczne dla wielu wątków."""
+
+    def __init__(self):
+        self.histogramy = {}
+        self.liczniki = {}
+        self._lock = threading.Lock()
+
+    def obserwuj(self, nazwa: str, wartosc: float, **etykiety):
+        klucz = (nazwa, tuple(sorted(etykiety.items())))
+        with self._lock:
+            histogram = self.histogramy.get(klucz)
+            if histogram is None:
+                histogram = self.histogramy[klucz] = Histogram()
+            histogram.dodaj(wartosc)
+
+    def zwieksz(self, nazwa: str, ile: int = 1, **etykiety):
+        klucz = (nazwa, tuple(sorted(etykiety.items())))
+        with self._lock:
+            self.liczniki[klucz] = self.liczniki.get(klucz, 0) + ile
+
+    def tekst(self) -> str:
+        """Zwraca wszystkie metryki w formacie tekstowym Prometheusa."""
+        with self._lock:
+            liczniki = sorted(self.liczniki.items())
+            histogramy = sorted(
+                (klucz, list(h.kubelki), h.suma, h.liczba) for klucz, h in self.histogramy.items()
+            )
+
+        linie = []
+        ostatnia = None
+        for (nazwa, etykiety), wartosc in liczniki:
+            if nazwa != ostatnia:
+                linie.append(f"# TYPE {nazwa} counter")
+                ostatnia = nazwa
+            linie.append(f"{nazwa}{_etykiety(etykiety)} {wartosc}")
+
+        for (nazwa, etykiety), kubelki, suma, liczba in histogramy:
+            if nazwa != ostatnia:
+                linie.append(f"# TYPE {nazwa} histogram")
+                ostatnia = nazwa
+            narastajaco = 0
+            for granica, ile in zip(PRZEDZIALY + ('+Inf',), kubelki):
+                narastajaco += ile
+                linie.append(f"{nazwa}_bucket{_etykiety(etykiety + (('le', str(granica)),))} {narastajaco}")
+            linie.append(f"{nazwa}_sum{_etykiety(etykiety)} {suma}")
+            linie.append(f"{nazwa}_count{_etykiety(etykiety)} {liczba}")
+        return '\n'.join(linie) + '\n'
+
+
+def _etykiety(etykiety) -> str:
+    """Formatuje etykiety jako {a="1",b="2"} (z wymaganym przez format escapowaniem)."""
+    if not etykiety:
+        return ''
+    pary = []
+    for klucz, wartosc in etykiety:
+        wartosc = str(wartosc).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+        pary.append(f'{klucz}="{wartosc}"')
+    return '{' + ','.join(pary) + '}'
+
+
+rejestr = Rejestr()
+
+# Czasy operacji bieżącego zapytania HTTP: lista (nazwa, sekundy) albo None poza zapytaniem
+_pomiary = ContextVar('pomiary', default=None)
+
+
+def zacznij_pomiar():
+    """Zaczyna zbieranie czasów operacji dla bieżącego zapytania i zwraca ich listę."""
+    pomiary = []
+    _pomiary.set(pomiary)
+    return pomiary
+
+
+def w_kontekscie(funkcja):
+    """Opakowuje funkcję uruchamianą w innym wątku (np. pula), żeby jej pomiary
+    trafiały do zapytania, które ją zleciło."""
+    kontekst = copy_context()
+    return lambda *args, **kwargs: kontekst.run(funkcja, *args, **kwargs)
+
+
+def mierzona(operacja: str):
+    """Dekorator: zapisuje czas wywołania w histogramie i w pomiarach bieżącego zapytania.
+
+    Działa też z funkcjami async (mierzony jest czas do zakończenia korutyny).
+    """
+    def zapisz(start):
+        czas = time.perf_counter() - start
+        rejestr.obserwuj(METRYKA_OPERACJI, czas, operacja=operacja)
+        pomiary = _pomiary.get()
+        if pomiary is not None:
+            pomiary.append((operacja, czas))
+
+    def dekorator(funkcja):
+        if inspect.iscoroutinefunction(funkcja):
+            @wraps(funkcja)
+            async def opakowana_async(*args, **kwargs):
+                start = time.perf_counter()
+                try:
+                    return await funkcja(*args, **kwargs)
+                finally:
+                    zapisz(start)
+            return opakowana_async
+
+        @wraps(funkcja)
+        def opakowana(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return funkcja(*args, **kwargs)
+            finally:
+                zapisz(start)
+        return opakowana
+    return dekorator
+
+
+def server_timing(pomiary, calosc: float) -> str:
+    """Buduje nagłówek Server-Timing: suma czasów każdej operacji i czas całego zapytania.
+
+    Operacje wykonywane równolegle (np. kilka zapytań do API) są sumowane,
+    a ich liczba trafia do opisu.
+    """
+    sumy = {}
+    for operacja, czas in list(pomiary):
+        suma, liczba = sumy.get(operacja, (0.0, 0))
+        sumy[operacja] = (suma + czas, liczba + 1)
+    czesci = [
+        f'{operacja};dur={suma * 1000:.2f}' + (f';desc="{liczba}x"' if liczba > 1 else '')
+        for operacja, (suma, liczba) in sumy.items()
+    ]
+    czesci.append(f'total;dur={calosc * 1000:.2f}')
+    return ', '.join(czesci)
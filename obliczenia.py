@@ -0,0 +1,378 @@
+"""
+Obliczenia wartości odżywczych dla wielu produktów i porcji naraz (NumPy).
+
+Składniki z tabeli produkty są trzymane w macierzy N x 4 (kolejność jak w SKLADNIKI).
+Porcje, sumy dzienne wielu użytkowników i filtry liczone są na całych tablicach,
+bez pętli w Pythonie po pojedynczych wierszach. Zamienniki (produkty o najbliższym
+profilu składników) wyszukuje drzewo k-d zbudowane na tej samej macierzy.
+"""
+
+import heapq
+import threading
+
+import numpy as np
+
+from kalorie import SKLADNIKI, get_connection, wersja_produktow
+from produkty_lokalne import dane_lokalne
+
+# Ile wierszy pobieramy z bazy naraz przy budowie macierzy
+ROZMIAR_PARTII = 50000
+
+# Jednostki odległości między produktami: 10 kcal różnicy liczy się jak 1 g makroskładnika
+SKALA_ODLEGLOSCI = np.array([10.0, 1.0, 1.0, 1.0])
+
+# Najwięcej punktów w liściu drzewa k-d - liście przeglądane są wektorowo,
+# a węzły wewnętrzne w pętli Pythona
+ROZMIAR_LISCIA = 64
+
+# Najwięcej produktów dodanych po zbudowaniu drzewa, przeglądanych bez niego -
+# po przekroczeniu drzewo budowane jest od nowa
+MAKS_DOPISANYCH = 5000
+
+
+class TabelaSkladnikow:
+    """Macierz składników produktów z bazy, posortowana po id."""
+
+    def __init__(self, ids, nazwy, wartosci, wersja: int = 0):
+        self.ids = np.asarray(ids, dtype=np.int64)
+        self.nazwy = nazwy
+        self.wartosci = np.asarray(wartosci, dtype=np.float64).reshape(-1, len(SKLADNIKI))
+        self.wersja = wersja
+
+    @classmethod
+    def z_bazy(cls):
+        """Wczytuje kolumny składników wszystkich produktów."""
+        conn = get_connection()
+        wersja = wersja_produktow()
+        cursor = conn.execute("""
+            SELECT id, nazwa, kalorie, bialko, weglowodany, tluszcze
+            FROM produkty ORDER BY id
+        """)
+        ids, nazwy, wartosci = [], [], []
+        while True:
+            partia = cursor.fetchmany(ROZMIAR_PARTII)
+            if not partia:
+                break
+            kolumny = list(zip(*partia))
+            ids.append(np.array(kolumny[0], dtype=np.int64))
+            nazwy.extend(kolumny[1])
+            wartosci.append(np.array(kolumny[2:6], dtype=np.float64).T)
+        if not ids:
+            return cls([], [], np.empty((0, len(SKLADNIKI))), wersja)
+        return cls(np.concatenate(ids), nazwy, np.concatenate(wartosci), wersja)
+
+    def __len__(self):
+        return len(self.ids)
+
+    def indeksy(self, ids) -> np.ndarray:
+        """Zamienia id produktów na numery wierszy macierzy. Nieznane id -> KeyError."""
+        ids = np.asarray(ids, dtype=np.int64)
+        nr = np.searchsorted(self.ids, ids)
+        nr = np.minimum(nr, len(self.ids) - 1)
+        brakujace = self.ids[nr] != ids if len(self.ids) else np.ones(ids.shape, dtype=bool)
+        if brakujace.any():
+            raise KeyError(f"Nieznane id produktów: {ids[brakujace][:10].tolist()}")
+        return nr
+
+    def porcje(self, ids, gramy) -> np.ndarray:
+        """Wartości odżywcze porcji: macierz len(ids) x 4."""
+        gramy = np.asarray(gramy, dtype=np.float64)
+        return self.wartosci[self.indeksy(ids)] * (gramy / 100)[:, None]
+
+    def sumy(self, grupy, ids, gramy, liczba_grup: int = None) -> np.ndarray:
+        """Sumuje porcje w grupach (np. użytkownik-dzień): macierz liczba_grup x 4.
+
+        Wejście to trzy równoległe tablice: numer grupy, id produktu i gramatura
+        każdej pozycji. Odpowiada iloczynowi rzadkiej macierzy gramatur (grupy x produkty)
+        przez macierz składników.
+        """
+        grupy = np.asarray(grupy, dtype=np.int64)
+        if liczba_grup is None:
+            liczba_grup = int(grupy.max()) + 1 if len(grupy) else 0
+        porcje = self.porcje(ids, gramy)
+        wynik = np.empty((liczba_grup, len(SKLADNIKI)))
+        for k in range(len(SKLADNIKI)):
+            wynik[:, k] = np.bincount(grupy, weights=porcje[:, k], minlength=liczba_grup)
+        return wynik
+
+    def jadlospis(self, ids, gramy) -> np.ndarray:
+        """Sumy dla gęstej macierzy gramatur (plany x len(ids)): macierz plany x 4."""
+        return (np.asarray(gramy, dtype=np.float64) / 100) @ self.wartosci[self.indeksy(ids)]
+
+    def pasujace(self, maks_kalorii: float, min_bialka: float = 0.0, gramy: float = 100) -> np.ndarray:
+        """Id produktów, których porcja ma najwyżej `maks_kalorii` kcal i co najmniej `min_bialka` g białka."""
+        mnoznik = gramy / 100
+        maska = (self.wartosci[:, 0] * mnoznik <= maks_kalorii) & (self.wartosci[:, 1] * mnoznik >= min_bialka)
+        return self.ids[maska]
+
+
+def sumy_tygodniowe(dzienne: np.ndarray) -> np.ndarray:
+    """Zamienia sumy dzienne (użytkownicy x dni x 4) na tygodniowe (użytkownicy x tygodnie x 4).
+
+    Niepełny ostatni tydzień jest sumowany z dni, które są.
+    """
+    uzytkownicy, dni, skladniki = dzienne.shape
+    tygodnie = -(-dni // 7)
+    uzupelnione = np.zeros((uzytkownicy, tygodnie * 7, skladniki))
+    uzupelnione[:, :dni] = dzienne
+    return uzupelnione.reshape(uzytkownicy, tygodnie, 7, skladniki).sum(axis=2)
+
+
+_tabela = None
+_tabela_lock = threading.Lock()
+
+
+def tabela_skladnikow() -> TabelaSkladnikow:
+    """Współdzielona macierz składników, wczytywana ponownie po każdej zmianie produktów."""
+    global _tabela
+    wersja = wersja_produktow()
+    tabela = _tabela
+    if tabela is not None and tabela.wersja == wersja:
+        return tabela
+    with _tabela_lock:
+        if _tabela is None or _tabela.wersja != wersja:
+            _tabela = TabelaSkladnikow.z_bazy()
+        return _tabela
+
+
+class DrzewoKD:
+    """Drzewo k-d punktów (wierszy macierzy) do wyszukiwania k najbliższych sąsiadów.
+
+    Każdy węzeł dzieli swoje punkty na połowy wzdłuż osi o największym rozrzucie,
+    aż do liści po najwyżej `rozmiar_liscia` punktów. Punkty są przestawione tak, że
+    węzeł to ciągły zakres wierszy, a każdy węzeł zna prostokąt obejmujący jego punkty.
+    """
+
+    def __init__(self, punkty, rozmiar_liscia: int = ROZMIAR_LISCIA):
+        punkty = np.asarray(punkty, dtype=np.float64)
+        # Punkty przestawiane są w miejscu, po współrzędnych (wiersz na oś) - zakres
+        # węzła to widok, a minimum i maksimum liczone są wzdłuż ciągłych wierszy
+        osie = np.ascontiguousarray(punkty.T)
+        kolejnosc = np.arange(len(punkty))
+
+        # Węzły w kolejności wszerz: dzieci węzła mają zawsze większe numery od niego
+        self.zakresy = [(0, len(punkty))]
+        self.dzieci = []
+        glebokosci = [0]
+        nr = 0
+        while nr < len(self.zakresy):
+            od, do = self.zakresy[nr]
+            if do - od <= rozmiar_liscia:
+                self.dzieci.append(None)
+                nr += 1
+                continue
+            fragment = osie[:, od:do]
+            os = int(np.argmax(fragment.max(axis=1) - fragment.min(axis=1)))
+            polowa = (do - od) // 2
+            podzial = np.argpartition(fragment[os], polowa)
+            osie[:, od:do] = fragment[:, podzial]
+            kolejnosc[od:do] = kolejnosc[od:do][podzial]
+            self.dzieci.append((len(self.zakresy), len(self.zakresy) + 1))
+            self.zakresy += [(od, od + polowa), (od + polowa, do)]
+            glebokosci += [glebokosci[nr] + 1] * 2
+            nr += 1
+
+        self.kolejnosc = kolejnosc
+        self.punkty = np.ascontiguousarray(osie.T)
+
+        # Prostokąty: liście z ich punktów (reduceat po zakresach), węzły wewnętrzne
+        # z dzieci - poziomami, od najgłębszego
+        wymiary = punkty.shape[1]
+        self.dolne = np.full((len(self.zakresy), wymiary), np.inf)
+        self.gorne = np.full((len(self.zakresy), wymiary), -np.inf)
+        liscie = [nr for nr, d in enumerate(self.dzieci) if d is None and self.zakresy[nr][0] < self.zakresy[nr][1]]
+        if liscie:
+            liscie.sort(key=lambda nr: self.zakresy[nr][0])
+            poczatki = [self.zakresy[nr][0] for nr in liscie]
+            self.dolne[liscie] = np.minimum.reduceat(self.punkty, poczatki)
+            self.gorne[liscie] = np.maximum.reduceat(self.punkty, poczatki)
+        wewnetrzne = np.array([nr for nr, d in enumerate(self.dzieci) if d is not None], dtype=np.intp)
+        if len(wewnetrzne):
+            lewe = np.array([self.dzieci[nr][0] for nr in wewnetrzne.tolist()], dtype=np.intp)
+            poziomy = np.array(glebokosci)[wewnetrzne]
+            for poziom in range(int(poziomy.max()), -1, -1):
+                wezly, dzieci = wewnetrzne[poziomy == poziom], lewe[poziomy == poziom]
+                self.dolne[wezly] = np.minimum(self.dolne[dzieci], self.dolne[dzieci + 1])
+                self.gorne[wezly] = np.maximum(self.gorne[dzieci], self.gorne[dzieci + 1])
+
+    def __len__(self):
+        return len(self.punkty)
+
+    def najblizsze(self, punkt, k: int):
+        """Kwadraty odległości i numery (wiersze macierzy wejściowej) k punktów najbliższych `punkt`.
+
+        Węzły są odwiedzane od najbliższego prostokąta; węzeł dalszy niż k-ty znaleziony
+        punkt jest pomijany razem z poddrzewem.
+        """
+        punkt = np.asarray(punkt, dtype=np.float64)
+        odleglosci = np.empty(0)
+        numery = np.empty(0, dtype=np.intp)
+        if k <= 0 or not len(self):
+            return odleglosci, numery
+
+        prog = np.inf
+        kolejka = [(0.0, 0)]
+        while kolejka:
+            odleglosc, nr = heapq.heappop(kolejka)
+            if odleglosc >= prog:
+                break
+            dzieci = self.dzieci[nr]
+            if dzieci is None:
+                od, do = self.zakresy[nr]
+                roznice = self.punkty[od:do] - punkt
+                odleglosci = np.concatenate((odleglosci, np.einsum('ij,ij->i', roznice, roznice)))
+                numery = np.concatenate((numery, np.arange(od, do)))
+                if len(odleglosci) > k:
+                    najblizsze = np.argpartition(odleglosci, k - 1)[:k]
+                    odleglosci, numery = odleglosci[najblizsze], numery[najblizsze]
+                if len(odleglosci) == k:
+                    prog = odleglosci.max()
+                continue
+            # Odległość od prostokąta: zero wzdłuż osi, na których punkt leży w jego zakresie
+            poza = np.maximum(self.dolne[list(dzieci)] - punkt, 0) + np.maximum(punkt - self.gorne[list(dzieci)], 0)
+            for dziecko, odleglosc in zip(dzieci, np.einsum('ij,ij->i', poza, poza).tolist()):
+                if odleglosc < prog:
+                    heapq.heappush(kolejka, (odleglosc, dziecko))
+
+        kolejne = np.argsort(odleglosci, kind='stable')
+        return odleglosci[kolejne], self.kolejnosc[numery[kolejne]]
+
+
+class ZamiennikiProduktow:
+    """Produkty listy lokalnej i bazy jako punkty (kalorie, białko, węglowodany, tłuszcze)
+    do wyszukiwania zamienników - produktów o najbliższym profilu składników.
+
+    Główna część ma drzewo k-d (całość i osobne drzewa kategorii, budowane przy pierwszym
+    zapytaniu o kategorię). Produkty dodane później trafiają do małej części dopisanej,
+    przeglądanej bez drzewa, a po MAKS_DOPISANYCH całość budowana jest od nowa.
+    Wiersze macierzy to najpierw produkty `lokalne`, a po nich produkty bazy o id `ids`.
+    """
+
+    def __init__(self, lokalne, ids, wartosci, kategorie, wersja: int = 0, ostatnie_id: int = 0):
+        self.lokalne = lokalne
+        self.ids = np.asarray(ids, dtype=np.int64)
+        self.punkty = np.asarray(wartosci, dtype=np.float64).reshape(-1, len(SKLADNIKI)) / SKALA_ODLEGLOSCI
+        self.kody_kategorii = {}
+        self.kategorie = np.array([self.kody_kategorii.setdefault(k, len(self.kody_kategorii)) for k in kategorie],
+                                  dtype=np.intp)
+        self.wersja = wersja
+        self.ostatnie_id = ostatnie_id
+        self.drzewa = {None: (DrzewoKD(self.punkty), None)}
+        self._drzewa_lock = threading.Lock()
+
+        self.dopisane = np.empty(0, dtype=np.int64)
+        self.dopisane_punkty = np.empty((0, len(SKLADNIKI)))
+        self.dopisane_kategorie = []
+
+    @classmethod
+    def z_bazy(cls):
+        """Buduje indeks z listy lokalnej i wszystkich produktów bazy."""
+        lokalne = dane_lokalne().produkty
+        ids = []
+        wartosci = [np.array([[p[s] for s in SKLADNIKI] for p in lokalne], dtype=np.float64)
+                    .reshape(-1, len(SKLADNIKI))]
+        kategorie = [p.kategoria for p in lokalne]
+
+        wersja = wersja_produktow()
+        cursor = get_connection().execute("""
+            SELECT id, kalorie, bialko, weglowodany, tluszcze, kategoria
+            FROM produkty ORDER BY id
+        """)
+        while True:
+            partia = cursor.fetchmany(ROZMIAR_PARTII)
+            if not partia:
+                break
+            kolumny = list(zip(*partia))
+            ids.append(np.array(kolumny[0], dtype=np.int64))
+            wartosci.append(np.array(kolumny[1:5], dtype=np.float64).T)
+            kategorie.extend(kolumny[5])
+        ids = np.concatenate(ids) if ids else np.empty(0, dtype=np.int64)
+        ostatnie_id = int(ids[-1]) if len(ids) else 0
+        return cls(lokalne, ids, np.concatenate(wartosci), kategorie, wersja, ostatnie_id)
+
+    def aktualizuj(self):
+        """Indeks dla bieżącej wersji produktów.
+
+        Gdy od zbudowania indeksu produkty były tylko dodawane (każda zmiana podnosi wersję
+        o jeden, a nowe wiersze mają większe id), zwraca kopię z dopisanymi produktami
+        i tymi samymi drzewami. Po zmianie lub usunięciu produktu buduje indeks od nowa.
+        """
+        wersja = wersja_produktow()
+        nowe = get_connection().execute("""
+            SELECT id, kalorie, bialko, weglowodany, tluszcze, kategoria
+            FROM produkty WHERE id > ? ORDER BY id
+        """, (self.ostatnie_id,)).fetchall()
+        if len(nowe) != wersja - self.wersja or len(self.dopisane) + len(nowe) > MAKS_DOPISANYCH:
+            return ZamiennikiProduktow.z_bazy()
+
+        kopia = object.__new__(ZamiennikiProduktow)
+        kopia.__dict__.update(self.__dict__)
+        kopia.wersja = wersja
+        if nowe:
+            kopia.ostatnie_id = nowe[-1][0]
+            kopia.dopisane = np.concatenate((self.dopisane, np.array([w[0] for w in nowe], dtype=np.int64)))
+            kopia.dopisane_punkty = np.concatenate((
+                self.dopisane_punkty, np.array([w[1:5] for w in nowe], dtype=np.float64) / SKALA_ODLEGLOSCI
+            ))
+            kopia.dopisane_kategorie = self.dopisane_kategorie + [w[5] for w in nowe]
+        return kopia
+
+    def __len__(self):
+        return len(self.punkty) + len(self.dopisane)
+
+    def produkt(self, nr: int):
+        """Produkt wiersza głównej części: ProduktLokalny albo id w tabeli produkty."""
+        return self.lokalne[nr] if nr < len(self.lokalne) else int(self.ids[nr - len(self.lokalne)])
+
+    def drzewo(self, kategoria):
+        """Drzewo produktów głównej części z kategorii (None - wszystkich) i numery ich wierszy."""
+        kod = None if kategoria is None else self.kody_kategorii.get(kategoria, -1)
+        with self._drzewa_lock:
+            if kod not in self.drzewa:
+                numery = np.flatnonzero(self.kategorie == kod)
+                self.drzewa[kod] = (DrzewoKD(self.punkty[numery]), numery)
+            return self.drzewa[kod]
+
+    def najblizsze(self, wartosci, k: int, kategoria: str = None):
+        """k produktów najbliższych wartościom składników na 100g, opcjonalnie tylko z kategorii.
+
+        Zwraca listę (odległość, produkt) od najbliższego, gdzie produkt to ProduktLokalny
+        albo id w tabeli produkty.
+        """
+        punkt = np.asarray(wartosci, dtype=np.float64) / SKALA_ODLEGLOSCI
+        drzewo, numery = self.drzewo(kategoria)
+        odleglosci, wiersze = drzewo.najblizsze(punkt, k)
+        wyniki = [(odleglosc, self.produkt(nr)) for odleglosc, nr in
+                  zip(odleglosci.tolist(), (wiersze if numery is None else numery[wiersze]).tolist())]
+
+        if len(self.dopisane):
+            roznice = self.dopisane_punkty - punkt
+            dopisane = np.einsum('ij,ij->i', roznice, roznice)
+            if kategoria is not None:
+                dopisane[[kat != kategoria for kat in self.dopisane_kategorie]] = np.inf
+            najblizsze = np.argsort(dopisane, kind='stable')[:k]
+            wyniki.extend((odleglosc, int(id_produktu)) for odleglosc, id_produktu in
+                          zip(dopisane[najblizsze].tolist(), self.dopisane[najblizsze].tolist())
+                          if odleglosc < np.inf)
+            wyniki.sort(key=lambda w: w[0])
+
+        return [(float(np.sqrt(odleglosc)), produkt) for odleglosc, produkt in wyniki[:k]]
+
+
+_zamienniki = None
+_zamienniki_lock = threading.Lock()
+
+
+def zamienniki_produktow() -> ZamiennikiProduktow:
+    """Współdzielony indeks zamienników, aktualizowany po każdej zmianie produktów."""
+    global _zamienniki
+    wersja = wersja_produktow()
+    indeks = _zamienniki
+    if indeks is not None and indeks.wersja == wersja:
+        return indeks
+    with _zamienniki_lock:
+        if _zamienniki is None:
+            _zamienniki = ZamiennikiProduktow.z_bazy()
+        elif _zamienniki.wersja != wersja:
+            _zamienniki = _zamienniki.aktualizuj()
+        return _zamienniki
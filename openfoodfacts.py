@@ -0,0 +1,306 @@
+"""
+Klient Open Food Facts API.
+Jedna sesja HTTP na proces: pula połączeń keep-alive, kompresja gzip,
+ograniczone ponawianie zapytań i bezpiecznik odcinający API po serii błędów.
+Równoległe identyczne zapytania łączy WspolneZapytania (jedno zapytanie, wspólny wynik).
+"""
+
+import asyncio
+import os
+import threading
+import time
+from concurrent.futures import Future
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+ADRES_API = os.environ.get('OFF_URL', 'https://pl.openfoodfacts.org')
+
+NAGLOWKI = {
+    'User-Agent': 'BazaKalorii/1.0 (https://github.com/polycheckone/baza-kalorii)',
+    'Accept': 'application/json',
+    'Accept-Encoding': 'gzip, deflate',
+}
+POLA = 'code,product_name,brands,nutriments'
+
+
+def parametry_wyszukiwania(fraza: str) -> dict:
+    """Parametry zapytania do wyszukiwarki /cgi/search.pl."""
+    return {
+        'search_terms': fraza,
+        'search_simple': 1,
+        'action': 'process',
+        'json': 1,
+        'page_size': 15,
+        'fields': POLA,
+    }
+
+
+def kalorie_na_100g(nutriments: dict) -> float:
+    """Zwraca kcal na 100g z pól nutriments (energia podana w kJ jest przeliczana)."""
+    kalorie = nutriments.get('energy-kcal_100g') or nutriments.get('energy_100g', 0)
+    if isinstance(kalorie, str):
+        kalorie = 0
+    if kalorie > 900:
+        kalorie = kalorie / 4.184
+    return round(float(kalorie), 1)
+
+
+def produkt_z_off(product: dict):
+    """Zamienia produkt z Open Food Facts na słownik w formacie aplikacji.
+
+    Zwraca None dla produktów bez nazwy.
+    """
+    nazwa = product.get('product_name', '')
+    if not nazwa:
+        return None
+
+    marka = product.get('brands', '')
+    nutriments = product.get('nutriments', {})
+    return {
+        'id': product.get('code', ''),
+        'kod': product.get('code') or None,
+        'nazwa': f"{nazwa} ({marka})" if marka else nazwa,
+        'kalorie': kalorie_na_100g(nutriments),
+        'bialko': round(float(nutriments.get('proteins_100g', 0) or 0), 1),
+        'weglowodany': round(float(nutriments.get('carbohydrates_100g', 0) or 0), 1),
+        'tluszcze': round(float(nutriments.get('fat_100g', 0) or 0), 1),
+    }
+
+
+class UslugaNiedostepna(requests.RequestException):
+    """API jest chwilowo odcięte przez bezpiecznik - zapytanie nie zostało wysłane."""
+
+
+class LimitPrzekroczony(requests.RequestException):
+    """Wyczerpany limit zapytań do API - zapytanie nie zostało wysłane."""
+
+
+class WspolneZapytania:
+    """Łączy równoległe wywołania z tym samym kluczem: pierwsze wykonuje funkcję, a pozostałe
+    czekają na nie i dostają ten sam wynik (albo ten sam błąd).
+
+    `przy_dolaczeniu` jest wywoływana dla każdego wywołania, które dołączyło do trwającego.
+    """
+
+    def __init__(self, przy_dolaczeniu=None):
+        self.przy_dolaczeniu = przy_dolaczeniu
+        self._w_toku = {}
+        self._lock = threading.Lock()
+
+    def wykonaj(self, klucz, funkcja):
+        with self._lock:
+            wynik = self._w_toku.get(klucz)
+            pierwsze = wynik is None
+            if pierwsze:
+                wynik = self._w_toku[klucz] = Future()
+
+        if not pierwsze:
+            if self.przy_dolaczeniu:
+                self.przy_dolaczeniu()
+            return wynik.result()
+
+        try:
+            wartosc = funkcja()
+        except BaseException as e:
+            wynik.set_exception(e)
+            raise
+        else:
+            wynik.set_result(wartosc)
+            return wartosc
+        finally:
+            with self._lock:
+                del self._w_toku[klucz]
+
+
+class WspolneZapytaniaAsync:
+    """WspolneZapytania dla korutyn jednej pętli zdarzeń (tryb ASGI).
+
+    Wspólne zadanie nie jest przerywane, gdy czekający na nie przestanie czekać.
+    """
+
+    def __init__(self, przy_dolaczeniu=None):
+        self.przy_dolaczeniu = przy_dolaczeniu
+        self._w_toku = {}
+
+    async def wykonaj(self, klucz, funkcja):
+        zadanie = self._w_toku.get(klucz)
+        if zadanie is None:
+            zadanie = self._w_toku[klucz] = asyncio.ensure_future(funkcja())
+            zadanie.add_done_callback(lambda z: self._zakonczone(klucz, z))
+        elif self.przy_dolaczeniu:
+            self.przy_dolaczeniu()
+        return await asyncio.shield(zadanie)
+
+    def _zakonczone(self, klucz, zadanie):
+        self._w_toku.pop(klucz, None)
+        if not zadanie.cancelled():
+            zadanie.exception()  # odebrany błąd nie jest zgłaszany jako nieobsłużony
+
+
+class Bezpiecznik:
+    """Po `prog_bledow` kolejnych błędach blokuje zapytania na `czas_otwarcia` sekund.
+
+    Po tym czasie przepuszcza zapytania próbne - pierwszy sukces zamyka bezpiecznik,
+    a kolejny błąd od razu otwiera go ponownie.
+    """
+
+    def __init__(self, prog_bledow: int = 5, czas_otwarcia: float = 30):
+        self.prog_bledow = prog_bledow
+        self.czas_otwarcia = czas_otwarcia
+        self.bledy = 0
+        self.otwarty_do = 0.0
+        self._lock = threading.Lock()
+
+    def pozwala(self) -> bool:
+        """Czy można teraz wysłać zapytanie."""
+        return time.monotonic() >= self.otwarty_do
+
+    def sukces(self):
+        with self._lock:
+            self.bledy = 0
+            self.otwarty_do = 0.0
+
+    def porazka(self):
+        with self._lock:
+            self.bledy += 1
+            if self.bledy >= self.prog_bledow:
+                self.otwarty_do = time.monotonic() + self.czas_otwarcia
+
+
+class KlientOpenFoodFacts:
+    """Klient wyszukiwarki Open Food Facts współdzielony przez wątki procesu."""
+
+    def __init__(self, adres: str = ADRES_API, timeout: float = 5, rozmiar_puli: int = 10,
+                 proby: int = 2, bezpiecznik: Bezpiecznik = None):
+        self.adres = adres.rstrip('/')
+        self.timeout = timeout
+        self.bezpiecznik = bezpiecznik or Bezpiecznik()
+
+        # Ponawiamy tylko błędy połączenia i odpowiedzi 5xx/429 - nie timeout odczytu,
+        # który i tak zjadłby cały czas przeznaczony na wyszukiwanie
+        ponawianie = Retry(
+            total=proby,
+            connect=proby,
+            read=0,
+            status=proby,
+            backoff_factor=0.2,
+            status_forcelist=(429, 500, 502, 503, 504),
+            allowed_methods=frozenset(['GET']),
+            respect_retry_after_header=False,
+            raise_on_status=False,
+        )
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=rozmiar_puli, max_retries=ponawianie)
+
+        self.sesja = requests.Session()
+        self.sesja.mount('https://', adapter)
+        self.sesja.mount('http://', adapter)
+        self.sesja.headers.update(NAGLOWKI)
+
+    def szukaj(self, fraza: str, timeout: float = None):
+        """Zwraca listę produktów (słowniki z API) pasujących do frazy."""
+        if not self.bezpiecznik.pozwala():
+            raise UslugaNiedostepna("Open Food Facts chwilowo odcięte po serii błędów")
+
+        try:
+            response = self.sesja.get(f'{self.adres}/cgi/search.pl', params=parametry_wyszukiwania(fraza),
+                                      timeout=timeout or self.timeout)
+            response.raise_for_status()
+            produkty = response.json().get('products', [])
+        except requests.RequestException:
+            self.bezpiecznik.porazka()
+            raise
+
+        self.bezpiecznik.sukces()
+        return produkty
+
+    def produkt(self, kod: str, timeout: float = None):
+        """Zwraca produkt o podanym kodzie kreskowym jako listę [produkt] (pustą, gdy API go nie zna)."""
+        if not self.bezpiecznik.pozwala():
+            raise UslugaNiedostepna("Open Food Facts chwilowo odcięte po serii błędów")
+
+        try:
+            response = self.sesja.get(f'{self.adres}/api/v2/product/{kod}.json', params={'fields': POLA},
+                                      timeout=timeout or self.timeout)
+            # Nieznany kod to 404 - poprawna odpowiedź, a nie awaria API
+            if response.status_code == 404:
+                produkty = []
+            else:
+                response.raise_for_status()
+                dane = response.json()
+                produkty = [dane['product']] if dane.get('status') == 1 and dane.get('product') else []
+        except requests.RequestException:
+            self.bezpiecznik.porazka()
+            raise
+
+        self.bezpiecznik.sukces()
+        return produkty
+
+    def zamknij(self):
+        self.sesja.close()
+
+
+class KlientOpenFoodFactsAsync:
+    """Asynchroniczny klient wyszukiwarki (httpx) dla trybu ASGI - czekanie na API nie zajmuje wątku.
+
+    Błędy zgłasza jako requests.RequestException (jak klient synchroniczny), więc
+    kod obsługujący oba klienty jest ten sam.
+    """
+
+    def __init__(self, adres: str = ADRES_API, timeout: float = 5, rozmiar_puli: int = 100,
+                 proby: int = 2, bezpiecznik: Bezpiecznik = None):
+        import httpx  # potrzebny tylko w trybie ASGI
+
+        self.adres = adres.rstrip('/')
+        self.timeout = timeout
+        self.bezpiecznik = bezpiecznik or Bezpiecznik()
+        self._httpx = httpx
+        # Transport ponawia tylko nieudane nawiązanie połączenia
+        self.klient = httpx.AsyncClient(
+            headers=NAGLOWKI,
+            limits=httpx.Limits(max_connections=rozmiar_puli, max_keepalive_connections=rozmiar_puli),
+            transport=httpx.AsyncHTTPTransport(retries=proby),
+        )
+
+    async def szukaj(self, fraza: str, timeout: float = None):
+        """Zwraca listę produktów (słowniki z API) pasujących do frazy."""
+        if not self.bezpiecznik.pozwala():
+            raise UslugaNiedostepna("Open Food Facts chwilowo odcięte po serii błędów")
+
+        try:
+            response = await self.klient.get(f'{self.adres}/cgi/search.pl', params=parametry_wyszukiwania(fraza),
+                                             timeout=timeout or self.timeout)
+            response.raise_for_status()
+            produkty = response.json().get('products', [])
+        except (self._httpx.HTTPError, ValueError) as e:
+            self.bezpiecznik.porazka()
+            raise requests.RequestException(str(e)) from e
+
+        self.bezpiecznik.sukces()
+        return produkty
+
+    async def produkt(self, kod: str, timeout: float = None):
+        """Zwraca produkt o podanym kodzie kreskowym jako listę [produkt] (pustą, gdy API go nie zna)."""
+        if not self.bezpiecznik.pozwala():
+            raise UslugaNiedostepna("Open Food Facts chwilowo odcięte po serii błędów")
+
+        try:
+            response = await self.klient.get(f'{self.adres}/api/v2/product/{kod}.json', params={'fields': POLA},
+                                             timeout=timeout or self.timeout)
+            # Nieznany kod to 404 - poprawna odpowiedź, a nie awaria API
+            if response.status_code == 404:
+                produkty = []
+            else:
+                response.raise_for_status()
+                dane = response.json()
+                produkty = [dane['product']] if dane.get('status') == 1 and dane.get('product') else []
+        except (self._httpx.HTTPError, ValueError) as e:
+            self.bezpiecznik.porazka()
+            raise requests.RequestException(str(e)) from e
+
+        self.bezpiecznik.sukces()
+        return produkty
+
+    async def zamknij(self):
+        await self.klient.aclose()
@@ -0,0 +1,72 @@
+"""
+Lokalna lista podstawowych produktów (wartości na 100g).
+Dane leżą w pliku produkty_lokalne.csv z gotowymi, znormalizowanymi nazwami
+i są wczytywane przy pierwszym użyciu, a nie przy imporcie modułu.
+"""
+
+import csv
+import hashlib
+from functools import lru_cache
+from pathlib import Path
+
+from indeks import IndeksNazw
+
+PLIK = Path(__file__).parent / "produkty_lokalne.csv"
+
+
+def liczba(tekst: str):
+    """Liczba z CSV - całkowite zostają int, jak w odpowiedziach API."""
+    return float(tekst) if '.' in tekst else int(tekst)
+
+
+class ProduktLokalny:
+    """Produkt z listy lokalnej. Dostęp także przez produkt['nazwa'], jak do słownika."""
+
+    __slots__ = ('id', 'nazwa', 'nazwa_szukaj', 'kategoria', 'kalorie', 'bialko', 'weglowodany', 'tluszcze')
+
+    def __init__(self, id, nazwa, nazwa_szukaj, kategoria, kalorie, bialko, weglowodany, tluszcze):
+        self.id = id
+        self.nazwa = nazwa
+        self.nazwa_szukaj = nazwa_szukaj
+        self.kategoria = kategoria
+        self.kalorie = liczba(kalorie)
+        self.bialko = liczba(bialko)
+        self.weglowodany = liczba(weglowodany)
+        self.tluszcze = liczba(tluszcze)
+
+    def __getitem__(self, klucz):
+        return getattr(self, klucz)
+
+    def jako_slownik(self):
+        """Zwraca produkt w formacie odpowiedzi API."""
+        return {
+            'id': self.id,
+            'nazwa': self.nazwa,
+            'kalorie': self.kalorie,
+            'bialko': self.bialko,
+            'weglowodany': self.weglowodany,
+            'tluszcze': self.tluszcze,
+        }
+
+
+class DaneLokalne:
+    """Wczytana lista lokalna razem z indeksami do wyszukiwania."""
+
+    def __init__(self, produkty, wersja):
+        self.produkty = produkty
+        self.wersja = wersja
+        self.po_id = {p.id: p for p in produkty}
+        self.po_nazwie = {p.nazwa: p for p in produkty}
+        self.indeks = IndeksNazw(())
+        for p in produkty:
+            self.indeks.dodaj(p, p.nazwa_szukaj)
+
+
+@lru_cache(maxsize=None)
+def dane_lokalne(plik: Path = PLIK) -> DaneLokalne:
+    """Wczytuje listę lokalną (raz na proces)."""
+    tresc = plik.read_bytes()
+    wiersze = csv.reader(tresc.decode('utf-8').splitlines())
+    next(wiersze)  # nagłówek
+    produkty = [ProduktLokalny(*wiersz) for wiersz in wiersze if wiersz]
+    return DaneLokalne(produkty, hashlib.sha1(tresc).hexdigest()[:12])
@@ -3,7 +3,7 @@ Skrypt dodający przykładowe produkty do bazy danych.
 Uruchom raz, żeby wypełnić bazę podstawowymi produktami.
 """
 
-from kalorie import init_db, dodaj_produkt
+from kalorie import init_db, zapisz_produkty, wypisz_raport
 
 # Inicjalizacja bazy
 init_db()
@@ -54,7 +54,6 @@ produkty = [
 
 print("Dodawanie przykładowych produktów...\n")
 
-for produkt in produkty:
-    dodaj_produkt(*produkt)
+wypisz_raport(zapisz_produkty(produkty))
 
 print("\nGotowe! Możesz teraz uruchomić: python kalorie.py")
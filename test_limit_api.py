@@ -0,0 +1,116 @@
+"""
+Testy zapytań do Open Food Facts: limit zapytań wspólny dla workerów, łączenie
+równoległych identycznych zapytań i odpowiedź bez API po wyczerpaniu limitu.
+
+API zastępuje serwer-atrapa z benchmark.py, który liczy otrzymane zapytania.
+Uruchom: python -m pytest -q
+"""
+
+import subprocess
+import sys
+import threading
+import time
+from pathlib import Path
+
+import pytest
+
+# Import benchmarku ustawia tymczasową bazę (KALORIE_DB) przed importem aplikacji
+from benchmark import StubOpenFoodFacts
+
+import app
+import kalorie
+from openfoodfacts import KlientOpenFoodFacts, LimitPrzekroczony
+
+
+@pytest.fixture
+def stub():
+    serwer = StubOpenFoodFacts(opoznienie=0.2)
+    yield serwer
+    serwer.zatrzymaj()
+
+
+@pytest.fixture(autouse=True)
+def czysta_baza():
+    """Każdy test zaczyna z pełnymi limitami i pustym cache odpowiedzi API."""
+    conn = kalorie.get_connection()
+    with conn:
+        conn.execute("DELETE FROM limity_api")
+        conn.execute("DELETE FROM cache_api")
+
+
+@pytest.fixture
+def api(stub, monkeypatch):
+    """Aplikacja pytająca atrapę API, bez limitu zapytań (testy ustawiają własny)."""
+    monkeypatch.setattr(app, 'klient_off', KlientOpenFoodFacts(adres=stub.adres))
+    monkeypatch.setitem(app.LIMITY_API, 'szukaj', 0)
+    return stub
+
+
+@pytest.fixture
+def klient():
+    klient = app.app.test_client()
+    with klient.session_transaction() as sesja:
+        sesja['zalogowany'] = True
+        sesja['uzytkownik'] = 'test'
+    return klient
+
+
+def test_wiadro_wspolne_dla_procesow():
+    # Kilka procesów naraz nie dostanie więcej żetonów, niż mieści się w wiadrze
+    kod = "import kalorie; print(sum(kalorie.pobierz_zeton('test', 0, 30) for _ in range(50)))"
+    procesy = [subprocess.Popen([sys.executable, '-c', kod], cwd=Path(__file__).parent, stdout=subprocess.PIPE,
+                                text=True) for _ in range(4)]
+    assert sum(int(p.communicate()[0]) for p in procesy) == 30
+
+
+def test_wiadro_uzupelnia_sie_w_czasie():
+    assert kalorie.pobierz_zeton('test', 1000, 1)
+    assert not kalorie.pobierz_zeton('test', 0, 1)
+    time.sleep(0.01)
+    assert kalorie.pobierz_zeton('test', 1000, 1)  # 1000 żetonów/s - po chwili znowu jest żeton
+
+
+def test_rownolegle_identyczne_zapytania_laczone(api):
+    watki = 20
+    bariera = threading.Barrier(watki)
+    wyniki = []
+
+    def szukaj():
+        bariera.wait()
+        wyniki.append(app.wyszukaj_w_api('jabłko'))
+
+    lista = [threading.Thread(target=szukaj) for _ in range(watki)]
+    for w in lista:
+        w.start()
+    for w in lista:
+        w.join()
+
+    assert api.zapytania == 1
+    assert len(wyniki) == watki and all(w == wyniki[0] for w in wyniki)
+
+
+def test_po_wyczerpaniu_limitu_bez_zapytania_do_api(api, monkeypatch):
+    monkeypatch.setitem(app.LIMITY_API, 'szukaj', 1)
+    app.wyszukaj_w_api('gruszka')
+    with pytest.raises(LimitPrzekroczony):
+        app.wyszukaj_w_api('śliwka')
+    assert api.zapytania == 1
+
+
+def test_po_wyczerpaniu_limitu_przeterminowany_cache(api, monkeypatch):
+    monkeypatch.setitem(app.LIMITY_API, 'szukaj', 1)
+    produkty = app.wyszukaj_w_api('gruszka')
+    monkeypatch.setattr(app, 'CACHE_API_TTL', -1)  # każdy wpis jest już przeterminowany
+    assert app.wyszukaj_w_api('gruszka') == produkty
+    assert api.zapytania == 1
+
+
+def test_wyszukiwanie_po_wyczerpaniu_limitu_zwraca_wyniki_lokalne(api, klient, monkeypatch):
+    monkeypatch.setitem(app.LIMITY_API, 'szukaj', 1)
+    assert any(p['zrodlo'] == 'online' for p in klient.get('/api/szukaj?q=gruszka').get_json())
+
+    odpowiedz = klient.get('/api/szukaj?q=jabłko')
+    assert odpowiedz.status_code == 200
+    zrodla = {p['zrodlo'] for p in odpowiedz.get_json()}
+    assert 'lokalne' in zrodla and 'online' not in zrodla
+    assert api.zapytania == 1
@@ -0,0 +1,65 @@
+"""
+Testy startu aplikacji: migracje schematu można wykonać ponownie na tej samej bazie,
+a import aplikacji nie ładuje NumPy (ładowany dopiero przez obliczenia).
+
+Uruchom: python -m pytest -q
+"""
+
+import subprocess
+import sys
+from pathlib import Path
+
+import pytest
+
+# Import benchmarku ustawia tymczasową bazę (KALORIE_DB) przed importem aplikacji
+import benchmark  # noqa: F401
+
+import kalorie
+
+
+@pytest.fixture
+def nowa_baza(tmp_path, monkeypatch):
+    """Pusta baza w osobnym pliku, używana przez połączenie bieżącego wątku."""
+    kalorie.zamknij_polaczenie()
+    monkeypatch.setattr(kalorie, 'DB_PATH', tmp_path / 'migracje.db')
+    yield kalorie.get_connection()
+    kalorie.zamknij_polaczenie()
+
+
+def wyszukaj_fts(conn, fraza):
+    return [w[0] for w in conn.execute("SELECT rowid FROM produkty_fts WHERE produkty_fts MATCH ?", (f'"{fraza}"',))]
+
+
+def test_import_app_bez_numpy():
+    kod = "import sys, app; print('numpy' in sys.modules)"
+    wynik = subprocess.run([sys.executable, '-c', kod], cwd=Path(__file__).parent,
+                           capture_output=True, text=True, check=True)
+    assert wynik.stdout.split()[-1] == 'False', "NumPy nie powinien być ładowany przy starcie"
+
+
+def test_migracje_nowej_bazy(nowa_baza):
+    assert kalorie.migruj() == kalorie.WERSJA_SCHEMATU
+    assert kalorie.migruj() == 0
+    assert kalorie.wersja_schematu() == kalorie.WERSJA_SCHEMATU
+
+
+def test_migracje_bazy_bez_wersji(nowa_baza):
+    # Baza ze schematem, ale bez zapisanej wersji (np. utworzona przed PRAGMA user_version)
+    kalorie.migruj()
+    kalorie.dodaj_produkt("Żółty ser", 350, 25, 1, 28)
+    id_produktu, = nowa_baza.execute("SELECT id FROM produkty WHERE nazwa = 'Żółty ser'").fetchone()
+    nowa_baza.execute("PRAGMA user_version = 0")
+
+    assert kalorie.migruj() == kalorie.WERSJA_SCHEMATU
+    assert kalorie.migruj() == 0
+    assert wyszukaj_fts(nowa_baza, "zolty") == [id_produktu]
+
+    # Wyzwalacze po ponownych migracjach: jeden wpis indeksu na produkt, nazwa po zmianie
+    with nowa_baza:
+        nowa_baza.execute("INSERT INTO produkty (nazwa, kalorie, bialko, weglowodany, tluszcze, nazwa_szukaj) "
+                          "VALUES ('Śliwka', 46, 0.7, 11, 0.3, 'sliwka')")
+        nowa_baza.execute("UPDATE produkty SET nazwa = 'Ser gouda', nazwa_szukaj = 'ser gouda' WHERE id = ?",
+                          (id_produktu,))
+    assert nowa_baza.execute("SELECT count(*) FROM produkty_fts").fetchone()[0] == 2
+    assert wyszukaj_fts(nowa_baza, "sliwka") and wyszukaj_fts(nowa_baza, "gouda") == [id_produktu]
+    assert wyszukaj_fts(nowa_baza, "zolty") == []
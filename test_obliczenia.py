@@ -0,0 +1,94 @@
+"""
+Testy obliczeń na macierzach (obliczenia.py): sumy jadłospisów, filtr produktów
+i sumy tygodniowe dają to samo co liczenie porcja po porcji przez przelicz_porcje.
+
+Uruchom: python -m pytest -q
+"""
+
+import numpy as np
+import pytest
+
+# Import benchmarku ustawia tymczasową bazę (KALORIE_DB) przed importem aplikacji
+from benchmark import zasiej_produkty
+
+import kalorie
+from obliczenia import TabelaSkladnikow, sumy_tygodniowe
+
+
+@pytest.fixture(autouse=True)
+def produkty():
+    kalorie.init_db()
+    conn = kalorie.get_connection()
+    with conn:
+        conn.execute("DELETE FROM produkty")
+    zasiej_produkty(2000)
+
+
+@pytest.fixture
+def tabela():
+    return TabelaSkladnikow.z_bazy()
+
+
+def wiersze_produktow():
+    return kalorie.get_connection().execute(
+        "SELECT id, nazwa, kalorie, bialko, weglowodany, tluszcze FROM produkty").fetchall()
+
+
+def test_sumy_jak_petla(tabela):
+    los = np.random.default_rng(1)
+    liczba_grup, liczba = 50, 500
+    grupy = los.integers(0, liczba_grup, liczba)
+    ids = tabela.ids[los.integers(0, len(tabela), liczba)]
+    gramy = los.uniform(20, 300, liczba).round()
+
+    po_id, _ = kalorie.pobierz_produkty(ids=ids.tolist())
+    petla = [dict.fromkeys(kalorie.SKLADNIKI, 0.0) for _ in range(liczba_grup)]
+    for grupa, id_produktu, g in zip(grupy.tolist(), ids.tolist(), gramy.tolist()):
+        porcja = kalorie.przelicz_porcje(po_id[id_produktu][2:6], g)
+        for skladnik in kalorie.SKLADNIKI:
+            petla[grupa][skladnik] += porcja[skladnik]
+
+    dzienne = tabela.sumy(grupy, ids, gramy, liczba_grup)
+    assert dzienne.shape == (liczba_grup, len(kalorie.SKLADNIKI))
+    assert np.allclose(dzienne, [[s[skladnik] for skladnik in kalorie.SKLADNIKI] for s in petla])
+
+
+def test_porcje_i_jadlospis_jak_przelicz_porcje(tabela):
+    ids = tabela.ids[[0, 5, 17]]
+    gramy = [150, 35, 80]
+    po_id, _ = kalorie.pobierz_produkty(ids=ids.tolist())
+    oczekiwane = [list(kalorie.przelicz_porcje(po_id[i][2:6], g).values()) for i, g in zip(ids.tolist(), gramy)]
+
+    assert np.allclose(tabela.porcje(ids, gramy), oczekiwane)
+    assert np.allclose(tabela.jadlospis(ids, [gramy]), [np.sum(oczekiwane, axis=0)])
+
+
+def test_nieznane_id_produktu(tabela):
+    with pytest.raises(KeyError):
+        tabela.porcje([int(tabela.ids.max()) + 1], [100])
+
+
+@pytest.mark.parametrize('gramy', [100, 50])
+def test_pasujace_jak_petla(tabela, gramy):
+    mnoznik = gramy / 100
+    oczekiwane = [w[0] for w in wiersze_produktow() if w[2] * mnoznik <= 300 and w[3] * mnoznik >= 20]
+    assert sorted(tabela.pasujace(300, 20, gramy).tolist()) == sorted(oczekiwane)
+
+
+def test_pusta_tabela():
+    conn = kalorie.get_connection()
+    with conn:
+        conn.execute("DELETE FROM produkty")
+    tabela = TabelaSkladnikow.z_bazy()
+    assert len(tabela) == 0 and len(tabela.pasujace(300)) == 0
+    assert tabela.sumy([], [], []).shape == (0, len(kalorie.SKLADNIKI))
+
+
+@pytest.mark.parametrize('dni', [7, 10, 14])
+def test_sumy_tygodniowe(dni):
+    dzienne = np.random.default_rng(2).uniform(0, 100, (3, dni, len(kalorie.SKLADNIKI)))
+    tygodniowe = sumy_tygodniowe(dzienne)
+
+    assert tygodniowe.shape == (3, -(-dni // 7), len(kalorie.SKLADNIKI))
+    for tydzien in range(tygodniowe.shape[1]):
+        assert np.allclose(tygodniowe[:, tydzien], dzienne[:, tydzien * 7:(tydzien + 1) * 7].sum(axis=1))
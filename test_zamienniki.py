@@ -0,0 +1,113 @@
+"""
+Testy wyszukiwania zamienników: drzewo k-d i indeks ZamiennikiProduktow dają tych
+samych najbliższych sąsiadów co przegląd wszystkich punktów, także po dopisaniu,
+zmianie i usunięciu produktów.
+
+Uruchom: python -m pytest -q
+"""
+
+import numpy as np
+import pytest
+
+# Import benchmarku ustawia tymczasową bazę (KALORIE_DB) przed importem aplikacji
+from benchmark import zasiej_produkty
+
+import kalorie
+from obliczenia import SKALA_ODLEGLOSCI, DrzewoKD, ZamiennikiProduktow
+
+
+def przeglad(punkty, punkt, k):
+    """Kwadraty odległości k najbliższych punktów - przegląd wszystkich."""
+    return np.sort(((punkty - punkt) ** 2).sum(axis=1))[:k]
+
+
+def punkty_indeksu(indeks):
+    return np.concatenate((indeks.punkty, indeks.dopisane_punkty))
+
+
+@pytest.fixture(autouse=True)
+def produkty():
+    kalorie.init_db()
+    conn = kalorie.get_connection()
+    with conn:
+        conn.execute("DELETE FROM produkty")
+    zasiej_produkty(2000)
+
+
+@pytest.mark.parametrize('k', [0, 1, 10, 100, 5000])
+def test_drzewo_jak_przeglad(k):
+    los = np.random.default_rng(1)
+    # Powtórzone punkty - liście z jednakowymi współrzędnymi
+    punkty = np.concatenate((los.random((3000, 4)), np.zeros((200, 4))))
+    drzewo = DrzewoKD(punkty)
+    for punkt in los.random((20, 4)) * 1.2 - 0.1:
+        odleglosci, numery = drzewo.najblizsze(punkt, k)
+        assert np.allclose(odleglosci, przeglad(punkty, punkt, k))
+        assert np.allclose(((punkty[numery] - punkt) ** 2).sum(axis=1), odleglosci)
+
+
+def test_pusty_zbior_punktow():
+    odleglosci, numery = DrzewoKD(np.empty((0, 4))).najblizsze(np.zeros(4), 5)
+    assert len(odleglosci) == len(numery) == 0
+
+
+def test_zamienniki_jak_przeglad():
+    indeks = ZamiennikiProduktow.z_bazy()
+    los = np.random.default_rng(2)
+    for wartosci in los.random((20, 4)) * [900, 40, 80, 50]:
+        odleglosci = [o for o, _ in indeks.najblizsze(wartosci, 10)]
+        oczekiwane = np.sqrt(przeglad(indeks.punkty, wartosci / SKALA_ODLEGLOSCI, 10))
+        assert np.allclose(odleglosci, oczekiwane)
+
+
+def test_zamienniki_z_kategorii():
+    indeks = ZamiennikiProduktow.z_bazy()
+    najblizsze = indeks.najblizsze([100, 10, 10, 10], 10, 'test')
+    assert len(najblizsze) == 10 and all(isinstance(p, int) for _, p in najblizsze)
+    assert indeks.najblizsze([100, 10, 10, 10], 10, 'brak takiej kategorii') == []
+
+
+def test_dopisane_produkty_bez_przebudowy():
+    indeks = ZamiennikiProduktow.z_bazy()
+    conn = kalorie.get_connection()
+    with conn:
+        conn.executemany("""
+            INSERT INTO produkty (nazwa, kalorie, bialko, weglowodany, tluszcze, kategoria, nazwa_szukaj)
+            VALUES (?, ?, ?, ?, ?, 'test', ?)
+        """, ((f"Zamiennik {i}", 1000 + i, i % 40, i % 80, i % 50, f"zamiennik {i}") for i in range(100)))
+
+    nowy = indeks.aktualizuj()
+    assert len(nowy.dopisane) == 100
+    assert nowy.drzewa is indeks.drzewa
+
+    for wartosci in ([5, 5, 5, 5], [950, 20, 40, 25], [1050, 10, 10, 10]):
+        odleglosci = [o for o, _ in nowy.najblizsze(wartosci, 10)]
+        oczekiwane = np.sqrt(przeglad(punkty_indeksu(nowy), np.asarray(wartosci) / SKALA_ODLEGLOSCI, 10))
+        assert np.allclose(odleglosci, oczekiwane)
+    # Dopisany produkt o dokładnie tych wartościach jest najbliższy (kalorie spoza zasianych)
+    (odleglosc, id_produktu), = nowy.najblizsze([1007, 7, 7, 7], 1)
+    assert odleglosc == 0 and id_produktu == int(nowy.dopisane[7])
+
+
+def test_zmiana_produktu_przebudowuje_indeks():
+    indeks = ZamiennikiProduktow.z_bazy()
+    conn = kalorie.get_connection()
+    id_produktu = int(indeks.ids[0])
+    with conn:
+        conn.execute("UPDATE produkty SET kalorie = 5000 WHERE id = ?", (id_produktu,))
+
+    nowy = indeks.aktualizuj()
+    assert nowy.drzewa is not indeks.drzewa and len(nowy.dopisane) == 0
+    assert nowy.najblizsze([5000, 0, 0, 0], 1)[0][1] == id_produktu
+
+
+def test_usuniecie_produktu_przebudowuje_indeks():
+    indeks = ZamiennikiProduktow.z_bazy()
+    conn = kalorie.get_connection()
+    id_produktu = int(indeks.ids[0])
+    with conn:
+        conn.execute("DELETE FROM produkty WHERE id = ?", (id_produktu,))
+
+    nowy = indeks.aktualizuj()
+    assert len(nowy) == len(indeks) - 1
+    assert id_produktu not in nowy.ids.tolist()